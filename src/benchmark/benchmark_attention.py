@@ -0,0 +1,71 @@
+import argparse
+import itertools
+
+import torch
+
+from src.benchmark.utils import time_fn, peak_rss_mb, environment, run_isolated, write_report
+from src.compat import inference_mode
+from src.export.onnx_export import example_inputs
+from src.models.axial_attention.axial_attention import ATTENTION_BACKENDS, SelfAttention
+from src.models.basic_pga.basic_pga_parts import PropAttention
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Speed and memory of the softmax and linear attention kernels '
+                                                 'against sequence length.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-l', '--lengths', metavar='L', type=int, nargs='+', default=[64, 128, 256, 512, 1024, 2048],
+                        help='Sequence lengths, the axis length for SelfAttention and the crop for PropAttention.',
+                        dest='lengths')
+    parser.add_argument('-a', '--attentions', metavar='A', type=str, nargs='+', default=['self', 'prop'],
+                        help='Attention modules to benchmark.', dest='attentions', choices=['self', 'prop'])
+    parser.add_argument('--backends', metavar='K', type=str, nargs='+', default=list(ATTENTION_BACKENDS),
+                        help='Attention kernels to compare.', dest='backends', choices=list(ATTENTION_BACKENDS))
+    parser.add_argument('--sequences', dest='sequences', type=int, default=64,
+                        help='Sequences per SelfAttention call, the rows or columns of an image.')
+    parser.add_argument('--dim', dest='dim', type=int, default=64,
+                        help='Channels of the attended tokens.')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=1,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=5,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_attention.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_attention(attention, backend, length, sequences=64, dim=64, warmup=1, repeats=5):
+    '''One kernel and length in its own process, so the peak RSS belongs to it'''
+    torch.manual_seed(0)
+    result = {'attention': attention, 'backend': backend, 'length': length}
+    if attention == 'self':
+        module = SelfAttention(dim, heads=2, backend=backend).eval()
+        inputs = (torch.randn(sequences, length, dim),)
+    else:
+        module = PropAttention(dim, heads=2, img_crop=length, backend=backend).eval()
+        _, obj_index, bg_index = example_inputs('only_pga', length)
+        inputs = (torch.randn(1, dim, length, length), obj_index, bg_index)
+    try:
+        with inference_mode():
+            result['forward_ms'] = time_fn(lambda: module(*inputs), warmup, repeats)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+        return result
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+if __name__ == '__main__':
+    args = get_args()
+    jobs = [(attention, backend, length, args.sequences, args.dim, args.warmup, args.repeats)
+            for attention, length, backend in itertools.product(args.attentions, args.lengths, args.backends)]
+    results = run_isolated(bench_attention, jobs)
+
+    for r in results:
+        if 'error' in r:
+            print(f"{r['attention']:>4} {r['backend']:>7} t={r['length']:<5}: {r['error']}")
+        else:
+            print(f"{r['attention']:>4} {r['backend']:>7} t={r['length']:<5}: {r['forward_ms']['mean']:.1f} ms, "
+                  f"peak rss {r['peak_rss_mb']:.0f} MB")
+    write_report(args.output, {'environment': environment(), 'sequences': args.sequences, 'dim': args.dim,
+                               'results': results})
@@ -0,0 +1,47 @@
+import argparse
+import itertools
+
+from src.benchmark.benchmark_models import bench_model
+from src.benchmark.utils import environment, run_isolated, write_report
+from src.models.registry import MODELS
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='CPU speed of every model in channels last against NCHW layout.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(MODELS),
+                        help='Models to benchmark.', dest='models')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-t', '--threads', metavar='T', type=int, default=0,
+                        help='Torch intra-op threads, 0 keeps the default.', dest='threads')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_channels_last.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    configs = list(itertools.product(args.models, args.crops, [False, True]))
+    jobs = [(name, args.batchsize, crop, 'cpu', args.warmup, args.repeats, args.threads, 3, 3, channels_last)
+            for name, crop, channels_last in configs]
+    results = [dict(r, channels_last=channels_last)
+               for r, (_, _, channels_last) in zip(run_isolated(bench_model, jobs), configs)]
+
+    by_key = {(r['model'], r['crop'], r['channels_last']): r for r in results}
+    for name, crop in itertools.product(args.models, args.crops):
+        nchw, nhwc = by_key[(name, crop, False)], by_key[(name, crop, True)]
+        if 'error' in nchw or 'error' in nhwc:
+            print(f"{name:>24} c={crop}: {nchw.get('error') or nhwc.get('error')}")
+            continue
+        print(f"{name:>24} c={crop}: forward {nchw['forward_ms']['mean']:.1f} -> {nhwc['forward_ms']['mean']:.1f} ms "
+              f"(x{nchw['forward_ms']['mean'] / nhwc['forward_ms']['mean']:.2f}), forward+backward "
+              f"{nchw['forward_backward_ms']['mean']:.1f} -> {nhwc['forward_backward_ms']['mean']:.1f} ms "
+              f"(x{nchw['forward_backward_ms']['mean'] / nhwc['forward_backward_ms']['mean']:.2f})")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,87 @@
+import argparse
+import itertools
+
+import torch
+import torch.nn.functional as F
+
+from src.benchmark.memory import MemoryProfiler
+from src.benchmark.utils import time_fn, peak_rss_mb, environment, run_isolated, write_report
+from src.export.onnx_export import example_inputs
+from src.models.axial_unet.axial_unet import AxialUnet
+from src.models.basic_pga.basic_pga_net import BigOnlyPGA
+from src.models.checkpoint import set_checkpointing
+from src.models.lbcnn.axial_lbcnn import AxialUNetLBC, LargeAxialLBC
+
+CHECKPOINT_MODELS = {
+    'large_axial_lbc': lambda crop: LargeAxialLBC(3, 3, 32),
+    'axial_lbc_unet': lambda crop: AxialUNetLBC(3, 3, 32),
+    'axial_unet_pos': lambda crop: AxialUnet(3, 3, 32, img_crop=crop),
+    'big_only_pga': lambda crop: BigOnlyPGA(3, 3, 32, img_crop=crop),
+}
+
+# name: (checkpoint attention, checkpointed segments of the flat block stacks)
+SETTINGS = {'none': (False, 0), 'attention': (True, 0), 'segments_4': (False, 4), 'segments_2': (False, 2)}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Peak memory against training step time with activation '
+                                                 'checkpointing.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(CHECKPOINT_MODELS),
+                        help='Models to benchmark.', dest='models', choices=list(CHECKPOINT_MODELS))
+    parser.add_argument('-s', '--settings', metavar='S', type=str, nargs='+', default=list(SETTINGS),
+                        help='Checkpointing settings to compare.', dest='settings', choices=list(SETTINGS))
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 384, 512],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=1,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=3,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_checkpoint.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_setting(name, setting, crop, warmup=1, repeats=3):
+    '''One training configuration in its own process, so the peak RSS belongs to it'''
+    torch.manual_seed(0)
+    result = {'model': name, 'setting': setting, 'crop': crop}
+    attention, segments = SETTINGS[setting]
+    net = set_checkpointing(CHECKPOINT_MODELS[name](crop), attention=attention, segments=segments).train()
+    # the PGA models take the routing index next to the image, AxialUnet embeds channels last images
+    inputs = example_inputs('only_pga' if 'pga' in name else name, crop)
+    if name == 'axial_unet_pos':
+        inputs = (inputs[0].permute(0, 2, 3, 1),)
+    target = torch.randint(0, 3, (1, crop, crop))
+
+    def train_step():
+        net.zero_grad(set_to_none=True)
+        F.cross_entropy(net(*inputs), target).backward()
+
+    try:
+        profiler = MemoryProfiler(net).run(*inputs, loss_fn=lambda out: F.cross_entropy(out, target))
+        step = time_fn(train_step, warmup, repeats)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+        return result
+    saved = profiler.totals['saved_bytes']
+    result.update({'saved_mb': None if saved is None else saved / 1024 ** 2, 'peak_rss_mb': peak_rss_mb(),
+                   'step_ms': step})
+    return result
+
+
+if __name__ == '__main__':
+    args = get_args()
+    jobs = [(name, setting, crop, args.warmup, args.repeats)
+            for name, crop, setting in itertools.product(args.models, args.crops, args.settings)
+            if not (SETTINGS[setting][1] and name not in ('large_axial_lbc', 'big_only_pga'))]
+    results = run_isolated(bench_setting, jobs)
+
+    for r in results:
+        if 'error' in r:
+            print(f"{r['model']:>16} {r['setting']:>10} c={r['crop']}: {r['error']}")
+        else:
+            saved = 'n/a' if r['saved_mb'] is None else f"{r['saved_mb']:.0f} MB"
+            print(f"{r['model']:>16} {r['setting']:>10} c={r['crop']}: saved for backward {saved}, "
+                  f"peak rss {r['peak_rss_mb']:.0f} MB, step {r['step_ms']['mean']:.0f} ms")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,75 @@
+import argparse
+import itertools
+
+import torch
+
+from src.benchmark.utils import time_fn, peak_rss_mb, environment, run_isolated, write_report
+from src.compat import inference_mode
+from src.export.fuse_dsc import fuse_dsc
+from src.models.registry import get_model
+
+DSC_MODELS = ['dsc_unet', 'small_dsc_unet', 'dsc_lbc_unet', 'small_dsc_lbc_unet']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='CPU latency and memory of the eager against the fused DSC models.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=DSC_MODELS,
+                        help='Models to benchmark.', dest='models', choices=DSC_MODELS)
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 512],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-t', '--threads', metavar='T', type=int, default=0,
+                        help='Torch intra-op threads, 0 keeps the default.', dest='threads')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_dsc.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_variant(name, variant, crop, warmup=3, repeats=10, threads=0):
+    '''Forward latency and peak memory of one variant, run in its own process so peak RSS is its own'''
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    net = get_model(name).eval()
+    imgs = torch.randn(1, 3, crop, crop)
+    if variant == 'fused':
+        net = fuse_dsc(net)
+        imgs = imgs.contiguous(memory_format=torch.channels_last)
+
+    with inference_mode():
+        forward = time_fn(lambda: net(imgs), warmup, repeats)
+    return {'model': name, 'variant': variant, 'crop': crop, 'forward_ms': forward, 'peak_rss_mb': peak_rss_mb()}
+
+
+def parity(name, crop=64):
+    torch.manual_seed(0)
+    net = get_model(name)
+    # give the batch norms statistics so folding them is not trivially exact
+    net.train()
+    with torch.no_grad():
+        for _ in range(3):
+            net(torch.randn(2, 3, crop, crop) * 2 + 1)
+    net.eval()
+    imgs = torch.randn(1, 3, crop, crop)
+    with inference_mode():
+        return (net(imgs) - fuse_dsc(net)(imgs)).abs().max().item()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    jobs = [(name, variant, crop, args.warmup, args.repeats, args.threads)
+            for name, crop, variant in itertools.product(args.models, args.crops, ['eager', 'fused'])]
+    results = run_isolated(bench_variant, jobs)
+    diffs = {name: parity(name) for name in args.models}
+
+    by_key = {(r['model'], r['crop'], r['variant']): r for r in results}
+    for name, crop in itertools.product(args.models, args.crops):
+        eager, fused = by_key[(name, crop, 'eager')], by_key[(name, crop, 'fused')]
+        print(f"{name:>20} crop={crop}: eager {eager['forward_ms']['mean']:.1f} ms {eager['peak_rss_mb']:.0f} MB, "
+              f"fused {fused['forward_ms']['mean']:.1f} ms {fused['peak_rss_mb']:.0f} MB, "
+              f"x{eager['forward_ms']['mean'] / fused['forward_ms']['mean']:.2f}, max diff {diffs[name]:.1e}")
+    write_report(args.output, {'environment': environment(), 'results': results, 'max_abs_diff': diffs})
@@ -0,0 +1,78 @@
+import argparse
+import itertools
+import os
+import tempfile
+import time
+
+import torch
+
+from src.benchmark.utils import time_fn, environment, run_isolated, write_report
+from src.compat import inference_mode
+
+VARIANTS = ('eager', 'torchscript', 'compile')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Startup time and steady state latency of eager, TorchScript and '
+                                                 'torch.compile models on CPU.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+',
+                        default=['unet', 'small_dsc_unet', 'small_lbc_unet', 'small_axial_lbc_unet'],
+                        help='Models to benchmark.', dest='models')
+    parser.add_argument('-v', '--variants', metavar='V', type=str, nargs='+', default=list(VARIANTS),
+                        help='Execution modes to compare.', dest='variants', choices=VARIANTS)
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the input images.')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations after the first call before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_export.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_variant(name, variant, crop, artifact, warmup=3, repeats=10):
+    """
+    Runs in a fresh process.  Startup covers everything from an empty process with torch imported to the first output:
+    importing the model code and building the model for eager and compile, loading the artifact for TorchScript, and
+    the first call, which is where torch.compile compiles and the TorchScript executor optimises.
+    """
+    imgs = torch.randn(1, 3, crop, crop)
+    start = time.perf_counter()
+    if variant == 'torchscript':
+        from src.export.runtime import load_artifact
+        net, _ = load_artifact(artifact)
+    else:
+        from src.models.registry import get_model
+        net = get_model(name).eval()
+        if variant == 'compile':
+            from src.export.compile import compile_model
+            net = compile_model(net)
+
+    with inference_mode():
+        net(imgs)
+        startup_ms = (time.perf_counter() - start) * 1000
+        forward = time_fn(lambda: net(imgs), warmup, repeats)
+    return {'model': name, 'variant': variant, 'crop': crop, 'startup_ms': startup_ms, 'forward_ms': forward}
+
+
+if __name__ == '__main__':
+    args = get_args()
+    from src.export.compile import export_torchscript
+    from src.models.registry import get_model
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        artifacts = {}
+        for name in args.models:
+            artifacts[name] = os.path.join(artifact_dir, f'{name}.pt')
+            export_torchscript(get_model(name), artifacts[name], metadata={'model': name, 'crop': args.crop})
+
+        jobs = [(name, variant, args.crop, artifacts[name], args.warmup, args.repeats)
+                for name, variant in itertools.product(args.models, args.variants)]
+        results = run_isolated(bench_variant, jobs)
+
+    for r in results:
+        print(f"{r['model']:>24} {r['variant']:>12}: startup {r['startup_ms']:.0f} ms, "
+              f"forward {r['forward_ms']['mean']:.1f} ms")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,67 @@
+import argparse
+import itertools
+
+import torch
+
+from src.benchmark.utils import time_fn, environment, write_report
+from src.compat import inference_mode
+from src.models.lbcnn.lbcnn_parts import BlockLBP, BlockLBPUNet, set_lbp_mode
+from src.models.registry import get_model
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark dense against sparse ternary LBP convolutions on CPU.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[64, 128, 256],
+                        help='Height and width of the inputs.', dest='crops')
+    parser.add_argument('-ch', '--channels', metavar='CH', type=int, default=64,
+                        help='Channels of the single block benchmarks.', dest='channels')
+    parser.add_argument('-sp', '--sparsities', metavar='S', type=float, nargs='+', default=[0.5, 0.1],
+                        help='Fraction of non zero LBP weights for the single block benchmarks.', dest='sparsities')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_lbp.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def compare_modes(net, imgs, warmup, repeats):
+    net.eval()
+    times = {}
+    with inference_mode():
+        set_lbp_mode(net, 'dense')
+        dense_out = net(imgs)
+        times['dense_ms'] = time_fn(lambda: net(imgs), warmup, repeats)
+        set_lbp_mode(net, 'sparse')
+        sparse_out = net(imgs)
+        times['sparse_ms'] = time_fn(lambda: net(imgs), warmup, repeats)
+    set_lbp_mode(net, 'dense')
+    times['max_abs_diff'] = (dense_out - sparse_out).abs().max().item()
+    times['speedup'] = times['dense_ms']['mean'] / times['sparse_ms']['mean']
+    return times
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(0)
+    results = []
+
+    blocks = {'BlockLBP': BlockLBP, 'BlockLBPUNet': BlockLBPUNet}
+    for (name, block), sparsity, crop in itertools.product(blocks.items(), args.sparsities, args.crops):
+        net = block(args.channels, args.channels, sparsity=sparsity)
+        imgs = torch.randn(1, args.channels, crop, crop)
+        results.append({'net': name, 'sparsity': sparsity, 'crop': crop,
+                        **compare_modes(net, imgs, args.warmup, args.repeats)})
+
+    for name, crop in itertools.product(['lbc_unet', 'small_lbc_unet'], args.crops):
+        net = get_model(name)
+        imgs = torch.randn(1, 3, crop, crop)
+        results.append({'net': name, 'sparsity': 0.5, 'crop': crop,
+                        **compare_modes(net, imgs, args.warmup, args.repeats)})
+
+    for r in results:
+        print(f"{r['net']:>16} sparsity={r['sparsity']} crop={r['crop']}: dense {r['dense_ms']['mean']:.2f} ms, "
+              f"sparse {r['sparse_ms']['mean']:.2f} ms, x{r['speedup']:.2f}, max diff {r['max_abs_diff']:.1e}")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,113 @@
+import argparse
+import itertools
+import json
+
+import torch
+import torch.nn.functional as F
+
+from src.benchmark.utils import (time_fn, sync_for, peak_rss_mb, count_parameters, environment, run_isolated,
+                                 write_report)
+from src.compat import inference_mode
+from src.models.registry import MODELS, get_model, model_logits
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark forward and training step latency of registered models.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(MODELS),
+                        help='Models to benchmark.', dest='models')
+    parser.add_argument('-b', '--batch-sizes', metavar='B', type=int, nargs='+', default=[1, 4],
+                        help='Batch sizes to benchmark.', dest='batch_sizes')
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 512],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-t', '--threads', metavar='T', type=int, default=0,
+                        help='Torch intra-op threads, 0 keeps the default.', dest='threads')
+    parser.add_argument('-dev', '--device', dest='device', type=str, default='cpu',
+                        help='Benchmark on gpu vs cpu.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_models.json',
+                        help='Path of the JSON report.', dest='output')
+    parser.add_argument('--compare', metavar='P', type=str, default=None,
+                        help='Previous report to compare the new results against.', dest='compare')
+    return parser.parse_args()
+
+
+def bench_model(name, batch_size, crop, device='cpu', warmup=3, repeats=10, threads=0, n_channels=3, n_classes=3,
+                channels_last=False):
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    result = {'model': name, 'batch_size': batch_size, 'crop': crop}
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    try:
+        net = get_model(name, n_channels, n_classes).to(device=device, memory_format=memory_format)
+        imgs = torch.randn(batch_size, n_channels, crop, crop, device=device).contiguous(memory_format=memory_format)
+        target = torch.randint(0, n_classes, (batch_size, crop, crop), device=device)
+        sync = sync_for(device)
+
+        def train_step():
+            net.zero_grad(set_to_none=True)
+            loss = F.cross_entropy(model_logits(net(imgs)), target)
+            loss.backward()
+
+        net.eval()
+        with inference_mode():
+            forward = time_fn(lambda: net(imgs), warmup, repeats, sync)
+        net.train()
+        forward_backward = time_fn(train_step, warmup, repeats, sync)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+        return result
+
+    result.update({
+        'parameters': count_parameters(net),
+        'forward_ms': forward,
+        'forward_backward_ms': forward_backward,
+        'inference_img_per_s': batch_size * 1000 / forward['mean'],
+        'train_img_per_s': batch_size * 1000 / forward_backward['mean'],
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    if str(device).startswith('cuda'):
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+    return result
+
+
+def result_key(result):
+    return result['model'], result['batch_size'], result['crop']
+
+
+def compare(old_report, new_report, metrics=('forward_ms', 'forward_backward_ms')):
+    '''Ratio new / old of the mean latency of every configuration present in both reports'''
+    old = {result_key(r): r for r in old_report['results']}
+    rows = []
+    for new in new_report['results']:
+        prev = old.get(result_key(new))
+        if prev is None or 'error' in prev or 'error' in new:
+            continue
+        rows.append((*result_key(new), *[new[m]['mean'] / prev[m]['mean'] for m in metrics]))
+    return rows
+
+
+if __name__ == '__main__':
+    args = get_args()
+    jobs = [(name, batch_size, crop, args.device, args.warmup, args.repeats, args.threads)
+            for name, batch_size, crop in itertools.product(args.models, args.batch_sizes, args.crops)]
+    results = run_isolated(bench_model, jobs)
+    report = {'environment': environment(), 'results': sorted(results, key=result_key)}
+    write_report(args.output, report)
+
+    for r in report['results']:
+        if 'error' in r:
+            print(f"{r['model']:>24} b={r['batch_size']} c={r['crop']}: {r['error']}")
+        else:
+            print(f"{r['model']:>24} b={r['batch_size']} c={r['crop']}: forward {r['forward_ms']['mean']:.1f} ms, "
+                  f"forward+backward {r['forward_backward_ms']['mean']:.1f} ms, peak rss {r['peak_rss_mb']:.0f} MB")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        for name, batch_size, crop, forward, forward_backward in compare(old_report, report):
+            print(f'{name:>24} b={batch_size} c={crop}: forward x{forward:.2f}, forward+backward x{forward_backward:.2f}')
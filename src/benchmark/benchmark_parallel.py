@@ -0,0 +1,66 @@
+import argparse
+import itertools
+
+import torch
+
+from src.benchmark.utils import time_fn, environment, run_isolated, write_report
+from src.compat import inference_mode
+from src.export.onnx_export import build_model, example_inputs
+from src.models.parallel import set_branch_workers, set_parallel_branches
+
+PARALLEL_MODELS = ['small_axial_lbc_unet', 'axial_lbc_unet', 'axial_unet', 'basic_axial_pga']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='CPU inference latency with the independent branches of the blocks '
+                                                 'run concurrently against one after the other.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=PARALLEL_MODELS,
+                        help='Models to benchmark.', dest='models')
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('-t', '--threads', metavar='T', type=int, nargs='+', default=[1, 2, 4],
+                        help='Torch intra-op threads per run.', dest='threads')
+    parser.add_argument('--workers', dest='workers', type=int, default=2,
+                        help='Threads the extra branches run on besides the calling thread.')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=3,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_parallel.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_parallel(name, crop, threads, parallel, workers=2, warmup=3, repeats=10):
+    torch.manual_seed(0)
+    torch.set_num_threads(threads)
+    set_branch_workers(workers)
+    result = {'model': name, 'crop': crop, 'threads': threads, 'parallel': parallel}
+    net = set_parallel_branches(build_model(name, crop=crop), parallel).eval()
+    inputs = example_inputs(name, crop)
+    try:
+        with inference_mode():
+            result['forward_ms'] = time_fn(lambda: net(*inputs), warmup, repeats)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+    return result
+
+
+if __name__ == '__main__':
+    args = get_args()
+    configs = list(itertools.product(args.models, args.crops, args.threads, [False, True]))
+    jobs = [(name, crop, threads, parallel, args.workers, args.warmup, args.repeats)
+            for name, crop, threads, parallel in configs]
+    results = run_isolated(bench_parallel, jobs)
+
+    by_key = {(r['model'], r['crop'], r['threads'], r['parallel']): r for r in results}
+    for name, crop, threads in itertools.product(args.models, args.crops, args.threads):
+        sequential, parallel = by_key[(name, crop, threads, False)], by_key[(name, crop, threads, True)]
+        if 'error' in sequential or 'error' in parallel:
+            print(f"{name:>24} c={crop} t={threads}: {sequential.get('error') or parallel.get('error')}")
+            continue
+        before, after = sequential['forward_ms']['mean'], parallel['forward_ms']['mean']
+        print(f"{name:>24} c={crop} t={threads}: {before:.1f} -> {after:.1f} ms "
+              f"({100 * (before - after) / before:+.1f}% latency reduction)")
+    write_report(args.output, {'environment': environment(), 'workers': args.workers, 'results': results})
@@ -0,0 +1,86 @@
+import argparse
+import itertools
+
+import torch
+import torch.nn.functional as F
+
+from src.benchmark.utils import time_fn, peak_rss_mb, count_parameters, environment, run_isolated, write_report
+from src.compat import inference_mode
+from src.models.basic_pga.pga_unet import PGAUNet
+from src.models.lbcnn.axial_lbcnn import AxialUNetLBC
+
+UNET_MODELS = {
+    'pga_unet': lambda crop: PGAUNet(3, 3, 32, img_crop=crop),
+    'axial_lbc_unet': lambda crop: AxialUNetLBC(3, 3, 32),
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Speed and memory of the multi scale PGAUNet against AxialUNetLBC.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(UNET_MODELS),
+                        help='Models to benchmark.', dest='models', choices=list(UNET_MODELS))
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 512],
+                        help='Height and width of the input images, multiples of 16.', dest='crops')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=2,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=5,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_pga_unet.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def missing_grads(net):
+    '''Trainable parameters of `net` the last backward did not reach'''
+    return [name for name, p in net.named_parameters() if p.requires_grad and p.grad is None]
+
+
+def bench_unet(name, crop, batch_size=1, warmup=2, repeats=5):
+    torch.manual_seed(0)
+    result = {'model': name, 'crop': crop, 'batch_size': batch_size}
+    net = UNET_MODELS[name](crop)
+    imgs = torch.randn(batch_size, 3, crop, crop)
+    # a proposal map covering the top third of the image, PGAUNet pools it to every level
+    prop = torch.zeros(batch_size, 1, crop, crop)
+    prop[:, :, :crop // 3] = 1
+    inputs = (imgs, prop) if name == 'pga_unet' else (imgs,)
+    target = torch.randint(0, 3, (batch_size, crop, crop))
+
+    def train_step():
+        net.zero_grad(set_to_none=True)
+        F.cross_entropy(net(*inputs), target).backward()
+
+    try:
+        net.eval()
+        with inference_mode():
+            forward = time_fn(lambda: net(*inputs), warmup, repeats)
+        net.train()
+        forward_backward = time_fn(train_step, warmup, repeats)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+        return result
+    result.update({'parameters': count_parameters(net), 'forward_ms': forward,
+                   'forward_backward_ms': forward_backward, 'missing_grads': missing_grads(net),
+                   'peak_rss_mb': peak_rss_mb()})
+    return result
+
+
+if __name__ == '__main__':
+    args = get_args()
+    jobs = [(name, crop, args.batchsize, args.warmup, args.repeats)
+            for crop, name in itertools.product(args.crops, args.models)]
+    results = run_isolated(bench_unet, jobs)
+
+    for r in results:
+        if 'error' in r:
+            print(f"{r['model']:>16} c={r['crop']}: {r['error']}")
+        else:
+            print(f"{r['model']:>16} c={r['crop']}: forward {r['forward_ms']['mean']:.0f} ms, forward+backward "
+                  f"{r['forward_backward_ms']['mean']:.0f} ms, peak rss {r['peak_rss_mb']:.0f} MB, "
+                  f"{r['parameters']['total']} parameters")
+            if r['missing_grads']:
+                print(f"{'':>16} no gradient reached {', '.join(r['missing_grads'])}")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,69 @@
+import argparse
+import itertools
+
+import torch
+
+from src.benchmark.utils import time_fn, peak_rss_mb, environment, run_isolated, write_report
+from src.compat import inference_mode
+from src.models.axial_attention.axial_attention import set_attention_window
+from src.models.registry import get_model
+
+# the axial models without a fixed size positional embedding, so they run on any image size
+WINDOW_MODELS = ['small_axial_lbc_unet', 'axial_lbc_unet', 'axial_unet', 'small_axial_unet']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='CPU inference latency and memory of dense against windowed axial '
+                                                 'attention as the image grows.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=WINDOW_MODELS,
+                        help='Models to benchmark.', dest='models')
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 512, 1024, 2048],
+                        help='Height and width of the input images.', dest='crops')
+    parser.add_argument('--window', dest='window', type=int, default=64,
+                        help='Positions per attention window along each axis.')
+    parser.add_argument('--overlap', dest='overlap', type=int, default=16,
+                        help='Extra key positions on either side of a window.')
+    parser.add_argument('--dilation', dest='dilation', type=int, default=1,
+                        help='Stride between the positions of a window.')
+    parser.add_argument('-w', '--warmup', metavar='W', type=int, default=1,
+                        help='Untimed iterations before measuring.', dest='warmup')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=3,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='benchmark_window.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def bench_window(name, crop, window=0, overlap=0, dilation=1, warmup=1, repeats=3):
+    '''One model, image size and window in its own process, so the peak RSS belongs to it'''
+    torch.manual_seed(0)
+    result = {'model': name, 'crop': crop, 'window': window, 'overlap': overlap, 'dilation': dilation}
+    net = set_attention_window(get_model(name), window, overlap, dilation).eval()
+    imgs = torch.randn(1, 3, crop, crop)
+    try:
+        with inference_mode():
+            result['forward_ms'] = time_fn(lambda: net(imgs), warmup, repeats)
+    except RuntimeError as e:
+        result['error'] = str(e).split('\n')[0]
+        return result
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['ms_per_mpixel'] = result['forward_ms']['mean'] / (crop ** 2 / 1e6)
+    return result
+
+
+if __name__ == '__main__':
+    args = get_args()
+    windows = [(0, 0, 1), (args.window, args.overlap, args.dilation)]
+    jobs = [(name, crop, *window, args.warmup, args.repeats)
+            for name, crop, window in itertools.product(args.models, args.crops, windows)]
+    results = run_isolated(bench_window, jobs)
+
+    for r in results:
+        label = 'dense' if not r['window'] else f"window {r['window']}+{r['overlap']}x{r['dilation']}"
+        if 'error' in r:
+            print(f"{r['model']:>24} c={r['crop']:<5} {label:>16}: {r['error']}")
+        else:
+            print(f"{r['model']:>24} c={r['crop']:<5} {label:>16}: {r['forward_ms']['mean']:.0f} ms, "
+                  f"{r['ms_per_mpixel']:.0f} ms/Mpx, peak rss {r['peak_rss_mb']:.0f} MB")
+    write_report(args.output, {'environment': environment(), 'results': results})
@@ -0,0 +1,168 @@
+import argparse
+from collections import defaultdict
+from contextlib import nullcontext
+
+import torch
+
+from src.benchmark.utils import peak_rss_mb, write_report
+from src.models.registry import MODELS, get_model, model_logits
+
+# saved tensor hooks arrived in torch 1.10, older torch profiles everything but saved_bytes
+SAVED_TENSORS_HOOKS = hasattr(torch.autograd, 'graph') and hasattr(torch.autograd.graph, 'saved_tensors_hooks')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Per module activation memory of a forward and backward pass.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--model', dest='model', type=str, default='small_axial_lbc_unet_10',
+                        help='Model to profile.', choices=list(MODELS))
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the input images.')
+    parser.add_argument('--depth', dest='depth', type=int, default=1,
+                        help='Module nesting depth of the report, 1 reports the top level blocks.')
+    parser.add_argument('-dev', '--device', dest='device', type=str, default='cpu',
+                        help='Profile on gpu vs cpu.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default=None,
+                        help='Optional path of a JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def tensor_bytes(t):
+    return t.numel() * t.element_size()
+
+
+def output_bytes(out):
+    if torch.is_tensor(out):
+        return tensor_bytes(out)
+    if isinstance(out, dict):
+        return sum(output_bytes(o) for o in out.values())
+    if isinstance(out, (list, tuple)):
+        return sum(output_bytes(o) for o in out)
+    return 0
+
+
+class MemoryProfiler(object):
+    """
+    Records, for every module of `net` during a real forward and backward pass:
+        output_bytes: size of the tensors the module returns,
+        saved_bytes: size of the tensors autograd saves for backward while the module runs (inclusive of children),
+        peak_bytes: extra allocator memory the module's forward needed above what was live when it started (CUDA).
+
+    Unlike feeding an input through `model.modules()` one after the other this follows the real control flow, so skip
+    connections, multi-input blocks and attention are measured as they run.  saved_bytes is None on torch without saved
+    tensor hooks.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.names = {module: name for name, module in net.named_modules()}
+        self.modules = {name: module for module, name in self.names.items()}
+        self.cuda = next(net.parameters()).is_cuda
+        self.reset()
+
+    def reset(self):
+        self.stats = defaultdict(lambda: {'calls': 0, 'output_bytes': 0, 'saved_bytes': 0, 'peak_bytes': 0})
+        self.stack = []
+        self.saved = defaultdict(set)
+        self.param_ptrs = {p.data_ptr() for p in self.net.parameters()}
+        self.totals = {}
+
+    def _pre_hook(self, module, inputs):
+        frame = {'name': self.names[module], 'child_peak': 0}
+        if self.cuda:
+            frame['start'] = torch.cuda.memory_allocated()
+            frame['outer_peak'] = torch.cuda.max_memory_allocated()
+            torch.cuda.reset_peak_memory_stats()
+        self.stack.append(frame)
+
+    def _hook(self, module, inputs, out):
+        frame = self.stack.pop()
+        stats = self.stats[frame['name']]
+        stats['calls'] += 1
+        stats['output_bytes'] += output_bytes(out)
+        if self.cuda:
+            peak = max(torch.cuda.max_memory_allocated(), frame['child_peak'])
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak - frame['start'])
+            # the reset at entry hid the enclosing module's peak, hand it back
+            if self.stack:
+                self.stack[-1]['child_peak'] = max(self.stack[-1]['child_peak'], peak, frame['outer_peak'])
+
+    def _pack(self, t):
+        if t.data_ptr() in self.param_ptrs:
+            return t
+        key = (t.data_ptr(), t.numel(), t.dtype)
+        for frame in self.stack:
+            if key not in self.saved[frame['name']]:
+                self.saved[frame['name']].add(key)
+                self.stats[frame['name']]['saved_bytes'] += tensor_bytes(t)
+        return t
+
+    def run(self, *inputs, loss_fn=None):
+        '''Profile one training step of the net on `inputs`'''
+        self.reset()
+        loss_fn = loss_fn or (lambda out: model_logits(out).float().mean())
+        handles = []
+        for module in self.names:
+            handles.append(module.register_forward_pre_hook(self._pre_hook))
+            handles.append(module.register_forward_hook(self._hook))
+
+        self.net.train()
+        self.net.zero_grad(set_to_none=True)
+        if self.cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            start = torch.cuda.memory_allocated()
+        try:
+            saved_hooks = torch.autograd.graph.saved_tensors_hooks(self._pack, lambda t: t) if SAVED_TENSORS_HOOKS \
+                else nullcontext()
+            with saved_hooks:
+                loss = loss_fn(self.net(*inputs))
+            loss.backward()
+        finally:
+            for handle in handles:
+                handle.remove()
+
+        if self.cuda:
+            torch.cuda.synchronize()
+            self.totals['forward_peak_bytes'] = self.stats['']['peak_bytes']
+            self.totals['step_peak_bytes'] = max(self.stats['']['peak_bytes'],
+                                                 torch.cuda.max_memory_allocated() - start)
+        self.totals['saved_bytes'] = self.stats['']['saved_bytes'] if SAVED_TENSORS_HOOKS else None
+        self.totals['peak_rss_mb'] = peak_rss_mb()
+        return self
+
+    def report(self, depth=1):
+        '''Rows of modules nested at most `depth` levels deep, the biggest saved-for-backward (else output) first'''
+        rows = []
+        for name, stats in self.stats.items():
+            if not name or name.count('.') >= depth:
+                continue
+            row = {'module': name, 'type': type(self.modules[name]).__name__, **stats}
+            if not SAVED_TENSORS_HOOKS:
+                row['saved_bytes'] = None
+            rows.append(row)
+        key = 'saved_bytes' if SAVED_TENSORS_HOOKS else 'output_bytes'
+        return sorted(rows, key=lambda row: row[key], reverse=True)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    net = get_model(args.model).to(device=args.device)
+    imgs = torch.randn(args.batchsize, 3, args.crop, args.crop, device=args.device)
+
+    profiler = MemoryProfiler(net).run(imgs)
+    rows = profiler.report(depth=args.depth)
+
+    mb = 1024 ** 2
+    print(f"{'module':<32}{'type':<20}{'output MB':>12}{'saved MB':>12}{'peak MB':>12}")
+    for row in rows:
+        saved = 'n/a' if row['saved_bytes'] is None else f"{row['saved_bytes'] / mb:.1f}"
+        print(f"{row['module']:<32}{row['type']:<20}{row['output_bytes'] / mb:>12.1f}{saved:>12}"
+              f"{row['peak_bytes'] / mb:>12.1f}")
+    print({k: v / mb if k.endswith('bytes') and v is not None else v for k, v in profiler.totals.items()})
+
+    if args.output:
+        write_report(args.output, {'model': args.model, 'batch_size': args.batchsize, 'crop': args.crop,
+                                   'totals': profiler.totals, 'modules': rows})
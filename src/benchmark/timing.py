@@ -0,0 +1,209 @@
+import argparse
+import json
+import time
+from collections import defaultdict
+
+import torch
+import torch.nn.functional as F
+
+from src.benchmark.utils import write_report
+from src.models.registry import MODELS, get_model, model_logits
+
+# autograd node pre hooks arrived in torch 2.0, older torch times the forward only and reports backward_ms as None
+NODE_PREHOOKS = hasattr(getattr(torch.autograd, 'graph', None), 'Node') and \
+    hasattr(torch.autograd.graph.Node, 'register_prehook')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Per block forward and backward wall time of a model.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--model', dest='model', type=str, default='small_axial_lbc_unet_10',
+                        help='Model to time.', choices=list(MODELS))
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the input images.')
+    parser.add_argument('-s', '--steps', dest='steps', type=int, default=5,
+                        help='Number of timed training steps.')
+    parser.add_argument('--all-modules', dest='all_modules', action='store_true',
+                        help='Time every module instead of only the blocks defined in src.models.')
+    parser.add_argument('-dev', '--device', dest='device', type=str, default='cpu',
+                        help='Time on gpu vs cpu.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='module_times.json',
+                        help='Path of the JSON report.', dest='output')
+    parser.add_argument('-t', '--trace', metavar='T', type=str, default='module_trace.json',
+                        help='Path of the Chrome trace (open in chrome://tracing or Perfetto).', dest='trace')
+    return parser.parse_args()
+
+
+def flat_tensors(obj):
+    if torch.is_tensor(obj):
+        return [obj]
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        return [t for o in obj for t in flat_tensors(o)]
+    return []
+
+
+def is_block(module):
+    '''Blocks are the modules this repo defines, as opposed to torch building blocks like Conv2d'''
+    return type(module).__module__.startswith('src.')
+
+
+class ModuleTimer(object):
+    """
+    Opt-in per module wall time.  Forward time comes from forward pre/post hooks.  Backward time is the summed run time
+    of the autograd nodes a module created during its forward, timed with node pre/post hooks, so nested and skip
+    connected blocks are attributed correctly.  Without autograd node pre hooks backward_ms is None.
+
+    Call `step()` after every backward to fold the step into the totals.  Results are available as rows from `report()`
+    and as a Chrome trace from `export_chrome_trace()`.
+    """
+
+    def __init__(self, net, select=is_block):
+        self.net = net
+        self.names = {module: name or type(net).__name__ for name, module in net.named_modules() if select(module)}
+        self.cuda = next(net.parameters()).is_cuda
+        self.handles = []
+        self.t0 = time.perf_counter()
+        self.totals = defaultdict(lambda: {'calls': 0, 'forward_ms': 0.0, 'backward_ms': 0.0})
+        self.events = []
+        self.steps = 0
+        self._clear_step()
+
+    def _clear_step(self):
+        self.stack = []
+        self.node_times = {}
+        self.module_nodes = []
+
+    def _now(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return (time.perf_counter() - self.t0) * 1e6
+
+    def attach(self):
+        for module in self.names:
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook))
+            self.handles.append(module.register_forward_hook(self._hook))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _pre_hook(self, module, inputs):
+        boundary = {t.grad_fn for t in flat_tensors(inputs) if t.grad_fn is not None}
+        self.stack.append((self._now(), boundary))
+
+    def _hook(self, module, inputs, out):
+        start, boundary = self.stack.pop()
+        end = self._now()
+        name = self.names[module]
+        self.totals[name]['calls'] += 1
+        self.totals[name]['forward_ms'] += (end - start) / 1000
+        self.events.append(self._event(name, module, 'forward', start, end, tid=0))
+
+        if NODE_PREHOOKS and torch.is_grad_enabled():
+            nodes = self._graph_nodes([t.grad_fn for t in flat_tensors(out) if t.grad_fn is not None], boundary)
+            for node in nodes:
+                self._watch(node)
+            self.module_nodes.append((name, module, nodes))
+
+    def _graph_nodes(self, roots, boundary):
+        '''Autograd nodes between the module outputs and its inputs'''
+        nodes, stack = set(), list(roots)
+        while stack:
+            node = stack.pop()
+            if node is None or node in boundary or node in nodes or not hasattr(node, 'next_functions'):
+                continue
+            if type(node).__name__ == 'AccumulateGrad':
+                continue
+            nodes.add(node)
+            stack.extend(next_node for next_node, _ in node.next_functions)
+        return nodes
+
+    def _watch(self, node):
+        if node in self.node_times:
+            return
+        times = self.node_times[node] = [None, None]
+
+        def pre_hook(grad_outputs):
+            times[0] = self._now()
+
+        def hook(grad_inputs, grad_outputs):
+            times[1] = self._now()
+
+        node.register_prehook(pre_hook)
+        node.register_hook(hook)
+
+    def step(self):
+        '''Attribute the backward pass of the last step to the modules and drop the step's graph references'''
+        for name, module, nodes in self.module_nodes:
+            spans = [self.node_times[node] for node in nodes if node in self.node_times]
+            spans = [(start, end) for start, end in spans if start is not None and end is not None]
+            if not spans:
+                continue
+            self.totals[name]['backward_ms'] += sum(end - start for start, end in spans) / 1000
+            self.events.append(self._event(name, module, 'backward', min(s for s, _ in spans),
+                                           max(e for _, e in spans), tid=1))
+        self.steps += 1
+        self._clear_step()
+
+    def _event(self, name, module, phase, start, end, tid):
+        return {'name': name, 'cat': phase, 'ph': 'X', 'ts': start, 'dur': end - start, 'pid': 0, 'tid': tid,
+                'args': {'type': type(module).__name__, 'step': self.steps}}
+
+    def report(self):
+        '''Per module totals over all steps, the slowest first'''
+        rows = []
+        for name, totals in self.totals.items():
+            steps = max(self.steps, 1)
+            row = {'module': name, **totals, 'forward_ms_per_step': totals['forward_ms'] / steps,
+                   'backward_ms_per_step': totals['backward_ms'] / steps}
+            if not NODE_PREHOOKS:
+                row['backward_ms'] = row['backward_ms_per_step'] = None
+            rows.append(row)
+        return sorted(rows, key=lambda row: row['forward_ms'] + (row['backward_ms'] or 0.), reverse=True)
+
+    def export_chrome_trace(self, path):
+        meta = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': phase}}
+                for tid, phase in enumerate(('forward', 'backward'))]
+        with open(path, 'w') as outfile:
+            json.dump({'traceEvents': meta + self.events, 'displayTimeUnit': 'ms'}, outfile)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    net = get_model(args.model).to(device=args.device)
+    imgs = torch.randn(args.batchsize, 3, args.crop, args.crop, device=args.device)
+    target = torch.randint(0, 3, (args.batchsize, args.crop, args.crop), device=args.device)
+
+    # one untimed step so lazy initialisation does not land in the first block
+    F.cross_entropy(model_logits(net(imgs)), target).backward()
+
+    timer = ModuleTimer(net, select=(lambda m: True) if args.all_modules else is_block)
+    with timer:
+        for _ in range(args.steps):
+            net.zero_grad(set_to_none=True)
+            F.cross_entropy(model_logits(net(imgs)), target).backward()
+            timer.step()
+
+    rows = timer.report()
+    print(f"{'module':<32}{'calls':>8}{'forward ms/step':>18}{'backward ms/step':>18}")
+    for row in rows:
+        backward = 'n/a' if row['backward_ms_per_step'] is None else f"{row['backward_ms_per_step']:.2f}"
+        print(f"{row['module']:<32}{row['calls']:>8}{row['forward_ms_per_step']:>18.2f}{backward:>18}")
+    if not NODE_PREHOOKS:
+        print(f'Backward times need autograd node pre hooks (torch 2.0), this is torch {torch.__version__}.')
+
+    write_report(args.output, {'model': args.model, 'batch_size': args.batchsize, 'crop': args.crop,
+                               'steps': args.steps, 'backward_timed': NODE_PREHOOKS, 'modules': rows})
+    timer.export_chrome_trace(args.trace)
@@ -0,0 +1,102 @@
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+
+def sync_for(device):
+    '''Function that waits for queued kernels on `device`, so timings measure the work and not the launch'''
+    if str(device).startswith('cuda'):
+        return torch.cuda.synchronize
+    return lambda: None
+
+
+def time_fn(fn, warmup=3, repeats=10, sync=None):
+    '''Wall time statistics of `fn` in milliseconds after `warmup` untimed calls'''
+    sync = sync or (lambda: None)
+    for _ in range(warmup):
+        fn()
+    sync()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        sync()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'mean': statistics.mean(times),
+        'std': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'repeats': repeats,
+    }
+
+
+def peak_rss_mb():
+    '''Peak resident set size of this process'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+
+
+def count_parameters(net):
+    return {
+        'total': sum(p.numel() for p in net.parameters()),
+        'trainable': sum(p.numel() for p in net.parameters() if p.requires_grad),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'threads': torch.get_num_threads(),
+        'cuda': torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+    }
+
+
+def run_isolated(fn, jobs):
+    '''
+    Run `fn(*job)` for every job in its own fresh process so peak memory and allocator state of one measurement do not
+    leak into the next.  `fn` must be importable by the spawned process.
+    '''
+    with mp.get_context('spawn').Pool(processes=1, maxtasksperchild=1) as pool:
+        return [pool.apply(fn, job) for job in jobs]
+
+
+def write_report(path, report):
+    '''Atomically write `report` as stable, diffable JSON'''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+            outfile.write('\n')
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,13 @@
+"""
+Fallbacks for torch features newer than the torch pinned in requirements.txt.  Model, eval and benchmark code import
+them from here; src/export/runtime.py keeps its own copy so it stays standalone.
+"""
+import torch
+
+# inference mode arrived in torch 1.9, no_grad computes the same results with a little more bookkeeping
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+def is_inference_mode_enabled():
+    '''Whether the calling thread is in inference mode, never on torch without it'''
+    return torch.is_inference_mode_enabled() if hasattr(torch, 'is_inference_mode_enabled') else False
@@ -1,14 +1,23 @@
 import argparse
+import glob
 import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 import matplotlib.pyplot as plt
 import skimage.transform
 from PIL import Image
+from tqdm import tqdm
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='Convert DeepMask proposals into numpy masks.',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--masks-directory', metavar='M', type=str, default='../data/proposals/masks',
+                        help='Directory of the masks_{NUM}.npy DeepMask proposal stacks, every one is converted.',
+                        dest='masks_dir')
     parser.add_argument('-s', '--save-directory', metavar='S', type=str, default='../data/proposals/binary',
                         help='Directory where proposals will be saved.', dest='save_dir')
     parser.add_argument('-n', '--n-proposals', metavar='P', type=int, default=250,
@@ -17,38 +26,150 @@ def get_args():
                         help='Ratio of largest proposal to the size of the image.', dest='max_ratio')
     parser.add_argument('-p', '--plot', metavar='PLT', type=bool, default=False,
                         help='Plot images with proposals.', dest='plot')
+    parser.add_argument('-i', '--instances', dest='instances', action='store_true',
+                        help='Save an instance label map with per instance pixel ranges (.npz) instead of the binary '
+                             'union.')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count(),
+                        help='Processes converting scenes in parallel, 0 converts in this process.')
+    parser.add_argument('--block-rows', dest='block_rows', type=int, default=64,
+                        help='Rows of a proposal stack read from disk at a time.')
     return parser.parse_args()
 
 
-def build_masks(dir, n_proposals, max_ratio=16, plot=False):
-    for NUM in range(1, 51):
-        proposal = np.load(f"../data/proposals/masks/masks_{NUM}.npy")
-        proposals = np.zeros_like(proposal[:, :, 0])
-        for ind in range(n_proposals):
-            if proposal[:, :, ind].sum() < (proposal.shape[0] * proposal.shape[1]) / max_ratio:
-                proposals[(proposal[:, :, ind] == 1)] = 1
-        dst = os.path.join(dir, f'img_{NUM}.npy')
-        np.save(dst, proposals)
-
-        if plot:
-            img = Image.open(f"../data/imgs/img_{NUM}.tif")
-            h, w = img.size
-            newW, newH = np.round_(0.5 * w), np.round_(0.5 * h)
-            assert newW > 0 and newH > 0, 'Scale is too small'
-            img_nd = np.array(img)
-            img_nd = skimage.transform.resize(img_nd,
-                                              (newW, newH),
-                                              mode='edge',
-                                              anti_aliasing=False,
-                                              anti_aliasing_sigma=None,
-                                              preserve_range=True,
-                                              order=0)
-            img_nd = img_nd.astype(int)
-            fig, ax = plt.subplots()
-            ax.imshow(img_nd)
-            ax.imshow(proposals, alpha=0.2)
+def instance_ranges(labels):
+    """
+    CSR layout of an instance label map: flat pixel positions sorted by label and the offsets of every label, so the
+    pixels of label l are order[offsets[l]:offsets[l + 1]].  Label 0 is background.
+    """
+    flat = labels.ravel()
+    order = np.argsort(flat, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(flat, minlength=int(flat.max()) + 1))))
+    return order, offsets
+
+
+def discover_scenes(masks_dir):
+    '''Scene number -> proposal stack path of every masks_{NUM}.npy in `masks_dir`, in scene order'''
+    scenes = {}
+    for path in glob.glob(os.path.join(masks_dir, 'masks_*.npy')):
+        match = re.fullmatch(r'masks_(\d+)\.npy', os.path.basename(path))
+        if match:
+            scenes[int(match.group(1))] = path
+    return dict(sorted(scenes.items()))
+
+
+def proposal_areas(proposal, n_proposals, block_rows=64):
+    '''Pixel count of each of the first `n_proposals` proposals of a (H, W, P) stack, read block of rows by block'''
+    areas = np.zeros(min(n_proposals, proposal.shape[2]), dtype=np.int64)
+    for row in range(0, proposal.shape[0], block_rows):
+        areas += np.count_nonzero(proposal[row:row + block_rows, :, :len(areas)], axis=(0, 1))
+    return areas
+
+
+def kept_proposals(areas, shape, max_ratio=16):
+    '''Indices of the proposals smaller than 1 / max_ratio of the image'''
+    return np.flatnonzero(areas < (shape[0] * shape[1]) / max_ratio)
+
+
+def union_mask(proposal, kept, block_rows=64):
+    '''Binary union of the kept proposals, in the dtype of the stack'''
+    proposals = np.zeros(proposal.shape[:2], dtype=proposal.dtype)
+    if len(kept):
+        for row in range(0, proposal.shape[0], block_rows):
+            proposals[row:row + block_rows] = proposal[row:row + block_rows, :, kept].any(axis=2)
+    return proposals
+
+
+def instance_labels(proposal, kept, areas, block_rows=64):
+    """
+    Label map of the kept proposals, numbered 1.. in proposal order.  Where proposals overlap the smallest one keeps
+    the pixel, it is the most specific group; among equally large ones the later proposal wins.
+    """
+    labels = np.zeros(proposal.shape[:2], dtype=np.int32)
+    if not len(kept):
+        return labels
+    # kept positions by priority, smallest first and later first among ties: the first covering one along the
+    # priority axis owns the pixel
+    priority = np.lexsort((-np.arange(len(kept)), areas[kept]))
+    priority_labels = (priority + 1).astype(np.int32)
+    for row in range(0, proposal.shape[0], block_rows):
+        block = proposal[row:row + block_rows, :, kept[priority]] != 0
+        labels[row:row + block_rows] = np.where(block.any(axis=2), priority_labels[block.argmax(axis=2)], 0)
+    return labels
+
+
+def build_scene(num, path, save_dir, n_proposals, max_ratio=16, instances=False, block_rows=64):
+    '''Convert one memory mapped proposal stack, returns the scene number, kept proposals and seconds taken'''
+    start = time.perf_counter()
+    proposal = np.load(path, mmap_mode='r')
+    areas = proposal_areas(proposal, n_proposals, block_rows)
+    kept = kept_proposals(areas, proposal.shape, max_ratio)
+    if instances:
+        labels = instance_labels(proposal, kept, areas, block_rows)
+        order, offsets = instance_ranges(labels)
+        np.savez_compressed(os.path.join(save_dir, f'img_{num}.npz'), labels=labels, order=order, offsets=offsets)
+    else:
+        np.save(os.path.join(save_dir, f'img_{num}.npy'), union_mask(proposal, kept, block_rows))
+    return num, len(kept), time.perf_counter() - start
+
+
+def build_masks(masks_dir, save_dir, n_proposals, max_ratio=16, instances=False, workers=0, block_rows=64):
+    '''Convert every scene of `masks_dir` over a pool of `workers` processes with progress, returns per scene results'''
+    scenes = discover_scenes(masks_dir)
+    if not scenes:
+        raise ValueError(f'No masks_*.npy proposal stacks in {masks_dir}.')
+    os.makedirs(save_dir, exist_ok=True)
+
+    jobs = [(num, path, save_dir, n_proposals, max_ratio, instances, block_rows) for num, path in scenes.items()]
+    results = []
+    with tqdm(total=len(jobs), desc='Scenes', unit='scene') as pbar:
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for future in as_completed([pool.submit(build_scene, *job) for job in jobs]):
+                    results.append(future.result())
+                    pbar.update()
+        else:
+            for job in jobs:
+                results.append(build_scene(*job))
+                pbar.update()
+    return sorted(results)
+
+
+def plot_proposals(num, proposals, imgs_dir='../data/imgs'):
+    img = Image.open(os.path.join(imgs_dir, f'img_{num}.tif'))
+    h, w = img.size
+    newW, newH = np.round_(0.5 * w), np.round_(0.5 * h)
+    assert newW > 0 and newH > 0, 'Scale is too small'
+    img_nd = np.array(img)
+    img_nd = skimage.transform.resize(img_nd,
+                                      (newW, newH),
+                                      mode='edge',
+                                      anti_aliasing=False,
+                                      anti_aliasing_sigma=None,
+                                      preserve_range=True,
+                                      order=0)
+    img_nd = img_nd.astype(int)
+    fig, ax = plt.subplots()
+    ax.imshow(img_nd)
+    ax.imshow(proposals, alpha=0.2)
 
 
 if __name__ == '__main__':
     args = get_args()
-    build_masks(args.save_dir, args.proposals, max_ratio=args.max_ratio, plot=args.plot)
\ No newline at end of file
+    start = time.perf_counter()
+    results = build_masks(args.masks_dir, args.save_dir, args.proposals, max_ratio=args.max_ratio,
+                          instances=args.instances, workers=args.workers, block_rows=args.block_rows)
+    total = time.perf_counter() - start
+
+    for num, n_kept, seconds in results:
+        print(f'img_{num}: kept {n_kept} proposals in {seconds:.2f} s')
+    print(f'{len(results)} scenes in {total:.1f} s, {sum(s for _, _, s in results) / len(results):.2f} s per scene '
+          f'with {args.workers or 1} worker(s)')
+
+    if args.plot:
+        for num, _, _ in results:
+            if args.instances:
+                proposals = np.load(os.path.join(args.save_dir, f'img_{num}.npz'))['labels'] > 0
+            else:
+                proposals = np.load(os.path.join(args.save_dir, f'img_{num}.npy'))
+            plot_proposals(num, proposals)
+        plt.show()
@@ -8,6 +8,7 @@ import skimage.transform
 from torch.utils import data
 
 from src.datasets.utils import recursive_glob, Compose, RandomHorizontallyFlip, RandomRotate, Scale
+from src.datasets.dataset_stats import load_stats
 
 
 class City(data.Dataset):
@@ -58,6 +59,7 @@ class City(data.Dataset):
             img_norm=True,
             version="cityscapes",
             test_mode=False,
+            stats_file=None,
     ):
         """__init__
         :param root:
@@ -65,6 +67,7 @@ class City(data.Dataset):
         :param is_transform:
         :param img_size:
         :param augmentations
+        :param stats_file: optional src/datasets/dataset_stats.py file whose RGB mean replaces the version mean
         """
         self.root = root
         self.split = split
@@ -74,6 +77,9 @@ class City(data.Dataset):
         self.n_classes = 19
         self.img_size = img_size if isinstance(img_size, tuple) else (img_size, img_size)
         self.mean = np.array(self.mean_rgb[version])
+        if stats_file:
+            # images are converted to BGR before the mean is subtracted
+            self.mean = np.array(load_stats(stats_file)[0][::-1])
         self.files = {}
 
         self.images_base = os.path.join(self.root, "leftImg8bit", self.split)
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Per channel mean and std and class pixel frequencies of a dataset, '
+                                                 'streamed image by image over a process pool.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataset', dest='dataset', type=str, default='ice', choices=['ice', 'city'],
+                        help='Layout of the data directory.')
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside, the Cityscapes root for city.',
+                        dest='data_dir')
+    parser.add_argument('--split', dest='split', type=str, default='train',
+                        help='Split to compute the statistics on.')
+    parser.add_argument('-n', '--n-classes', dest='n_classes', type=int, default=None,
+                        help='Number of classes, mask values at or above it are counted as ignored.  3 for ice, 19 '
+                             'for city by default.')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count(),
+                        help='Processes reading images in parallel, 0 reads in this process.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default=None,
+                        help='Path of the JSON stats file, <dataset>_stats_<split>.json in the data directory by '
+                             'default.', dest='output')
+    return parser.parse_args()
+
+
+class RunningStats(object):
+    """
+    Per channel pixel count, mean and sum of squared deviations, updated a batch of pixels at a time (Welford) and
+    mergeable across processes (Chan et al.), so no more than one image is ever held in memory.
+    """
+
+    def __init__(self, channels=3):
+        self.count = 0
+        self.mean = np.zeros(channels)
+        self.m2 = np.zeros(channels)
+
+    def update(self, pixels):
+        '''Add (..., channels) pixels'''
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, len(self.mean))
+        batch = RunningStats(len(self.mean))
+        batch.count = len(pixels)
+        batch.mean = pixels.mean(axis=0)
+        batch.m2 = ((pixels - batch.mean) ** 2).sum(axis=0)
+        return self.merge(batch)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count, 1))
+
+
+def load_stats(path):
+    '''Per channel (mean, std) in 0-255 pixel units, RGB order, from a stats file written by this module'''
+    with open(path) as f:
+        stats = json.load(f)
+    return stats['mean'], stats['std']
+
+
+def ice_files(data_dir, split):
+    '''Image and mask paths of an ice split, masks hold the class ids'''
+    with open(os.path.join(data_dir, 'txt_files', f'ice_{split}.txt')) as f:
+        names = [line.strip() for line in f if line.strip()]
+    return [(os.path.join(data_dir, 'imgs', name), os.path.join(data_dir, 'masks', name)) for name in names]
+
+
+def city_files(data_dir, split):
+    '''Image and labelIds paths of a Cityscapes split, and the labelIds -> train id lookup of City.encode_segmap'''
+    from src.datasets.city import City
+
+    city = City(data_dir, split)
+    lookup = np.full(256, city.ignore_index, dtype=np.uint8)
+    lookup[city.valid_classes] = [city.class_map[c] for c in city.valid_classes]
+    files = [(path, os.path.join(city.annotations_base, path.split(os.sep)[-2],
+                                 os.path.basename(path)[:-15] + 'gtFine_labelIds.png'))
+             for path in city.files[split]]
+    return files, lookup
+
+
+def image_stats(img_path, mask_path, n_classes, lookup=None):
+    """
+    Statistics of one image: running RGB pixel stats, per class pixel counts and the count of pixels outside the
+    classes.  `lookup` maps raw mask values to classes when the masks are not stored in class ids.
+    """
+    img = np.array(Image.open(img_path).convert('RGB'))
+    mask = np.array(Image.open(mask_path))
+    if lookup is not None:
+        mask = lookup[mask.astype(np.uint8)]
+    stats = RunningStats(img.shape[-1]).update(img)
+    counts = np.bincount(mask.ravel(), minlength=n_classes)
+    return stats, counts[:n_classes], int(counts[n_classes:].sum())
+
+
+def dataset_stats(files, n_classes, lookup=None, workers=0):
+    '''Stream every (image, mask) pair of `files` once over a pool of `workers` processes, returns the stats file dict'''
+    if not files:
+        raise ValueError('No images to compute statistics on.')
+    stats, class_pixels, ignored = RunningStats(), np.zeros(n_classes, dtype=np.int64), 0
+    jobs = [(img_path, mask_path, n_classes, lookup) for img_path, mask_path in files]
+
+    def merge(result):
+        nonlocal class_pixels, ignored
+        image, counts, image_ignored = result
+        stats.merge(image)
+        class_pixels += counts
+        ignored += image_ignored
+
+    with tqdm(total=len(jobs), desc='Images', unit='img') as pbar:
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for result in pool.map(image_stats, *zip(*jobs), chunksize=4):
+                    merge(result)
+                    pbar.update()
+        else:
+            for job in jobs:
+                merge(image_stats(*job))
+                pbar.update()
+
+    total = max(int(class_pixels.sum()), 1)
+    return {
+        'images': len(files),
+        'pixels': int(stats.count),
+        'mean': stats.mean.tolist(),
+        'std': stats.std.tolist(),
+        'class_pixels': class_pixels.tolist(),
+        'class_frequency': (class_pixels / total).tolist(),
+        'ignored_pixels': ignored,
+    }
+
+
+if __name__ == '__main__':
+    args = get_args()
+    n_classes = args.n_classes or (3 if args.dataset == 'ice' else 19)
+    if args.dataset == 'ice':
+        files, lookup = ice_files(args.data_dir, args.split), None
+    else:
+        files, lookup = city_files(args.data_dir, args.split)
+    output = args.output or os.path.join(args.data_dir, f'{args.dataset}_stats_{args.split}.json')
+
+    start = time.perf_counter()
+    stats = dict(dataset_stats(files, n_classes, lookup, args.workers), dataset=args.dataset, split=args.split,
+                 units='0-255 pixel values, RGB')
+    with open(output, 'w') as f:
+        json.dump(stats, f, indent=2)
+
+    print(f"{stats['images']} images, {stats['pixels']} pixels in {time.perf_counter() - start:.1f} s")
+    print(f"mean {[round(m, 4) for m in stats['mean']]}, std {[round(s, 4) for s in stats['std']]}")
+    print(f"class frequencies {[round(c, 4) for c in stats['class_frequency']]}, written to {output}")
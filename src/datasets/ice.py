@@ -7,11 +7,20 @@ from torch.utils.data import Dataset
 from torchvision.transforms import transforms
 import torch
 import skimage.transform
+from src.datasets.build_proposal_masks import instance_ranges
+from src.datasets.dataset_stats import load_stats
+from src.datasets.proposals import generate_labels
 
 MEANS = [121.4836, 122.35021, 122.517166]
 STDS = [58.89167, 58.966404, 59.09349]
 
 
+def to_chw(img, channels_last=False):
+    '''CHW view of an HWC image tensor, with channels_last the HWC buffer is kept, i.e. the NHWC strides convs prefer'''
+    img = img.permute(2, 0, 1)
+    return img if channels_last else img.contiguous()
+
+
 class BasicDatasetIce(Dataset):
     def __init__(self, imgs_dir, masks_dir, txt_dir, split, scale=1, mask_suffix='', preprocessing=None, augmentation=None):
         self.imgs_dir = imgs_dir
@@ -90,13 +99,17 @@ class BasicDatasetIce(Dataset):
 
 
 class Ice(Dataset):
-    def __init__(self, imgs_dir, masks_dir, txt_dir, split, scale=1, crop=300):
+    def __init__(self, imgs_dir, masks_dir, txt_dir, split, scale=1, crop=300, channels_last=False,
+                 stats_file=None):
         self.imgs_dir = imgs_dir
         self.masks_dir = masks_dir
         self.txt_dir = txt_dir
         self.split = split
         self.scale = scale
         self.crop = crop
+        self.channels_last = channels_last
+        # per channel mean and std from src/datasets/dataset_stats.py, in the same units as MEANS and STDS
+        self.means, self.stds = load_stats(stats_file) if stats_file else (MEANS, STDS)
         assert 0 < scale <= 1, 'Scale must be between 0 and 1'
 
         if split == "train":
@@ -146,7 +159,7 @@ class Ice(Dataset):
         mask = transforms.CenterCrop(self.crop)(Image.fromarray(mask.squeeze(-1).astype(np.uint8)))
 
         img = transforms.ToTensor()(img)
-        img = transforms.Normalize(mean=MEANS, std=STDS)(img)
+        img = transforms.Normalize(mean=self.means, std=self.stds)(img)
         img = img.permute(1, 2, 0).contiguous()
 
         mask = torch.tensor(np.array(mask))
@@ -163,7 +176,7 @@ class Ice(Dataset):
 
         img, mask = self.process(img, mask)
         mask = mask.unsqueeze(0)
-        img = img.permute(2, 0, 1).contiguous()
+        img = to_chw(img, self.channels_last)
 
         return {
             'image': img,
@@ -172,13 +185,14 @@ class Ice(Dataset):
 
 
 class IceForVisualizing(Dataset):
-    def __init__(self, imgs_dir, masks_dir, txt_dir, split, scale=1, crop=300):
+    def __init__(self, imgs_dir, masks_dir, txt_dir, split, scale=1, crop=300, stats_file=None):
         self.imgs_dir = imgs_dir
         self.masks_dir = masks_dir
         self.txt_dir = txt_dir
         self.split = split
         self.scale = scale
         self.crop = crop
+        self.means, self.stds = load_stats(stats_file) if stats_file else (MEANS, STDS)
         assert 0 < scale <= 1, 'Scale must be between 0 and 1'
 
         if split == "train":
@@ -228,7 +242,7 @@ class IceForVisualizing(Dataset):
         mask = transforms.CenterCrop(self.crop)(Image.fromarray(mask.squeeze(-1).astype(np.uint8)))
 
         img_orig = transforms.ToTensor()(img)
-        img = transforms.Normalize(mean=MEANS, std=STDS)(img_orig)
+        img = transforms.Normalize(mean=self.means, std=self.stds)(img_orig)
         img = img.permute(1, 2, 0).contiguous()
 
         mask = torch.tensor(np.array(mask))
@@ -256,7 +270,8 @@ class IceForVisualizing(Dataset):
 
 
 class IceWithProposals(Dataset):
-    def __init__(self, imgs_dir, masks_dir, txt_dir, prop_dir, split, scale=1, crop=300):
+    def __init__(self, imgs_dir, masks_dir, txt_dir, prop_dir, split, scale=1, crop=300, channels_last=False,
+                 instances=False, instance_len=64, generate=False, stats_file=None):
         self.imgs_dir = imgs_dir
         self.masks_dir = masks_dir
         self.txt_dir = txt_dir
@@ -264,6 +279,13 @@ class IceWithProposals(Dataset):
         self.split = split
         self.scale = scale
         self.crop = crop
+        self.channels_last = channels_last
+        # route attention through sequences inside single proposals (build_proposal_masks.py --instances artifacts)
+        self.instances = instances
+        self.instance_len = instance_len
+        # build proposals from the image itself (src/datasets/proposals.py) instead of loading DeepMask ones
+        self.generate = generate
+        self.means, self.stds = load_stats(stats_file) if stats_file else (MEANS, STDS)
         assert 0 < scale <= 1, 'Scale must be between 0 and 1'
 
         if split == "train":
@@ -280,7 +302,8 @@ class IceWithProposals(Dataset):
         for name in self.img_ids:
             img_file = os.path.join(imgs_dir, name)
             mask_file = os.path.join(masks_dir, name)
-            prop_file = os.path.join(prop_dir, name.replace('.tif', '.npy'))
+            prop_file = None if generate else \
+                os.path.join(prop_dir, name.replace('.tif', '.npz' if instances else '.npy'))
             self.files.append({
                 "img": img_file,
                 "mask": mask_file,
@@ -311,14 +334,20 @@ class IceWithProposals(Dataset):
     def process(self, img, mask, prop):
         img = self.resize(img)
         mask = self.resize(mask)
-        prop = self.resize(prop, is_prop=True)
+        if prop is None:
+            labels = generate_labels(img)
+            prop = np.expand_dims(labels if self.instances else (labels > 0).astype(np.uint8), axis=2)
+        else:
+            prop = self.resize(prop, is_prop=True)
 
         img = transforms.CenterCrop(self.crop)(Image.fromarray(img.astype(np.uint8)))
         mask = transforms.CenterCrop(self.crop)(Image.fromarray(mask.squeeze(-1).astype(np.uint8)))
-        prop = transforms.CenterCrop(self.crop)(Image.fromarray(prop.squeeze(-1).astype(np.uint8)))
+        # instance labels can exceed 255, they are cropped as 32 bit integers
+        prop = prop.squeeze(-1).astype(np.int32 if self.instances else np.uint8)
+        prop = transforms.CenterCrop(self.crop)(Image.fromarray(prop))
 
         img = transforms.ToTensor()(img)
-        img = transforms.Normalize(mean=MEANS, std=STDS)(img)
+        img = transforms.Normalize(mean=self.means, std=self.stds)(img)
         img = img.permute(1, 2, 0).contiguous()
 
         mask = torch.tensor(np.array(mask))
@@ -326,19 +355,82 @@ class IceWithProposals(Dataset):
 
         return img, mask, prop
 
-    def build_dict(self, array, val):
+    def build_index(self, array, val):
+        """Flat positions of the pixels equal to `val`, repeated cyclically to fill all crop * crop routing slots"""
         inds = (array == val).nonzero(as_tuple=True)[0]
-        extended = torch.cat((inds, inds), dim=0)
-        while len(extended) < self.crop ** 2:
-            extended = torch.cat((extended, inds), dim=0)
-        extended = extended[:self.crop ** 2]
-        return {i: x.item() for i, x in enumerate(extended)}
+        if len(inds) == 0 and self.generate:
+            # generated proposals can cover nothing or everything, that half is routed through the whole image
+            inds = torch.arange(len(array))
+        if len(inds) == 0:
+            raise ValueError(f'The proposal map has no pixels of value {val} to route attention through.')
+        repeats = -(-self.crop ** 2 // len(inds))
+        return inds.repeat(repeats)[:self.crop ** 2]
+
+    def pack_instances(self, groups, slots, rng):
+        """
+        `slots` routing positions filled with sequences of `instance_len` pixels that never straddle two groups.  Pixels
+        are shuffled within every group and groups are taken in random order until the slots run out; the last sequence
+        of a group and the unused slots are padded with -1.  Pixels left out keep their input value.
+        """
+        index = np.full(slots, -1, dtype=np.int64)
+        pos = 0
+        for g in rng.permutation(len(groups)):
+            pixels = rng.permutation(groups[g])[:slots - pos]
+            index[pos:pos + len(pixels)] = pixels
+            pos += -(-len(pixels) // self.instance_len) * self.instance_len
+            if pos >= slots:
+                break
+        return torch.from_numpy(index)
+
+    def crop_ranges(self, order, offsets, shape):
+        """
+        The stored instance ranges of a full proposal map of `shape` restricted to the pixels `process` keeps, as flat
+        crop positions.  This needs every crop pixel to come from its own proposal pixel, so None is returned when the
+        map is upsampled (scale above the 0.5 of the proposals) or smaller than the crop.
+        """
+        if self.scale > 0.5:
+            return None
+        # source position of every crop pixel, through the same resize and crop as the labels
+        positions = np.arange(shape[0] * shape[1], dtype=np.int32).reshape(shape)
+        positions = self.resize(positions, is_prop=True).squeeze(-1).astype(np.int32)
+        if min(positions.shape) < self.crop:
+            return None
+        positions = np.array(transforms.CenterCrop(self.crop)(Image.fromarray(positions))).ravel()
+
+        crop_of = np.full(shape[0] * shape[1], -1, dtype=np.int64)
+        crop_of[positions] = np.arange(len(positions))
+        kept = crop_of[order]
+        inside = kept >= 0
+        counts = np.concatenate(([0], np.cumsum(inside)))
+        return kept[inside], counts[offsets]
+
+    def build_instance_index(self, labels, rng, ranges=None):
+        """
+        Object routing through the proposal instances and background routing, crop * crop // 2 slots each.  `ranges`
+        are the crop's (order, offsets) from crop_ranges, otherwise they are computed from the cropped `labels`.
+        """
+        slots = self.crop ** 2 // 2 // self.instance_len * self.instance_len
+        order, offsets = ranges if ranges is not None else instance_ranges(labels)
+        objects = [order[offsets[l]:offsets[l + 1]] for l in range(1, len(offsets) - 1)]
+        return (self.pack_instances(objects, slots, rng),
+                self.pack_instances([order[offsets[0]:offsets[1]]], slots, rng))
+
+    def build_dict(self, array, val):
+        return {i: x.item() for i, x in enumerate(self.build_index(array, val))}
 
     def __getitem__(self, i):
         datafiles = self.files[i]
         img = Image.open(datafiles["img"])
         mask = Image.open(datafiles["mask"])
-        prop = np.load(datafiles["prop"])
+        ranges = None
+        if self.generate:
+            prop = None
+        elif self.instances:
+            artifact = np.load(datafiles["prop"])
+            prop = artifact['labels']
+            ranges = self.crop_ranges(artifact['order'], artifact['offsets'], prop.shape)
+        else:
+            prop = np.load(datafiles["prop"])
 
         assert img.size == mask.size, \
             f'Image and mask {i} should be the same size, but are {img.size} and {mask.size}'
@@ -350,17 +442,22 @@ class IceWithProposals(Dataset):
 
         mask = mask.unsqueeze(0)
         prop = prop.unsqueeze(0)
-        img = img.permute(2, 0, 1).contiguous()
+        img = to_chw(img, self.channels_last)
 
         prop_flat = prop.flatten()
-        # obj_dict, bg_dict = get_image_dicts(prop_flat)
-        obj_dict = self.build_dict(prop_flat, 1)
-        bg_dict = self.build_dict(prop_flat, 0)
+
+        if self.instances:
+            # fresh sequences every epoch in training, fixed ones for evaluation
+            rng = np.random.default_rng() if self.split == 'train' else np.random.default_rng(i)
+            obj_index, bg_index = self.build_instance_index(prop_flat.numpy(), rng, ranges)
+            prop = (prop > 0).to(torch.uint8)
+        else:
+            obj_index, bg_index = self.build_index(prop_flat, 1), self.build_index(prop_flat, 0)
 
         return {
             'image': img,
             'mask': mask,
             'prop': prop,
-            'obj_dict': obj_dict,
-            'bg_dict': bg_dict
+            'obj_index': obj_index,
+            'bg_index': bg_index
         }
@@ -0,0 +1,90 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import skimage.filters
+import skimage.measure
+from PIL import Image
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Time the in process proposal generator on ice images.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='../data',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-n', '--n-images', metavar='N', type=int, default=10,
+                        help='Number of images to time.', dest='n_images')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.5,
+                        help='Downscaling factor of the images, the saved DeepMask proposals are at 0.5.')
+    parser.add_argument('-r', '--max-ratio', metavar='B', type=int, default=16,
+                        help='Ratio of largest proposal to the size of the image.', dest='max_ratio')
+    parser.add_argument('-a', '--min-area', dest='min_area', type=int, default=16,
+                        help='Smallest proposal in pixels.')
+    parser.add_argument('--sigma', dest='sigma', type=float, default=1.,
+                        help='Gaussian smoothing before thresholding, 0 turns it off.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default=None,
+                        help='Optional directory to save the binary proposals to as img_N.npy.', dest='output')
+    return parser.parse_args()
+
+
+def to_gray(img):
+    '''Single channel float image of an (H, W), (H, W, C) array or a (C, H, W) tensor'''
+    if hasattr(img, 'numpy'):
+        img = img.detach().cpu().numpy()
+        img = np.moveaxis(img, 0, -1) if img.ndim == 3 else img
+    img = np.asarray(img, dtype=np.float32)
+    return img.mean(axis=-1) if img.ndim == 3 else img
+
+
+def generate_labels(img, max_ratio=16, min_area=16, n_proposals=250, sigma=1.):
+    """
+    Instance label map of classical proposals: Otsu threshold of the smoothed brightness, bright connected components
+    (ice against darker water) numbered 1.. by decreasing area, 0 elsewhere.  Like build_proposal_masks, components of
+    1 / max_ratio of the image or more are dropped, as are those under `min_area` pixels; at most `n_proposals` are
+    kept.
+    """
+    gray = to_gray(img)
+    if sigma:
+        gray = skimage.filters.gaussian(gray, sigma=sigma, preserve_range=True)
+    if gray.max() == gray.min():
+        return np.zeros(gray.shape, dtype=np.int32)
+
+    components = skimage.measure.label(gray > skimage.filters.threshold_otsu(gray), connectivity=1)
+    areas = np.bincount(components.ravel())
+    keep = (areas >= min_area) & (areas < gray.size / max_ratio)
+    keep[0] = False
+    kept = np.flatnonzero(keep)
+    kept = kept[np.argsort(-areas[kept], kind='stable')][:n_proposals]
+
+    relabel = np.zeros(len(areas), dtype=np.int32)
+    relabel[kept] = np.arange(1, len(kept) + 1, dtype=np.int32)
+    return relabel[components]
+
+
+def generate_proposals(img, max_ratio=16, min_area=16, n_proposals=250, sigma=1.):
+    '''Binary proposal map of `img` in the format build_proposal_masks saves, uint8 with 1 on proposals'''
+    return (generate_labels(img, max_ratio, min_area, n_proposals, sigma) > 0).astype(np.uint8)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    names = sorted(f for f in os.listdir(os.path.join(args.data_dir, 'imgs')) if f.endswith('.tif'))[:args.n_images]
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    times = []
+    for name in names:
+        img = Image.open(os.path.join(args.data_dir, 'imgs', name))
+        img = np.array(img.resize((round(args.scale * img.size[0]), round(args.scale * img.size[1])), Image.NEAREST))
+        start = time.perf_counter()
+        labels = generate_labels(img, args.max_ratio, args.min_area, sigma=args.sigma)
+        times.append((time.perf_counter() - start) * 1000)
+        print(f'{name}: {img.shape[1]}x{img.shape[0]}, {labels.max()} proposals covering '
+              f'{100 * (labels > 0).mean():.1f}% in {times[-1]:.1f} ms')
+        if args.output:
+            np.save(os.path.join(args.output, name.replace('.tif', '.npy')), (labels > 0).astype(np.uint8))
+
+    if times:
+        print(f'{len(times)} images, {np.mean(times):.1f} ms per image (median {np.median(times):.1f}, '
+              f'max {np.max(times):.1f})')
@@ -0,0 +1,57 @@
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from src.compat import inference_mode
+from src.metrics.segmentation import ConfusionMatrix
+
+
+def default_forward(net, batch, device):
+    imgs = batch['image'].to(device=device, dtype=torch.float32, non_blocking=True)
+    return net(imgs)
+
+
+def accumulate(net, loader, device, n_classes, forward=default_forward, ignore_index=-100, matrix=None,
+               progress=True, memory_format=None):
+    """
+    Run `net` in eval mode over every batch of `loader` and return the confusion matrix, the summed cross entropy
+    and the number of scored pixels.  All three stay on `device`, nothing is synchronised inside the loop.
+    With `memory_format` the images are converted before they reach `forward`, e.g. torch.channels_last for a net
+    converted with `net.to(memory_format=torch.channels_last)`.
+    """
+    matrix = ConfusionMatrix(n_classes, device=device) if matrix is None else matrix
+    was_training = net.training
+    net.eval()
+
+    with inference_mode(), tqdm(total=len(loader), desc='Validation round', unit='batch', leave=False,
+                                disable=not progress) as pbar:
+        loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+        n_pixels = torch.zeros((), dtype=torch.long, device=device)
+        for batch in loader:
+            if memory_format is not None:
+                batch = dict(batch, image=batch['image'].contiguous(memory_format=memory_format))
+            mask_pred = forward(net, batch, device)
+            if isinstance(mask_pred, dict):
+                mask_pred = mask_pred['out']
+
+            true_masks = batch['mask'].to(device=device, dtype=torch.long, non_blocking=True)
+            true_masks = true_masks.reshape(mask_pred.shape[0], *mask_pred.shape[2:])
+
+            loss_sum += F.cross_entropy(mask_pred, true_masks, ignore_index=ignore_index, reduction='sum')
+            n_pixels += (true_masks != ignore_index).sum()
+            matrix.update(true_masks, mask_pred.argmax(dim=1))
+            pbar.update()
+
+    net.train(was_training)
+    return matrix, loss_sum, n_pixels
+
+
+def evaluate(net, loader, device, n_classes, forward=default_forward, ignore_index=-100, progress=True,
+             memory_format=None):
+    """Mean loss, mean IoU and mean per class accuracy over the whole loader"""
+    matrix, loss_sum, n_pixels = accumulate(net, loader, device, n_classes, forward=forward,
+                                            ignore_index=ignore_index, progress=progress,
+                                            memory_format=memory_format)
+    metrics = matrix.compute()
+    loss = loss_sum / n_pixels.clamp(min=1)
+    loss, iou, acc = torch.stack([loss, metrics['iou'][0], metrics['acc'][0]]).cpu()
+    return loss.item(), iou, acc
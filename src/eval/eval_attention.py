@@ -0,0 +1,65 @@
+import argparse
+import os
+
+import torch
+from torch.utils.data import DataLoader
+from loguru import logger as log
+
+from src.benchmark.utils import environment, write_report
+from src.datasets.ice import Ice
+from src.eval.engine import evaluate
+from src.models.axial_attention.axial_attention import set_attention_backend
+from src.models.registry import MODELS, get_model
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='IoU of the softmax and linear attention kernels on the ice '
+                                                 'validation split.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-m', '--model', dest='model', type=str, default='small_axial_lbc_unet',
+                        help='Model to evaluate.', choices=list(MODELS))
+    parser.add_argument('-f', '--softmax-weights', dest='softmax_weights', type=str, required=True,
+                        help='Checkpoint trained with softmax attention.')
+    parser.add_argument('-l', '--linear-weights', dest='linear_weights', type=str, default=None,
+                        help='Checkpoint trained with linear attention (train_val_loss.py --attention linear).')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.35,
+                        help='Downscaling factor of the images')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of images and masks.')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=4,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-dev', '--device', dest='device', type=str, default='cpu',
+                        help='Evaluate on gpu vs cpu.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='eval_attention.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def eval_backend(name, weights, backend, loader, device):
+    net = set_attention_backend(get_model(name), backend)
+    net.load_state_dict(torch.load(weights, map_location=device))
+    net.to(device=device)
+    loss, iou, acc = evaluate(net, loader, device, n_classes=3)
+    return {'backend': backend, 'weights': weights, 'loss': loss, 'miou': iou.item(), 'acc': acc.item()}
+
+
+if __name__ == '__main__':
+    args = get_args()
+    val_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                  os.path.join(args.data_dir, 'txt_files'), 'val', args.scale, args.crop)
+    val_loader = DataLoader(val_set, batch_size=args.batchsize)
+
+    # the linear kernel on softmax weights shows the drop in replacement, on its own weights the trained quality
+    runs = [(args.softmax_weights, 'softmax'), (args.softmax_weights, 'linear')]
+    if args.linear_weights:
+        runs.append((args.linear_weights, 'linear'))
+
+    results = []
+    for weights, backend in runs:
+        row = eval_backend(args.model, weights, backend, val_loader, args.device)
+        results.append(row)
+        log.info(f"{args.model} {backend} attention with {os.path.basename(weights)}: mIoU {row['miou']:.4f}, "
+                 f"acc {row['acc']:.4f}, loss {row['loss']:.4f}")
+    write_report(args.output, {'environment': environment(), 'model': args.model, 'results': results})
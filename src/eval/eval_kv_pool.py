@@ -0,0 +1,75 @@
+import argparse
+import os
+
+import torch
+from torch.utils.data import DataLoader
+from loguru import logger as log
+
+from src.benchmark.utils import environment, write_report
+from src.datasets.ice import Ice
+from src.export.quantize import report_row
+from src.models.axial_attention.axial_attention import KV_POOL_MODES, set_kv_pool
+from src.models.basic_axial.basic_axialnet import BasicAxial
+from src.models.registry import get_model
+
+KV_POOL_MODELS = {
+    'axial_unet': lambda crop: get_model('axial_unet'),
+    'axial_lbc_unet': lambda crop: get_model('axial_lbc_unet'),
+    'basic_axial': lambda crop: BasicAxial(3, 3, 32, img_crop=crop),
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Quality and speed curve of axial attention with pooled keys and '
+                                                 'values.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(KV_POOL_MODELS),
+                        help='Models to evaluate.', dest='models', choices=list(KV_POOL_MODELS))
+    parser.add_argument('-k', '--factors', metavar='K', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Key and value pooling factors, 1 is the full attention baseline.', dest='factors')
+    parser.add_argument('--mode', dest='mode', type=str, default='avg', choices=list(KV_POOL_MODES),
+                        help='Average every factor tokens or keep every factor-th.')
+    parser.add_argument('-w', '--weights-dir', dest='weights_dir', type=str, default=None,
+                        help='Directory with a <model>.pth checkpoint per model, random weights otherwise.')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.35,
+                        help='Downscaling factor of the images')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of images and masks.')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per latency measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='eval_kv_pool.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(0)
+    val_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                  os.path.join(args.data_dir, 'txt_files'), 'val', args.scale, args.crop)
+    val_loader = DataLoader(val_set, batch_size=args.batchsize)
+    imgs = torch.randn(args.batchsize, 3, args.crop, args.crop)
+
+    results = []
+    for name in args.models:
+        net = KV_POOL_MODELS[name](args.crop)
+        weights = os.path.join(args.weights_dir, f'{name}.pth') if args.weights_dir else None
+        if weights and os.path.exists(weights):
+            net.load_state_dict(torch.load(weights, map_location='cpu'))
+        else:
+            log.warning(f'No checkpoint for {name}, the IoU of random weights only shows the pooling drift.')
+        net.eval()
+
+        curve = []
+        for factor in args.factors:
+            row = dict(report_row(set_kv_pool(net, factor, args.mode), val_loader, imgs, args.repeats), factor=factor)
+            curve.append(row)
+            log.info(f"{name} kv pool {factor} ({args.mode}): mIoU {row['miou']:.4f}, forward "
+                     f"{row['forward_ms']['mean']:.1f} ms (x{curve[0]['forward_ms']['mean'] / row['forward_ms']['mean']:.2f})")
+        results.append({'model': name, 'mode': args.mode, 'curve': curve})
+
+    write_report(args.output, {'environment': environment(), 'results': results})
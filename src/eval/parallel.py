@@ -0,0 +1,105 @@
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Subset
+
+from src.eval.engine import accumulate, default_forward
+from src.metrics.segmentation import ConfusionMatrix
+
+_worker = {}
+
+
+def _init_worker(net, dataset, n_classes, batch_size, threads, forward, ignore_index):
+    torch.set_num_threads(threads)
+    _worker.update(net=net, dataset=dataset, n_classes=n_classes, batch_size=batch_size, forward=forward,
+                   ignore_index=ignore_index)
+
+
+def _eval_shard(indices, state_dict=None):
+    net = _worker['net']
+    if state_dict is not None:
+        net.load_state_dict(state_dict)
+    loader = DataLoader(Subset(_worker['dataset'], indices), batch_size=_worker['batch_size'])
+    matrix, loss_sum, n_pixels = accumulate(net, loader, 'cpu', _worker['n_classes'], forward=_worker['forward'],
+                                            ignore_index=_worker['ignore_index'], progress=False)
+    return matrix.state_dict(), loss_sum.item(), n_pixels.item()
+
+
+def shard_indices(n_items, n_shards):
+    '''Strided shards so that every shard sees a similar mix of images'''
+    return [list(range(i, n_items, n_shards)) for i in range(min(n_shards, n_items))]
+
+
+def reduce_shards(results):
+    '''Merge per shard (confusion matrix state, loss sum, pixel count) into loss, mean IoU and mean accuracy'''
+    matrix = ConfusionMatrix.merge_all(ConfusionMatrix.from_state_dict(state) for state, _, _ in results)
+    loss = sum(loss_sum for _, loss_sum, _ in results) / max(sum(n for _, _, n in results), 1)
+    metrics = matrix.compute()
+    return loss, metrics['iou'][0], metrics['acc'][0]
+
+
+def cpu_snapshot(net):
+    return {k: v.detach().to('cpu', copy=True) for k, v in net.state_dict().items()}
+
+
+class ShardedEvaluator(object):
+    """
+    Evaluates a dataset split on a pool of CPU processes, each with its own thread budget.  The net is shipped to the
+    workers once, later evaluations only send a CPU snapshot of the weights.
+
+    With `block=False` in `submit` the evaluation runs in the background while training continues; finished results
+    are collected with `poll` or `wait`.
+    """
+
+    def __init__(self, net, dataset, n_classes, workers=2, threads_per_worker=None, batch_size=1,
+                 forward=default_forward, ignore_index=-100):
+        self.workers = workers
+        self.threads = threads_per_worker or max(1, torch.get_num_threads() // workers)
+        self.shards = shard_indices(len(dataset), workers)
+        template = copy.deepcopy(net).cpu()
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(template, dataset, n_classes, batch_size, self.threads, forward,
+                                                      ignore_index))
+        self.pending = []
+
+    def submit(self, net, tag=None, block=True):
+        state_dict = cpu_snapshot(net)
+        futures = [self.executor.submit(_eval_shard, indices, state_dict) for indices in self.shards]
+        if block:
+            return reduce_shards([future.result() for future in futures])
+        self.pending.append((tag, futures))
+
+    def poll(self):
+        '''Results of the background evaluations that have finished, in submission order'''
+        done = []
+        while self.pending and all(future.done() for future in self.pending[0][1]):
+            tag, futures = self.pending.pop(0)
+            done.append((tag, *reduce_shards([future.result() for future in futures])))
+        return done
+
+    def wait(self):
+        done = []
+        while self.pending:
+            tag, futures = self.pending.pop(0)
+            done.append((tag, *reduce_shards([future.result() for future in futures])))
+        return done
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sharded_eval(net, dataset, n_classes, workers=2, threads_per_worker=None, batch_size=1, forward=default_forward,
+                 ignore_index=-100):
+    """Loss, mean IoU and mean per class accuracy of `net` over `dataset`, sharded across CPU processes"""
+    with ShardedEvaluator(net, dataset, n_classes, workers=workers, threads_per_worker=threads_per_worker,
+                          batch_size=batch_size, forward=forward, ignore_index=ignore_index) as evaluator:
+        return evaluator.submit(net)
@@ -0,0 +1,88 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from src.compat import inference_mode
+from src.datasets.ice import Ice
+from src.export.onnx_export import ONNX_MODELS, build_model, export_onnx
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare ONNX Runtime outputs with PyTorch on ice crops.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-m', '--model', dest='model', type=str, default='small_dsc_unet',
+                        help='Model to check.', choices=ONNX_MODELS)
+    parser.add_argument('-f', '--load', dest='load', type=str, default=None,
+                        help='Load weights from a .pth file.')
+    parser.add_argument('--onnx', dest='onnx', type=str, default=None,
+                        help='Exported model to check, exported from the PyTorch model on the fly otherwise.  Needs '
+                             '--load with the weights it was exported from.')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.35,
+                        help='Downscaling factor of the images')
+    parser.add_argument('-c', '--crops', metavar='C', type=int, nargs='+', default=[256, 320],
+                        help='Crop sizes to check, several sizes exercise the dynamic spatial axes.', dest='crops')
+    parser.add_argument('-n', '--n-images', dest='n_images', type=int, default=8,
+                        help='Number of validation crops per size.')
+    parser.add_argument('--atol', dest='atol', type=float, default=1e-3,
+                        help='Largest absolute difference of the logits that passes the check.')
+    return parser.parse_args()
+
+
+def onnx_session(path):
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError('Checking ONNX models needs onnxruntime, install it with `pip install onnxruntime`.')
+    return onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+
+def check_parity(net, session, loader, n_images):
+    '''Largest absolute logit difference and fraction of pixels with the same predicted class, per image'''
+    net.eval()
+    rows = []
+    with inference_mode():
+        for i, batch in enumerate(loader):
+            if i == n_images:
+                break
+            imgs = batch['image'].float()
+            expected = net(imgs).numpy()
+            actual = session.run(None, {'image': imgs.numpy()})[0]
+            rows.append({
+                'max_abs_diff': float(np.abs(expected - actual).max()),
+                'agreement': float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean()),
+            })
+    return rows
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.onnx and not args.load:
+        raise ValueError('Please pass the weights the ONNX model was exported from with --load.')
+    torch.manual_seed(0)
+    net = build_model(args.model)
+    if args.load:
+        net.load_state_dict(torch.load(args.load, map_location='cpu'))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.onnx or export_onnx(net, args.model, os.path.join(tmp_dir, f'{args.model}.onnx'), args.crops[0])
+        session = onnx_session(path)
+
+        failed = False
+        for crop in args.crops:
+            val_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                          os.path.join(args.data_dir, 'txt_files'), 'val', args.scale, crop)
+            rows = check_parity(net, session, DataLoader(val_set, batch_size=1), args.n_images)
+            worst = max(row['max_abs_diff'] for row in rows)
+            agreement = min(row['agreement'] for row in rows)
+            failed |= worst > args.atol
+            print(f'{args.model} crop={crop}: {len(rows)} crops, max abs diff {worst:.2e}, '
+                  f'lowest class agreement {agreement:.4f}')
+
+    if failed:
+        raise SystemExit(f'ONNX outputs differ by more than the tolerance {args.atol:.0e}.')
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+
+import torch
+
+from src.compat import inference_mode
+from src.models.registry import MODELS, get_model, model_logits
+
+METHODS = ('script', 'trace')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Export registered models as TorchScript artifacts.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=list(MODELS),
+                        help='Models to export.', dest='models', choices=list(MODELS))
+    parser.add_argument('-f', '--load', dest='load', type=str, default=None,
+                        help='Load weights from a .pth file, only valid with a single model.')
+    parser.add_argument('--method', dest='method', type=str, default='script', choices=METHODS,
+                        help='torch.jit.script keeps control flow, torch.jit.trace records one run on an example.')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the example input used for tracing and the output check.')
+    parser.add_argument('--n-classes', dest='n_classes', type=int, default=3,
+                        help='Number of output classes.')
+    parser.add_argument('-o', '--output-dir', dest='output_dir', type=str, default='artifacts',
+                        help='Directory the <model>.pt artifacts are written to.')
+    return parser.parse_args()
+
+
+def script_model(model, example=None, method='script', freeze=True):
+    '''TorchScript module of `model` in eval mode, frozen so weights and attributes are inlined as constants'''
+    model.eval()
+    if method == 'script':
+        module = torch.jit.script(model)
+    elif method == 'trace':
+        if example is None:
+            raise ValueError('Tracing needs an example input.')
+        with torch.no_grad():
+            module = torch.jit.trace(model, example)
+    else:
+        raise ValueError(f'Please enter one of {", ".join(METHODS)} for method.  You entered {method}.')
+    return torch.jit.freeze(module) if freeze else module
+
+
+def export_torchscript(model, path, example=None, method='script', freeze=True, metadata=None):
+    '''Save `model` as a TorchScript artifact that `src.export.runtime` can run without any of this repository'''
+    module = script_model(model, example, method, freeze)
+    torch.jit.save(module, path, _extra_files={'metadata.json': json.dumps(metadata or {}, sort_keys=True)})
+    return module
+
+
+def compile_model(model, mode='default', dynamic=None):
+    '''In process torch.compile of `model`, the graph is compiled on the first call of every new input shape'''
+    if not hasattr(torch, 'compile'):
+        raise RuntimeError(f'torch.compile needs torch 2.0 or newer, this is torch {torch.__version__}.')
+    return torch.compile(model.eval(), mode=mode, dynamic=dynamic)
+
+
+def max_abs_diff(model, module, example):
+    with inference_mode():
+        return (model_logits(model(example)) - model_logits(module(example))).abs().max().item()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.load and len(args.models) > 1:
+        raise ValueError('Please export a single model when loading weights.')
+    os.makedirs(args.output_dir, exist_ok=True)
+    example = torch.randn(1, 3, args.crop, args.crop)
+
+    for name in args.models:
+        net = get_model(name, n_classes=args.n_classes)
+        if args.load:
+            net.load_state_dict(torch.load(args.load, map_location='cpu'))
+        net.eval()
+
+        path = os.path.join(args.output_dir, f'{name}.pt')
+        metadata = {'model': name, 'n_channels': 3, 'n_classes': args.n_classes, 'crop': args.crop,
+                    'method': args.method, 'torch': torch.__version__}
+        try:
+            module = export_torchscript(net, path, example, method=args.method, metadata=metadata)
+        except (RuntimeError, torch.jit.frontend.FrontendError) as e:
+            print(f'{name:>24}: export failed, {str(e).splitlines()[0]}')
+            continue
+        print(f'{name:>24}: {path}, max abs diff {max_abs_diff(net, module, example):.1e}')
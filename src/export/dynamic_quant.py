@@ -0,0 +1,97 @@
+import argparse
+import copy
+import os
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+from loguru import logger as log
+
+from src.benchmark.utils import environment, write_report
+from src.datasets.ice import Ice
+from src.export.quantize import report_row
+from src.models.registry import MODELS, get_model
+
+# the per token projections of SelfAttention and PropAttention and the pixel embedding of Embed
+ATTENTION_LINEARS = ('to_q', 'to_kv', 'to_out', 'embed')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Dynamic int8 quantization of the attention Linear layers with a '
+                                                 'throughput and IoU report against fp32.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+',
+                        default=['small_axial_lbc_unet', 'axial_unet'],
+                        help='Models to quantize.', dest='models', choices=list(MODELS))
+    parser.add_argument('-l', '--layers', metavar='L', type=str, nargs='+', default=list(ATTENTION_LINEARS),
+                        help='Names of the Linear layers to quantize.', dest='layers')
+    parser.add_argument('-w', '--weights-dir', dest='weights_dir', type=str, default=None,
+                        help='Directory with a <model>.pth checkpoint per model, random weights otherwise.')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.35,
+                        help='Downscaling factor of the images')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of images and masks.')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=1,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per latency measurement.', dest='repeats')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='dynamic_quantization_report.json',
+                        help='Path of the JSON report.', dest='output')
+    return parser.parse_args()
+
+
+def attention_linears(model, layers=ATTENTION_LINEARS):
+    '''Qualified names of the nn.Linear modules of `model` whose attribute name is in `layers`'''
+    return {name for name, module in model.named_modules()
+            if isinstance(module, nn.Linear) and name.rsplit('.', 1)[-1] in layers}
+
+
+def quantize_attention(model, layers=ATTENTION_LINEARS, dtype=torch.qint8):
+    """
+    Copy of `model` with the selected Linear layers dynamically quantized: int8 weights, activations quantized on the
+    fly per call.  Convolutions and everything else stay fp32, so the copy can replace the model anywhere on CPU.
+    """
+    try:
+        from torch.ao.quantization import quantize_dynamic
+    except ImportError:
+        # torch.ao arrived in 1.10, older torch has the same function under torch.quantization
+        from torch.quantization import quantize_dynamic
+
+    names = attention_linears(model, layers)
+    if not names:
+        raise ValueError(f'{type(model).__name__} has no Linear layers named {", ".join(layers)}.')
+    return quantize_dynamic(copy.deepcopy(model).eval(), qconfig_spec=names, dtype=dtype)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(0)
+    val_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                  os.path.join(args.data_dir, 'txt_files'), 'val', args.scale, args.crop)
+    val_loader = DataLoader(val_set, batch_size=args.batchsize)
+    imgs = torch.randn(args.batchsize, 3, args.crop, args.crop)
+
+    results = []
+    for name in args.models:
+        net = get_model(name)
+        weights = os.path.join(args.weights_dir, f'{name}.pth') if args.weights_dir else None
+        if weights and os.path.exists(weights):
+            net.load_state_dict(torch.load(weights, map_location='cpu'))
+        else:
+            log.warning(f'No checkpoint for {name}, the IoU of random weights only shows the int8 drift.')
+        net.eval()
+
+        quantized = quantize_attention(net, args.layers)
+        fp32, int8 = report_row(net, val_loader, imgs, args.repeats), report_row(quantized, val_loader, imgs,
+                                                                                 args.repeats)
+        for row in (fp32, int8):
+            row['img_per_s'] = args.batchsize * 1000 / row['forward_ms']['mean']
+        results.append({'model': name, 'layers': sorted(attention_linears(net, args.layers)), 'fp32': fp32,
+                        'int8': int8})
+        log.info(f"{name}: mIoU {fp32['miou']:.4f} -> {int8['miou']:.4f} ({int8['miou'] - fp32['miou']:+.4f}), "
+                 f"{fp32['img_per_s']:.2f} -> {int8['img_per_s']:.2f} img/s "
+                 f"(x{int8['img_per_s'] / fp32['img_per_s']:.2f})")
+
+    write_report(args.output, {'environment': environment(), 'results': results})
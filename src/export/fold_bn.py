@@ -0,0 +1,143 @@
+import argparse
+import copy
+
+import torch
+from torch import nn
+
+from src.benchmark.utils import time_fn
+from src.compat import inference_mode
+from src.models.basic_axial.basic_axial_parts import BlockAxial
+from src.models.basic_pga.basic_pga_parts import BlockPGA
+from src.models.dsc.dsc_unet import Conv2dDSC
+from src.models.lbcnn.lbcnn_parts import ConvLBP
+from src.models.registry import MODELS, get_model, model_logits
+
+# blocks whose forward applies the batch norm directly to the output of the conv
+ATTRIBUTE_PAIRS = {
+    BlockAxial: (('conv1', 'bn1'), ('conv2', 'bn2')),
+    BlockPGA: (('conv1', 'bn1'), ('conv2', 'bn2')),
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Fold BatchNorm into the preceding convolutions and check the outputs.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--model', dest='model', type=str, default='unet',
+                        help='Model to fold.', choices=list(MODELS))
+    parser.add_argument('-f', '--load', dest='load', type=str, default=None,
+                        help='Load model from a .pth file, otherwise batch norm statistics are drawn from random inputs.')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the input images.')
+    parser.add_argument('--atol', dest='atol', type=float, default=1e-4,
+                        help='Largest absolute difference of the logits that passes the check.')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per measurement.', dest='repeats')
+    parser.add_argument('-s', '--save', dest='save', type=str, default=None,
+                        help='Optional path to save the folded module to.')
+    return parser.parse_args()
+
+
+def _target_conv(module):
+    '''The conv whose output reaches the next module, if it can absorb a batch norm'''
+    if isinstance(module, Conv2dDSC):
+        module = module.depthwise_separable_conv[-1]
+    if isinstance(module, nn.Conv2d) and not isinstance(module, ConvLBP):
+        return module
+    return None
+
+
+def _foldable(conv, bn):
+    return (conv is not None and isinstance(bn, nn.BatchNorm2d) and bn.track_running_stats
+            and conv.out_channels == bn.num_features)
+
+
+def bn_affine(bn):
+    '''Per channel scale and shift an eval mode batch norm applies'''
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        shift = shift * bn.weight + bn.bias
+        scale = scale * bn.weight
+    return scale, shift
+
+
+def fold_conv_bn(conv, bn):
+    '''Fold the eval mode statistics and affine parameters of `bn` into `conv`, which must directly precede it'''
+    with torch.no_grad():
+        scale, shift = bn_affine(bn)
+
+        if conv.bias is None:
+            conv.bias = nn.Parameter(torch.zeros(conv.out_channels, dtype=conv.weight.dtype,
+                                                 device=conv.weight.device))
+        conv.weight.mul_(scale.reshape(-1, 1, 1, 1).to(conv.weight.dtype))
+        conv.bias.copy_(conv.bias * scale + shift)
+    return conv
+
+
+def fold_batch_norms(model, inplace=False):
+    """
+    Eval mode copy of `model` with every BatchNorm2d that directly follows a conv folded into that conv and replaced by
+    nn.Identity.  Pairs are found as consecutive entries of nn.Sequential (UNet, DSC, attention and torchvision blocks)
+    and as the conv/bn attributes listed in ATTRIBUTE_PAIRS.  Batch norms that follow a ReLU (BlockAxialLBC,
+    AxialDownLBC, ...) or precede a padded conv (the LBP blocks) cannot be folded exactly and are kept.
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model.eval()
+
+    for module in list(model.modules()):
+        if isinstance(module, nn.Sequential):
+            for i in range(len(module) - 1):
+                conv = _target_conv(module[i])
+                if _foldable(conv, module[i + 1]):
+                    fold_conv_bn(conv, module[i + 1])
+                    module[i + 1] = nn.Identity()
+
+        for conv_name, bn_name in ATTRIBUTE_PAIRS.get(type(module), ()):
+            conv = _target_conv(getattr(module, conv_name))
+            if _foldable(conv, getattr(module, bn_name)):
+                fold_conv_bn(conv, getattr(module, bn_name))
+                setattr(module, bn_name, nn.Identity())
+
+    return model
+
+
+def count_batch_norms(model):
+    return sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in model.modules())
+
+
+def max_abs_diff(model, folded, *inputs):
+    model.eval()
+    folded.eval()
+    with inference_mode():
+        return (model_logits(model(*inputs)) - model_logits(folded(*inputs))).abs().max().item()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    torch.manual_seed(0)
+    net = get_model(args.model)
+    imgs = torch.randn(1, 3, args.crop, args.crop)
+
+    if args.load:
+        net.load_state_dict(torch.load(args.load, map_location='cpu'))
+    else:
+        # freshly initialised batch norms are identities, give them statistics worth folding
+        net.train()
+        with torch.no_grad():
+            for _ in range(3):
+                net(torch.randn(2, 3, args.crop, args.crop) * 2 + 1)
+
+    folded = fold_batch_norms(net)
+    diff = max_abs_diff(net, folded, imgs)
+
+    with inference_mode():
+        before = time_fn(lambda: net(imgs), repeats=args.repeats)
+        after = time_fn(lambda: folded(imgs), repeats=args.repeats)
+
+    print(f'{args.model}: batch norms {count_batch_norms(net)} -> {count_batch_norms(folded)}, '
+          f'max abs diff {diff:.2e}, forward {before["mean"]:.1f} ms -> {after["mean"]:.1f} ms')
+    if diff > args.atol:
+        raise SystemExit(f'Folded outputs differ by {diff:.2e}, more than the tolerance {args.atol:.0e}.')
+    if args.save:
+        torch.save(folded, args.save)
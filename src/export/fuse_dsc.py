@@ -0,0 +1,126 @@
+import copy
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from src.export.fold_bn import bn_affine, fold_conv_bn
+from src.models.dsc.dsc_lbc_unet import DSCBlockLBP, DSCDSCBlockLBPUNet
+from src.models.dsc.dsc_unet import Conv2dDSC, DoubleConvDSC
+
+
+class FusedConv2dDSC(nn.Module):
+    """
+    Inference form of Conv2dDSC followed by BatchNorm2d and ReLU: the depthwise bias and the batch norm are folded into
+    the pointwise conv and the ReLU runs in place, so one conv pair and no intermediate normalised activation remain.
+    """
+
+    def __init__(self, dsc, bn=None, relu=True, channels_last=True):
+        super(FusedConv2dDSC, self).__init__()
+        self.relu = relu
+        self.channels_last = channels_last
+
+        depth_conv = copy.deepcopy(dsc.depthwise_separable_conv[0])
+        point_conv = copy.deepcopy(dsc.depthwise_separable_conv[1])
+        with torch.no_grad():
+            if depth_conv.bias is not None:
+                if point_conv.bias is None:
+                    point_conv.bias = nn.Parameter(torch.zeros(point_conv.out_channels, dtype=point_conv.weight.dtype,
+                                                               device=point_conv.weight.device))
+                point_conv.bias.add_(point_conv.weight.flatten(1) @ depth_conv.bias)
+                depth_conv.bias = None
+        if bn is not None:
+            fold_conv_bn(point_conv, bn)
+        self.depth_conv = depth_conv
+        self.point_conv = point_conv
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = self.point_conv(self.depth_conv(x))
+        if self.relu:
+            x = torch.relu_(x)
+        return x
+
+
+class FusedDSCBlockLBP(nn.Module):
+    """
+    Inference form of DSCBlockLBP and DSCDSCBlockLBPUNet.  The pre batch norm is an affine map per channel, so it moves
+    through the depthwise LBP conv exactly: the scale goes into the conv weight and the shift becomes the conv of a
+    constant image, a map that only depends on the input size and is cached.  This drops the normalised copy of the
+    input that the block otherwise allocates.
+    """
+
+    def __init__(self, block, channels_last=True):
+        super(FusedDSCBlockLBP, self).__init__()
+        self.residual_last = isinstance(block, DSCBlockLBP)
+        self.channels_last = channels_last
+
+        conv_lbp = block.conv_lbp
+        scale, shift = bn_affine(block.batch_norm)
+        repeats = conv_lbp.out_channels // conv_lbp.in_channels
+        self.conv = nn.Conv2d(conv_lbp.in_channels, conv_lbp.out_channels, conv_lbp.kernel_size,
+                              padding=conv_lbp.padding, groups=conv_lbp.groups, bias=False)
+        with torch.no_grad():
+            self.conv.weight.copy_(conv_lbp.weight * scale.repeat_interleave(repeats).reshape(-1, 1, 1, 1))
+        self.conv.weight.requires_grad_(False)
+        self.register_buffer('lbp_weight', conv_lbp.weight.detach().clone())
+        self.register_buffer('shift', shift.detach().clone())
+        self.conv_1x1 = copy.deepcopy(block.conv_1x1)
+        self._shift_maps = {}
+
+    def shift_map(self, x):
+        key = (x.shape[-2], x.shape[-1], x.device, x.dtype)
+        if key not in self._shift_maps:
+            const = self.shift.to(x.dtype).reshape(1, -1, 1, 1).expand(1, -1, x.shape[-2], x.shape[-1])
+            self._shift_maps[key] = F.conv2d(const, self.lbp_weight.to(x.dtype), padding=self.conv.padding,
+                                             groups=self.conv.groups)
+        return self._shift_maps[key]
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        res = x
+        x = torch.relu_(self.conv(x).add_(self.shift_map(x)))
+        if self.residual_last:
+            x = self.conv_1x1(x)
+            x.add_(res)
+        else:
+            x.add_(res)
+            x = self.conv_1x1(x)
+        return x
+
+
+def _fuse_double_conv(double_conv, channels_last):
+    layers = list(double_conv)
+    fused = []
+    i = 0
+    while i < len(layers):
+        if isinstance(layers[i], Conv2dDSC):
+            bn = layers[i + 1] if i + 1 < len(layers) and isinstance(layers[i + 1], nn.BatchNorm2d) else None
+            j = i + 1 + (bn is not None)
+            relu = j < len(layers) and isinstance(layers[j], nn.ReLU)
+            fused.append(FusedConv2dDSC(layers[i], bn, relu, channels_last))
+            i = j + relu
+        else:
+            fused.append(layers[i])
+            i += 1
+    return nn.Sequential(*fused)
+
+
+def fuse_dsc(model, channels_last=True):
+    """
+    Eval mode copy of a UNetDSC, SmallUNetDSC, DSCUNetLBP or DSCSmallUNetLBP for inference: every DoubleConvDSC becomes
+    two FusedConv2dDSC and every DSC LBP block a FusedDSCBlockLBP.  With `channels_last` the weights are converted and
+    the fused modules keep activations in channels last layout, which the CPU convolution kernels prefer.
+    """
+    model = copy.deepcopy(model).eval()
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, DoubleConvDSC):
+                child.double_conv = _fuse_double_conv(child.double_conv, channels_last)
+            elif isinstance(child, (DSCBlockLBP, DSCDSCBlockLBPUNet)):
+                setattr(module, name, FusedDSCBlockLBP(child, channels_last))
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
@@ -0,0 +1,105 @@
+import argparse
+import inspect
+import os
+
+import torch
+
+from src.models.basic_pga.basic_pga_net import BasicAxialPGA, OnlyPGA, BigOnlyPGA
+from src.models.registry import get_model
+
+# the UNet, DSC, LBC and axial families, the torchvision models return dicts and are served through torchvision
+ONNX_MODELS = ['unet', 'small_unet', 'dsc_unet', 'small_dsc_unet', 'lbc_unet', 'small_lbc_unet', 'dsc_lbc_unet',
+               'small_dsc_lbc_unet', 'axial_unet', 'small_axial_unet', 'axial_lbc_unet', 'small_axial_lbc_unet',
+               'small_axial_lbc_unet_10']
+
+# proposal guided models route attention through a fixed crop, so only the batch axis is dynamic
+PGA_MODELS = {
+    'basic_axial_pga': lambda n_classes, crop: BasicAxialPGA(3, n_classes, 32, img_crop=crop),
+    'only_pga': lambda n_classes, crop: OnlyPGA(3, n_classes, 32, img_crop=crop),
+    'big_only_pga': lambda n_classes, crop: BigOnlyPGA(3, n_classes, 32, img_crop=crop),
+}
+
+
+def default_opset():
+    '''Opset the installed TorchScript exporter writes by default, its main opset on torch before the constant existed'''
+    try:
+        from torch.onnx._constants import ONNX_DEFAULT_OPSET
+        return ONNX_DEFAULT_OPSET
+    except ImportError:
+        from torch.onnx.symbolic_helper import _onnx_main_opset
+        return _onnx_main_opset
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Export models to ONNX with dynamic batch and spatial axes.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=ONNX_MODELS,
+                        help='Models to export.', dest='models', choices=ONNX_MODELS + list(PGA_MODELS))
+    parser.add_argument('-f', '--load', dest='load', type=str, default=None,
+                        help='Load weights from a .pth file, only valid with a single model.')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of the example input, the fixed crop of PGA models.')
+    parser.add_argument('--n-classes', dest='n_classes', type=int, default=3,
+                        help='Number of output classes.')
+    parser.add_argument('--opset', dest='opset', type=int, default=default_opset(),
+                        help='ONNX opset version, the default of the installed exporter.')
+    parser.add_argument('-o', '--output-dir', dest='output_dir', type=str, default='onnx',
+                        help='Directory the <model>.onnx files are written to.')
+    return parser.parse_args()
+
+
+def build_model(name, n_classes=3, crop=256):
+    if name in PGA_MODELS:
+        return PGA_MODELS[name](n_classes, crop)
+    return get_model(name, n_classes=n_classes)
+
+
+def example_inputs(name, crop, batch_size=1):
+    '''Example inputs of the model, PGA models also take the object and background routing index'''
+    imgs = torch.randn(batch_size, 3, crop, crop)
+    if name not in PGA_MODELS:
+        return (imgs,)
+    pixels = torch.arange(crop ** 2)
+    is_obj = (pixels // crop) < crop // 3
+    obj_index, bg_index = [p.repeat(-(-crop ** 2 // len(p)))[:crop ** 2] for p in (pixels[is_obj], pixels[~is_obj])]
+    return imgs, obj_index.expand(batch_size, -1), bg_index.expand(batch_size, -1)
+
+
+def export_onnx(model, name, path, crop=256, opset=None):
+    model.eval()
+    opset = opset or default_opset()
+    inputs = example_inputs(name, crop)
+    if name in PGA_MODELS:
+        input_names = ['image', 'obj_index', 'bg_index']
+        dynamic_axes = {'image': {0: 'batch'}, 'obj_index': {0: 'batch'}, 'bg_index': {0: 'batch'},
+                        'logits': {0: 'batch'}}
+    else:
+        input_names = ['image']
+        dynamic_axes = {'image': {0: 'batch', 2: 'height', 3: 'width'},
+                        'logits': {0: 'batch', 2: 'height', 3: 'width'}}
+
+    # the dynamo exporter of newer torch down converts graphs ONNX Runtime then rejects, the TorchScript one is exact
+    legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(model, inputs, path, input_names=input_names, output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **legacy)
+    return path
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.load and len(args.models) > 1:
+        raise ValueError('Please export a single model when loading weights.')
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for name in args.models:
+        net = build_model(name, args.n_classes, args.crop)
+        if args.load:
+            net.load_state_dict(torch.load(args.load, map_location='cpu'))
+        path = os.path.join(args.output_dir, f'{name}.onnx')
+        try:
+            export_onnx(net, name, path, args.crop, args.opset)
+        except Exception as e:
+            print(f'{name:>24}: export failed, {str(e).splitlines()[0]}')
+            continue
+        print(f'{name:>24}: {path}')
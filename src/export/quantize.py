@@ -0,0 +1,164 @@
+import argparse
+import copy
+import os
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+from loguru import logger as log
+
+from src.benchmark.utils import time_fn, environment, write_report
+from src.compat import inference_mode
+from src.datasets.ice import Ice
+from src.eval.engine import evaluate
+from src.models.lbcnn.lbcnn_parts import ConvLBP
+from src.models.registry import get_model
+
+QUANT_MODELS = ['small_dsc_unet', 'small_lbc_unet', 'small_dsc_lbc_unet']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Post training static int8 quantization with an mIoU and latency '
+                                                 'report against fp32.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d', '--data_directory', metavar='D', type=str, default='/home/dsola/repos/PGA-Net/data/',
+                        help='Directory where images, masks, and txt files reside.', dest='data_dir')
+    parser.add_argument('-m', '--models', metavar='M', type=str, nargs='+', default=QUANT_MODELS,
+                        help='Models to quantize.', dest='models', choices=QUANT_MODELS)
+    parser.add_argument('-w', '--weights-dir', dest='weights_dir', type=str, default=None,
+                        help='Directory with a <model>.pth checkpoint per model, random weights otherwise.')
+    parser.add_argument('-s', '--scale', dest='scale', type=float, default=0.35,
+                        help='Downscaling factor of the images')
+    parser.add_argument('-c', '--crop', dest='crop', type=int, default=256,
+                        help='Height and width of images and masks.')
+    parser.add_argument('-n', '--calibration-batches', dest='calibration_batches', type=int, default=32,
+                        help='Number of train batches the observers see.')
+    parser.add_argument('-b', '--batch-size', metavar='B', type=int, default=4,
+                        help='Batch size', dest='batchsize')
+    parser.add_argument('--backend', dest='backend', type=str, default='x86',
+                        help='Quantized engine, x86 or fbgemm on servers, qnnpack on ARM.')
+    parser.add_argument('-r', '--repeats', metavar='R', type=int, default=10,
+                        help='Timed iterations per latency measurement.', dest='repeats')
+    parser.add_argument('--min-agreement', dest='min_agreement', type=float, default=0.9,
+                        help='Warn when int8 and fp32 predict the same class on fewer pixels than this fraction.')
+    parser.add_argument('-o', '--output', metavar='O', type=str, default='quantization_report.json',
+                        help='Path of the JSON report.', dest='output')
+    parser.add_argument('--save-dir', dest='save_dir', type=str, default=None,
+                        help='Optional directory to save the int8 models to as TorchScript.')
+    return parser.parse_args()
+
+
+def plain_lbp_convs(model):
+    """
+    Replace every ConvLBP by an nn.Conv2d with the same frozen weights so quantization treats it like any conv: it
+    gets a per channel int8 weight, which represents the ternary weights exactly, and fuses with the following ReLU.
+    """
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, ConvLBP):
+                conv = nn.Conv2d(child.in_channels, child.out_channels, child.kernel_size, stride=child.stride,
+                                 padding=child.padding, dilation=child.dilation, groups=child.groups, bias=False)
+                conv.weight = nn.Parameter(child.weight.detach().clone(), requires_grad=False)
+                setattr(module, name, conv)
+    return model
+
+
+def calibrate(model, loader, n_batches):
+    model.eval()
+    with torch.no_grad():
+        for i, batch in enumerate(loader):
+            if i == n_batches:
+                break
+            model(batch['image'].float())
+
+
+def unused_ops(graph_module):
+    '''Ops of an FX graph whose result nothing reads, e.g. an in place x.add_(res), which convert_fx drops'''
+    return [node.name for node in graph_module.graph.nodes
+            if node.op in ('call_function', 'call_method', 'call_module') and not node.users]
+
+
+def argmax_agreement(model, quantized, imgs):
+    '''Fraction of pixels of `imgs` where the quantized model predicts the same class as `model`'''
+    with inference_mode():
+        return (model(imgs).argmax(dim=1) == quantized(imgs).argmax(dim=1)).float().mean().item()
+
+
+def check_fx_quantization():
+    '''QConfigMapping FX quantization and the x86 engine are only in torch 1.13 or newer'''
+    try:
+        from torch.ao.quantization import get_default_qconfig_mapping  # noqa: F401
+    except ImportError:
+        raise RuntimeError(f'Static quantization needs torch 1.13 or newer, this is torch {torch.__version__}.') \
+            from None
+
+
+def quantize_static(model, calibration_loader, n_batches=32, backend='x86', example_inputs=None):
+    """
+    int8 copy of `model` through FX graph mode quantization: conv-bn-relu patterns are fused, observers record
+    activation ranges over `n_batches` calibration batches, and the result runs quantized kernels on CPU.
+    """
+    check_fx_quantization()
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    model = plain_lbp_convs(copy.deepcopy(model)).eval()
+    if example_inputs is None:
+        example_inputs = (next(iter(calibration_loader))['image'].float(),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs)
+    dropped = unused_ops(prepared)
+    if dropped:
+        raise RuntimeError(f'{type(model).__name__} has ops whose results are never used, the int8 model would lose '
+                           f'them: {", ".join(dropped)}.  Write in place updates like x.add_(res) as x = x + res.')
+    calibrate(prepared, calibration_loader, n_batches)
+    return convert_fx(prepared)
+
+
+def report_row(net, val_loader, imgs, repeats):
+    loss, iou, acc = evaluate(net, val_loader, 'cpu', n_classes=3)
+    with inference_mode():
+        latency = time_fn(lambda: net(imgs), repeats=repeats)
+    return {'loss': loss, 'miou': iou.item(), 'acc': acc.item(), 'forward_ms': latency}
+
+
+if __name__ == '__main__':
+    args = get_args()
+    check_fx_quantization()
+    torch.manual_seed(0)
+    train_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                    os.path.join(args.data_dir, 'txt_files'), 'train', args.scale, args.crop)
+    val_set = Ice(os.path.join(args.data_dir, 'imgs'), os.path.join(args.data_dir, 'masks'),
+                  os.path.join(args.data_dir, 'txt_files'), 'val', args.scale, args.crop)
+    calibration_loader = DataLoader(train_set, batch_size=args.batchsize, shuffle=True)
+    val_loader = DataLoader(val_set, batch_size=args.batchsize)
+    imgs = torch.randn(1, 3, args.crop, args.crop)
+
+    results = []
+    for name in args.models:
+        net = get_model(name)
+        weights = os.path.join(args.weights_dir, f'{name}.pth') if args.weights_dir else None
+        if weights and os.path.exists(weights):
+            net.load_state_dict(torch.load(weights, map_location='cpu'))
+        else:
+            log.warning(f'No checkpoint for {name}, the mIoU of random weights only shows the int8 drift.')
+        net.eval()
+
+        quantized = quantize_static(net, calibration_loader, args.calibration_batches, args.backend)
+        # the same network in int8 agrees with fp32 on nearly every pixel, a low agreement is a conversion bug
+        agreement = argmax_agreement(net, quantized, next(iter(val_loader))['image'].float())
+        if agreement < args.min_agreement:
+            log.warning(f'{name}: int8 predicts the fp32 class on only {100 * agreement:.1f}% of pixels, the '
+                        f'converted graph probably differs from the model.')
+        fp32, int8 = report_row(net, val_loader, imgs, args.repeats), report_row(quantized, val_loader, imgs,
+                                                                                 args.repeats)
+        results.append({'model': name, 'fp32': fp32, 'int8': int8, 'argmax_agreement': agreement})
+        log.info(f"{name}: mIoU {fp32['miou']:.4f} -> {int8['miou']:.4f}, forward {fp32['forward_ms']['mean']:.1f} "
+                 f"-> {int8['forward_ms']['mean']:.1f} ms (x{fp32['forward_ms']['mean'] / int8['forward_ms']['mean']:.2f})")
+
+        if args.save_dir:
+            os.makedirs(args.save_dir, exist_ok=True)
+            torch.jit.save(torch.jit.trace(quantized, imgs), os.path.join(args.save_dir, f'{name}_int8.pt'))
+
+    write_report(args.output, {'environment': environment(), 'backend': args.backend,
+                               'calibration_batches': args.calibration_batches, 'results': results})
@@ -0,0 +1,65 @@
+"""
+Runs TorchScript artifacts written by src/export/compile.py.  Only torch and numpy are imported, so this file can be
+copied next to an artifact and used on a machine without the training code.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Segment an image with an exported TorchScript artifact.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('artifact', type=str, help='Path of the .pt artifact.')
+    parser.add_argument('-i', '--input', dest='input', type=str, default=None,
+                        help='Normalised (C, H, W) float image as .npy, a random image of the exported crop otherwise.')
+    parser.add_argument('-o', '--output', dest='output', type=str, default=None,
+                        help='Optional .npy path of the predicted (H, W) class map.')
+    parser.add_argument('-dev', '--device', dest='device', type=str, default='cpu',
+                        help='Run on gpu vs cpu.')
+    return parser.parse_args()
+
+
+def load_artifact(path, device='cpu'):
+    '''The scripted module and the metadata stored with it'''
+    extra_files = {'metadata.json': ''}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    module.eval()
+    return module, json.loads(extra_files['metadata.json'] or '{}')
+
+
+def predict(module, imgs):
+    '''Class map of a (B, C, H, W) batch'''
+    with inference_mode():
+        out = module(imgs)
+        if isinstance(out, dict):
+            out = out['out']
+        return out.argmax(dim=1)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    start = time.perf_counter()
+    module, metadata = load_artifact(args.artifact, args.device)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    if args.input:
+        imgs = torch.from_numpy(np.load(args.input)).float().unsqueeze(0)
+    else:
+        crop = metadata.get('crop', 256)
+        imgs = torch.randn(1, metadata.get('n_channels', 3), crop, crop)
+    imgs = imgs.to(args.device)
+
+    start = time.perf_counter()
+    pred = predict(module, imgs)
+    first_ms = (time.perf_counter() - start) * 1000
+    print(f"{metadata.get('model', args.artifact)}: load {load_ms:.0f} ms, first forward {first_ms:.0f} ms, "
+          f"class counts {torch.bincount(pred.flatten().cpu()).tolist()}")
+
+    if args.output:
+        np.save(args.output, pred[0].cpu().numpy().astype(np.uint8))
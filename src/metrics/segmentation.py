@@ -1,4 +1,5 @@
 import torch
+import torch.distributed as dist
 
 EPS = 1e-10
 
@@ -7,15 +8,20 @@ def nanmean(x):
     return torch.mean(x[x == x])
 
 
-def _fast_hist(true, pred, num_classes):
+def _hist_counts(true, pred, num_classes):
+    true, pred = true.flatten().long(), pred.flatten().long()
     mask = (true >= 0) & (true < num_classes)
     hist = torch.bincount(
         num_classes * true[mask] + pred[mask],
         minlength=num_classes ** 2,
-    ).reshape(num_classes, num_classes).float()
+    ).reshape(num_classes, num_classes)
     return hist
 
 
+def _fast_hist(true, pred, num_classes):
+    return _hist_counts(true, pred, num_classes).float()
+
+
 def overall_pixel_accuracy(hist):
     correct = torch.diag(hist).sum()
     total = hist.sum()
@@ -38,3 +44,74 @@ def jaccard_index(hist):
     jaccard = A_inter_B / (A + B - A_inter_B + EPS)
     avg_jacc = nanmean(jaccard)
     return avg_jacc, jaccard
+
+
+def f1_score(hist):
+    A_inter_B = torch.diag(hist)
+    A = hist.sum(dim=1)
+    B = hist.sum(dim=0)
+    f1 = 2 * A_inter_B / (A + B + EPS)
+    avg_f1 = nanmean(f1)
+    return avg_f1, f1
+
+
+class ConfusionMatrix(object):
+    """
+    Running confusion matrix for a whole loader.  Counts stay on the device of the predictions and the metrics are
+    only computed from the accumulated matrix, so mIoU is not an average of per-batch IoUs.
+    """
+
+    def __init__(self, num_classes, device=None):
+        self.num_classes = num_classes
+        self.hist = torch.zeros(num_classes, num_classes, dtype=torch.long, device=device)
+
+    def update(self, true, pred):
+        '''Add a batch of targets and predicted labels of any shape'''
+        self.hist += _hist_counts(true.to(self.hist.device), pred.to(self.hist.device), self.num_classes)
+        return self
+
+    def merge(self, other):
+        '''Add the counts of another matrix, e.g. one built by a different process'''
+        if other.num_classes != self.num_classes:
+            raise ValueError(f'Cannot merge confusion matrices with {self.num_classes} and {other.num_classes} classes.')
+        self.hist += other.hist.to(self.hist.device)
+        return self
+
+    def all_reduce(self):
+        '''Sum the counts over all processes of an initialised torch.distributed group'''
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.hist)
+        return self
+
+    def reset(self):
+        self.hist.zero_()
+
+    @classmethod
+    def merge_all(cls, matrices):
+        matrices = list(matrices)
+        merged = cls(matrices[0].num_classes)
+        for matrix in matrices:
+            merged.merge(matrix)
+        return merged
+
+    def state_dict(self):
+        return {'num_classes': self.num_classes, 'hist': self.hist.cpu()}
+
+    @classmethod
+    def from_state_dict(cls, state, device=None):
+        matrix = cls(state['num_classes'], device=device)
+        matrix.hist.copy_(state['hist'])
+        return matrix
+
+    def total(self):
+        return self.hist.sum()
+
+    def compute(self):
+        '''IoU, per class accuracy, F1 and overall accuracy of everything accumulated so far'''
+        hist = self.hist.double()
+        return {
+            'iou': jaccard_index(hist),
+            'acc': per_class_pixel_accuracy(hist),
+            'f1': f1_score(hist),
+            'pixel_acc': overall_pixel_accuracy(hist),
+        }
@@ -1,6 +1,25 @@
+import functools
+import inspect
+from typing import List, Optional
+
 import torch
+import torch.nn.functional as F
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 from operator import itemgetter
+from src.models.parallel import run_branches
+
+
+# non reentrant checkpointing (torch 1.11+) backpropagates into the parameters even when no input requires grad, older
+# torch only has the reentrant one
+NON_REENTRANT_CHECKPOINT = 'use_reentrant' in inspect.signature(checkpoint).parameters
+
+
+def checkpointed(function, *args):
+    '''torch.utils.checkpoint of `function`, non reentrant where the installed torch supports it'''
+    if NON_REENTRANT_CHECKPOINT:
+        return checkpoint(function, *args, use_reentrant=False)
+    return checkpoint(function, *args)
 
 
 def map_el_ind(arr, ind):
@@ -30,6 +49,13 @@ def calculate_permutations(num_dimensions, emb_dim):
     return permutations
 
 
+def contiguous_like(t, x):
+    '''`t` made contiguous in the memory format of `x`, so channels last activations stay channels last'''
+    if x.dim() == 4 and not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last):
+        return t.contiguous(memory_format=torch.channels_last)
+    return t.contiguous()
+
+
 class Rezero(nn.Module):
     def __init__(self, fn):
         super().__init__()
@@ -59,26 +85,115 @@ class PermuteToFrom(nn.Module):
         self.permutation = permutation
         self.inv_permutation = inv_permutation
 
-    def forward(self, x, **kwargs):
-        axial = x.permute(*self.permutation).contiguous()
+    def forward(self, x):
+        axial = x.permute(self.permutation).contiguous()
 
         shape = axial.shape
-        *_, t, d = shape
+        t, d = shape[-2], shape[-1]
 
         # merge all but axial dimension
         axial = axial.reshape(-1, t, d)
 
         # attention
-        axial = self.fn(axial, **kwargs)
+        axial = self.fn(axial)
 
         # restore to original shape and permutation
-        axial = axial.reshape(*shape)
-        axial = axial.permute(*self.inv_permutation).contiguous()
+        axial = axial.reshape(shape)
+        axial = contiguous_like(axial.permute(self.inv_permutation), x)
         return axial
 
 
+def full_attention(q, k, v, mask: Optional[torch.Tensor] = None):
+    '''softmax(q k^T / sqrt(e)) v over sequences (n, t, e), keys where the (n, t) `mask` is False are ignored'''
+    dots = torch.einsum('bie,bje->bij', q, k) * (q.shape[-1] ** -0.5)
+    if mask is not None:
+        dots = dots.masked_fill(~mask.unsqueeze(1), -1e4 if dots.dtype == torch.float16 else -1e9)
+    dots = dots.softmax(dim=-1)
+    return torch.einsum('bij,bje->bie', dots, v)
+
+
+def linear_attention(q, k, v, mask: Optional[torch.Tensor] = None, eps: float = 1e-6):
+    """
+    Kernelized attention with the elu(x) + 1 feature map over sequences of shape (n, t, e): phi(q) (phi(k)^T v)
+    normalised by phi(q) sum_j phi(k_j).  The (e, e) key value summary replaces the (t, t) score matrix, so time and
+    memory grow linearly with t.  Keys where the (n, t) `mask` is False are left out of the summary.
+    """
+    q, k = F.elu(q) + 1, F.elu(k) + 1
+    if mask is not None:
+        k = k * mask.unsqueeze(-1).to(k.dtype)
+    kv = torch.einsum('bje,bjf->bef', k, v)
+    normaliser = 1 / (torch.einsum('bie,be->bi', q, k.sum(dim=1)) + eps)
+    return torch.einsum('bie,bef,bi->bif', q, kv, normaliser)
+
+
+# attention kernels selectable by name on SelfAttention, PropAttention and the blocks built on them
+ATTENTION_BACKENDS = ('softmax', 'linear')
+
+
+def check_backend(backend):
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f'Please enter a valid attention backend, one of {", ".join(ATTENTION_BACKENDS)}.  You '
+                         f'entered {backend}.')
+    return backend
+
+
+KV_POOL_MODES = ('avg', 'stride')
+
+
+def pool_tokens(x, factor: int, mode: str = 'avg'):
+    '''Shorten token sequences (n, t, d) by `factor` with an average over every `factor` tokens or every factor-th'''
+    if mode == 'stride':
+        return x[:, ::factor]
+    return F.avg_pool1d(x.transpose(1, 2), factor, factor, ceil_mode=True).transpose(1, 2)
+
+
+def _interleave(z, dilation: int):
+    # (n, t, e) -> (n * dilation, t // dilation, e), one sequence per offset of every dilation-th position
+    n, t, e = z.shape[0], z.shape[1], z.shape[2]
+    return z.reshape(n, t // dilation, dilation, e).transpose(1, 2).reshape(n * dilation, t // dilation, e)
+
+
+def _key_blocks(z, window: int, overlap: int, value: float = 0.):
+    # (n, t, e) -> (n, t // window, window + 2 * overlap, e), each block with its overlap on either side
+    z = F.pad(z, (0, 0, overlap, overlap), value=value)
+    return z.unfold(1, window + 2 * overlap, window).transpose(2, 3)
+
+
+def windowed_attention(q, k, v, window: int, overlap: int = 0, dilation: int = 1):
+    """
+    Local attention over sequences of shape (n, t, e).  The sequence is split into blocks of `window` positions and
+    every query attends to the keys of its own block plus `overlap` positions on either side, so the cost is linear in
+    t.  With `dilation` > 1 the blocks are taken over every `dilation`-th position, a window then spans
+    window * dilation pixels.  Positions padded up to a whole number of blocks are masked out of the keys.
+    """
+    n, t, e = q.shape[0], q.shape[1], q.shape[2]
+    span = window * dilation
+    padded = -(-t // span) * span
+    if padded != t:
+        q, k, v = F.pad(q, (0, 0, 0, padded - t)), F.pad(k, (0, 0, 0, padded - t)), F.pad(v, (0, 0, 0, padded - t))
+    q, k, v = _interleave(q, dilation), _interleave(k, dilation), _interleave(v, dilation)
+
+    blocks = padded // span
+    q = q.reshape(n * dilation, blocks, window, e)
+    k, v = _key_blocks(k, window, overlap), _key_blocks(v, window, overlap)
+
+    # original position of every key, padding and overlap beyond the ends are >= t
+    positions = torch.arange(padded, device=q.device).reshape(1, padded, 1)
+    positions = _key_blocks(_interleave(positions, dilation), window, overlap, float(padded)).squeeze(-1)
+    valid = (positions < t).repeat(n, 1, 1).unsqueeze(2)
+
+    dots = torch.einsum('bnie,bnje->bnij', q, k) * (e ** -0.5)
+    dots = dots.masked_fill(~valid, -1e4 if dots.dtype == torch.float16 else -1e9)
+    dots = dots.softmax(dim=-1)
+    out = torch.einsum('bnij,bnje->bnie', dots, v)
+
+    out = out.reshape(n, dilation, padded // dilation, e).transpose(1, 2).reshape(n, padded, e)
+    return out[:, :t]
+
+
 class SelfAttention(nn.Module):
-    def __init__(self, dim, heads, dim_heads=None):
+    def __init__(self, dim, heads, dim_heads=None, window=0, overlap=0, dilation=1, backend='softmax', kv_pool=1,
+                 kv_pool_mode='avg'):
         super().__init__()
         self.dim_heads = (dim // heads) if dim_heads is None else dim_heads
         dim_hidden = self.dim_heads * heads
@@ -87,46 +202,172 @@ class SelfAttention(nn.Module):
         self.to_q = nn.Linear(dim, dim_hidden, bias=False)
         self.to_kv = nn.Linear(dim, 2 * dim_hidden, bias=False)
         self.to_out = nn.Linear(dim_hidden, dim)
-
-    def forward(self, x, kv=None):
+        self.window, self.overlap, self.dilation = 0, 0, 1
+        self.kv_pool, self.kv_pool_mode = 1, 'avg'
+        self.set_window(window, overlap, dilation)
+        self.backend = check_backend(backend)
+        self.set_kv_pool(kv_pool, kv_pool_mode)
+
+    def set_window(self, window, overlap=0, dilation=1):
+        """
+        Attend within `window` positions (plus `overlap` on each side, every `dilation`-th), 0 for dense.  Windows and
+        key/value pooling exclude each other, and the linear backend always attends to the whole axis.
+        """
+        if window < 0 or overlap < 0 or dilation < 1:
+            raise ValueError(f'Expected window >= 0, overlap >= 0 and dilation >= 1, got {window}, {overlap} and '
+                             f'{dilation}.')
+        if window > 0 and self.kv_pool > 1:
+            raise ValueError(f'Please turn off key/value pooling (factor {self.kv_pool}) before setting a window.')
+        self.window, self.overlap, self.dilation = int(window), int(overlap), int(dilation)
+
+    def set_kv_pool(self, factor, mode='avg'):
+        '''Attend to keys and values pooled along the sequence by `factor`, 1 keeps every token; excludes windows'''
+        if factor < 1 or mode not in KV_POOL_MODES:
+            raise ValueError(f'Expected a pooling factor >= 1 and a mode in {", ".join(KV_POOL_MODES)}, got {factor} '
+                             f'and {mode}.')
+        if factor > 1 and self.window > 0:
+            raise ValueError(f'Please turn off windowed attention (window {self.window}) before pooling keys and '
+                             f'values.')
+        self.kv_pool, self.kv_pool_mode = int(factor), mode
+
+    def merge_heads(self, x):
+        b, h, e = x.shape[0], self.heads, self.dim_heads
+        return x.reshape(b, -1, h, e).transpose(1, 2).reshape(b * h, -1, e)
+
+    def forward(self, x, kv: Optional[torch.Tensor] = None):
         kv = x if kv is None else kv
-        q, k, v = (self.to_q(x), *self.to_kv(kv).chunk(2, dim=-1))
-
-        b, t, d, h, e = *q.shape, self.heads, self.dim_heads
-        merge_heads = lambda x: x.reshape(b, -1, h, e).transpose(1, 2).reshape(b * h, -1, e)
-        q, k, v = map(merge_heads, (q, k, v))
-
-        dots = torch.einsum('bie,bje->bij', q, k) * (e ** -0.5)
-        dots = dots.softmax(dim=-1)
-        out = torch.einsum('bij,bje->bie', dots, v)
+        # queries stay at full resolution, the pooled keys and values shrink the score matrix by the factor
+        if self.kv_pool > 1:
+            kv = pool_tokens(kv, self.kv_pool, self.kv_pool_mode)
+        q = self.to_q(x)
+        k, v = self.to_kv(kv).chunk(2, dim=-1)
+
+        b, t, d, h, e = q.shape[0], q.shape[1], q.shape[2], self.heads, self.dim_heads
+        q, k, v = self.merge_heads(q), self.merge_heads(k), self.merge_heads(v)
+
+        if self.backend == 'linear':
+            out = linear_attention(q, k, v)
+        # a window covering the whole axis is dense attention, which is cheaper without the padding and masking
+        elif self.window > 0 and k.shape[1] == t and (self.window < t or self.dilation > 1):
+            out = windowed_attention(q, k, v, self.window, self.overlap, self.dilation)
+        else:
+            out = full_attention(q, k, v)
         out = out.reshape(b, h, -1, e).transpose(1, 2).reshape(b, -1, d)
         out = self.to_out(out)
         return out
 
 
 class AxialAttention(nn.Module):
-    def __init__(self, dim, num_dimensions=2, heads=8, dim_heads=None, dim_index=-1, sum_axial_out=True):
+    def __init__(self, dim, num_dimensions=2, heads=8, dim_heads=None, dim_index=-1, sum_axial_out=True,
+                 checkpoint=False, parallel_branches=False, window=0, overlap=0, dilation=1, backend='softmax',
+                 kv_pool=1, kv_pool_mode='avg'):
         assert (dim % heads) == 0, 'hidden dimension must be divisible by number of heads'
         super().__init__()
         self.dim = dim
+        # recompute the attention in backward instead of keeping the score matrices alive
+        self.checkpoint = checkpoint
+        # with sum_axial_out the passes along every axis are independent and can run concurrently
+        self.parallel_branches = parallel_branches
         self.total_dimensions = num_dimensions + 2
         self.dim_index = dim_index if dim_index > 0 else (dim_index + self.total_dimensions)
 
         attentions = []
         for permutation in calculate_permutations(num_dimensions, dim_index):
-            attentions.append(PermuteToFrom(permutation, SelfAttention(dim, heads, dim_heads)))
+            attentions.append(PermuteToFrom(permutation, SelfAttention(dim, heads, dim_heads, window, overlap,
+                                                                       dilation, backend, kv_pool, kv_pool_mode)))
 
         self.axial_attentions = nn.ModuleList(attentions)
         self.sum_axial_out = sum_axial_out
 
+    def set_attention_window(self, window, overlap=0, dilation=1):
+        '''Switch every axial pass to windowed attention, `window` 0 goes back to dense'''
+        for axial_attn in self.axial_attentions:
+            axial_attn.fn.set_window(window, overlap, dilation)
+
+    def set_attention_backend(self, backend):
+        for axial_attn in self.axial_attentions:
+            axial_attn.fn.backend = check_backend(backend)
+
+    def set_kv_pool(self, factor, mode='avg'):
+        for axial_attn in self.axial_attentions:
+            axial_attn.fn.set_kv_pool(factor, mode)
+
     def forward(self, x):
         assert len(x.shape) == self.total_dimensions, 'input tensor does not have the correct number of dimensions'
         assert x.shape[self.dim_index] == self.dim, 'input tensor does not have the correct input dimension'
 
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return self._checkpointed_attention(x)
+        return self.attention(x)
+
+    @torch.jit.unused
+    def _checkpointed_attention(self, x):
+        return checkpointed(self.attention, x)
+
+    @torch.jit.unused
+    def _parallel_axial(self, x) -> List[torch.Tensor]:
+        return run_branches([functools.partial(axial_attn, x) for axial_attn in self.axial_attentions])
+
+    def attention(self, x):
         if self.sum_axial_out:
-            return sum(map(lambda axial_attn: axial_attn(x), self.axial_attentions))
+            outs: List[torch.Tensor] = []
+            if self.parallel_branches and torch.jit.is_scripting():
+                futures: List[torch.jit.Future[torch.Tensor]] = []
+                for axial_attn in self.axial_attentions:
+                    futures.append(torch.jit.fork(axial_attn, x))
+                for future in futures:
+                    outs.append(torch.jit.wait(future))
+            elif self.parallel_branches:
+                outs = self._parallel_axial(x)
+            else:
+                for axial_attn in self.axial_attentions:
+                    outs.append(axial_attn(x))
+
+            summed: Optional[torch.Tensor] = None
+            for out in outs:
+                summed = out if summed is None else summed + out
+            assert summed is not None
+            return summed
 
         out = x
         for axial_attn in self.axial_attentions:
             out = axial_attn(out)
-        return out
\ No newline at end of file
+        return out
+
+
+def set_attention_window(net, window, overlap=0, dilation=1):
+    """
+    Windowed axial attention in every AxialAttention of `net`: each pixel attends to `window` pixels of its row and
+    column block, `overlap` more on either side, every `dilation`-th.  `window` 0 restores dense attention.  Trained
+    weights carry over unchanged, only the attended span differs.  Raises while keys and values are pooled, and the
+    linear backend ignores the window.
+    """
+    for module in net.modules():
+        if isinstance(module, AxialAttention):
+            module.set_attention_window(window, overlap, dilation)
+    return net
+
+
+def set_attention_backend(net, backend):
+    """
+    Switch every attention of `net` that has a `backend`, SelfAttention in the axial blocks and PropAttention in the PGA
+    blocks, to the `backend` kernel.  The projections are shared between kernels, but a net trained with one kernel
+    needs fine tuning to do well with the other.
+    """
+    check_backend(backend)
+    for module in net.modules():
+        if hasattr(module, 'backend'):
+            module.backend = backend
+    return net
+
+
+def set_kv_pool(net, factor, mode='avg'):
+    """
+    Pool the keys and values of every AxialAttention of `net` along the attended axis by `factor`, averaging ('avg')
+    or keeping every factor-th pixel ('stride').  Attention FLOPs and score memory drop by the factor, 1 turns it off.
+    Raises while a window is set.
+    """
+    for module in net.modules():
+        if isinstance(module, AxialAttention):
+            module.set_kv_pool(factor, mode)
+    return net
@@ -29,7 +29,8 @@ class Embed(nn.Module):
             pos = self.pos(embedded)
             embedded_pos = elem_add(embedded, pos)
         else:
-            embedded_pos = self.pos(embedded.contiguous())
+            # the permuted linear output already is channels last, keep it that way instead of copying to NCHW
+            embedded_pos = self.pos(embedded.contiguous(memory_format=torch.channels_last))
         embedded_norm = self.bn(embedded_pos)
 
         return embedded_norm
@@ -8,7 +8,7 @@ def conv1x1(in_planes, out_planes, stride=1):
 
 
 class BlockAxial(nn.Module):
-    def __init__(self, channels, embedding_dims, img_shape=(300, 300)):
+    def __init__(self, channels, embedding_dims, img_shape=(300, 300), backend='softmax'):
         super(BlockAxial, self).__init__()
         self.channels = channels
         self.embedding_dims = embedding_dims
@@ -20,7 +20,7 @@ class BlockAxial(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
         self.attn = AxialAttention(dim=self.embedding_dims, dim_index=1, heads=2, num_dimensions=2,
-                                   sum_axial_out=True)
+                                   sum_axial_out=True, backend=backend)
 
         self.conv2 = conv1x1(self.embedding_dims_double, self.embedding_dims)
         self.bn2 = nn.BatchNorm2d(self.embedding_dims)
@@ -1,16 +1,22 @@
+import functools
+from typing import Tuple
+
 import torch
 from torch import nn
 from src.models.basic_axial.basic_axial_parts import BlockAxial, conv1x1
 from src.models.basic_pga.basic_pga_parts import BlockPGA
+from src.models.checkpoint import checkpoint_blocks
+from src.models.parallel import run_branches
 
 
 class BasicAxialPGA(nn.Module):
-    def __init__(self, channels, n_classes, embedding_dims, img_crop=320):
+    def __init__(self, channels, n_classes, embedding_dims, img_crop=320, parallel_branches=False):
         super(BasicAxialPGA, self).__init__()
         self.channels = channels
         self.n_classes = n_classes
         self.embedding_dims = embedding_dims
         self.img_crop = img_crop
+        self.parallel_branches = parallel_branches
 
         self.block_a1 = BlockAxial(self.channels, self.embedding_dims, img_shape=(self.img_crop, self.img_crop))
         self.block_pga1 = BlockPGA(self.channels, self.embedding_dims, img_shape=(self.img_crop, self.img_crop))
@@ -21,14 +27,31 @@ class BasicAxialPGA(nn.Module):
 
         self.outc = conv1x1(self.embedding_dims * 2, self.n_classes, 1)
 
-    def forward(self, x, obj_dict, bg_dict):
-        x_a1 = self.block_a1(x)
-        x_pga1 = self.block_pga1(x, obj_dict, bg_dict)
+    @torch.jit.unused
+    def _parallel_branches(self, block_a: nn.Module, block_pga: nn.Module, x, obj_index,
+                           bg_index) -> Tuple[torch.Tensor, torch.Tensor]:
+        x_a, x_pga = run_branches([functools.partial(block_a, x), functools.partial(block_pga, x, obj_index, bg_index)])
+        return x_a, x_pga
+
+    def forward(self, x, obj_index, bg_index):
+        # the axial and the PGA block of a stage see the same input and can run concurrently
+        if self.parallel_branches and torch.jit.is_scripting():
+            future = torch.jit.fork(self.block_pga1, x, obj_index, bg_index)
+            x_a1, x_pga1 = self.block_a1(x), torch.jit.wait(future)
+        elif self.parallel_branches:
+            x_a1, x_pga1 = self._parallel_branches(self.block_a1, self.block_pga1, x, obj_index, bg_index)
+        else:
+            x_a1, x_pga1 = self.block_a1(x), self.block_pga1(x, obj_index, bg_index)
         x = torch.cat((x_a1, x_pga1), dim=1)
         x = self.down1(x)
 
-        x_a2 = self.block_a2(x)
-        x_pga2 = self.block_pga2(x, obj_dict, bg_dict)
+        if self.parallel_branches and torch.jit.is_scripting():
+            future = torch.jit.fork(self.block_pga2, x, obj_index, bg_index)
+            x_a2, x_pga2 = self.block_a2(x), torch.jit.wait(future)
+        elif self.parallel_branches:
+            x_a2, x_pga2 = self._parallel_branches(self.block_a2, self.block_pga2, x, obj_index, bg_index)
+        else:
+            x_a2, x_pga2 = self.block_a2(x), self.block_pga2(x, obj_index, bg_index)
         x = torch.cat((x_a2, x_pga2), dim=1)
 
         logits = self.outc(x)
@@ -55,17 +78,17 @@ class OnlyPGA(nn.Module):
 
         self.outc = conv1x1(self.embedding_dims, self.n_classes, 1)
 
-    def forward(self, x, obj_dict, bg_dict):
-        x_pga1 = self.block_pga1(x, obj_dict, bg_dict)
+    def forward(self, x, obj_index, bg_index):
+        x_pga1 = self.block_pga1(x, obj_index, bg_index)
         x = self.down1(x_pga1)
 
-        x_pga2 = self.block_pga2(x, obj_dict, bg_dict)
+        x_pga2 = self.block_pga2(x, obj_index, bg_index)
         x = self.down2(x_pga2)
 
-        x_pga3 = self.block_pga3(x, obj_dict, bg_dict)
+        x_pga3 = self.block_pga3(x, obj_index, bg_index)
         x = self.down3(x_pga3)
 
-        x_pga4 = self.block_pga4(x, obj_dict, bg_dict)
+        x_pga4 = self.block_pga4(x, obj_index, bg_index)
 
         logits = self.outc(x_pga4)
 
@@ -73,12 +96,13 @@ class OnlyPGA(nn.Module):
 
 
 class BigOnlyPGA(nn.Module):
-    def __init__(self, channels, n_classes, embedding_dims, img_crop=320):
+    def __init__(self, channels, n_classes, embedding_dims, img_crop=320, checkpoint_segments=0):
         super(BigOnlyPGA, self).__init__()
         self.channels = channels
         self.n_classes = n_classes
         self.embedding_dims = embedding_dims
         self.img_crop = img_crop
+        self.checkpoint_segments = checkpoint_segments
 
         self.block_pga1 = BlockPGA(self.channels, self.embedding_dims, img_shape=(self.img_crop, self.img_crop))
         self.block_pga2 = BlockPGA(self.embedding_dims, self.embedding_dims, img_shape=(self.img_crop, self.img_crop))
@@ -91,15 +115,10 @@ class BigOnlyPGA(nn.Module):
 
         self.outc = conv1x1(self.embedding_dims, self.n_classes, 1)
 
-    def forward(self, x, obj_dict, bg_dict):
-        x = self.block_pga1(x, obj_dict, bg_dict)
-        x = self.block_pga2(x, obj_dict, bg_dict)
-        x = self.block_pga3(x, obj_dict, bg_dict)
-        x = self.block_pga4(x, obj_dict, bg_dict)
-        x = self.block_pga5(x, obj_dict, bg_dict)
-        x = self.block_pga6(x, obj_dict, bg_dict)
-        x = self.block_pga7(x, obj_dict, bg_dict)
-        x = self.block_pga8(x, obj_dict, bg_dict)
+    def forward(self, x, obj_index, bg_index):
+        blocks = [self.block_pga1, self.block_pga2, self.block_pga3, self.block_pga4, self.block_pga5,
+                  self.block_pga6, self.block_pga7, self.block_pga8]
+        x = checkpoint_blocks(blocks, x, self.checkpoint_segments, obj_index, bg_index)
 
         logits = self.outc(x)
         return logits
\ No newline at end of file
@@ -1,6 +1,13 @@
+from typing import Optional
+
 import torch
 from torch import nn
-from src.models.basic_pga.utils import get_image_dicts, build_pos_tensors, build_rand_inds
+from src.models.axial_attention.axial_attention import contiguous_like, check_backend, checkpointed, full_attention, \
+    linear_attention
+from src.models.basic_pga.utils import build_rand_inds, routing_index
+
+
+ROUTING_MODES = ('random', 'instance')
 
 
 def conv1x1(in_planes, out_planes, stride=1):
@@ -8,7 +15,8 @@ def conv1x1(in_planes, out_planes, stride=1):
 
 
 class BlockPGA(nn.Module):
-    def __init__(self, channels, embedding_dims, img_shape=(300, 300)):
+    def __init__(self, channels, embedding_dims, img_shape=(300, 300), backend='softmax', routing='random',
+                 instance_len=64):
         super(BlockPGA, self).__init__()
         self.channels = channels
         self.embedding_dims = embedding_dims
@@ -19,17 +27,18 @@ class BlockPGA(nn.Module):
         self.bn1 = nn.BatchNorm2d(self.embedding_dims)
         self.relu = nn.ReLU(inplace=True)
 
-        self.attn = PropAttention(dim=self.embedding_dims, heads=2, img_crop=img_shape[0])
+        self.attn = PropAttention(dim=self.embedding_dims, heads=2, img_crop=img_shape[0], backend=backend,
+                                  routing=routing, instance_len=instance_len)
 
         self.conv2 = conv1x1(self.embedding_dims_double, self.embedding_dims)
         self.bn2 = nn.BatchNorm2d(self.embedding_dims)
 
-    def forward(self, x, obj_dict, bg_dict):
+    def forward(self, x, obj_index, bg_index):
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
 
-        x_attn = self.attn(x, obj_dict, bg_dict)
+        x_attn = self.attn(x, obj_index, bg_index)
         x_attn = self.relu(x_attn)
 
         x = torch.cat((x_attn, x), dim=1)
@@ -41,10 +50,16 @@ class BlockPGA(nn.Module):
 
 
 class PropAttention(nn.Module):
-    def __init__(self, dim, heads, img_crop, dim_heads=None):
+    def __init__(self, dim, heads, img_crop, dim_heads=None, checkpoint=False, backend='softmax', routing='random',
+                 instance_len=64):
         assert (dim % heads) == 0, 'hidden dimension must be divisible by number of heads'
         super().__init__()
         self.dim_heads = (dim // heads) if dim_heads is None else dim_heads
+        # recompute the attention in backward instead of keeping the score matrices alive
+        self.checkpoint = checkpoint
+        self.backend = check_backend(backend)
+        self.routing_mode, self.instance_len = 'random', 64
+        self.set_routing(routing, instance_len)
 
         inds = build_rand_inds(heads, img_crop)
         inds_tensor = torch.LongTensor(inds)
@@ -56,69 +71,120 @@ class PropAttention(nn.Module):
         self.to_kv = nn.Linear(self.dim_heads, 2 * self.dim_heads, bias=False)
         self.to_out = nn.Linear(dim, dim)
 
-    def construct(self, t, obj_dict, bg_dict, inds):
-        img_flat = t.view(-1, self.img_crop ** 2)
-
-        obj_vecs = []
-        bg_vecs = []
+    def set_routing(self, routing, instance_len=64):
+        """
+        'random' draws the sequences of every head at random from the object and background pixels.  'instance' takes
+        the routing as given: consecutive runs of `instance_len` slots are one sequence, inside a single proposal
+        instance or the background, -1 slots are padding (IceWithProposals(instances=True) builds them).
+        """
+        if routing not in ROUTING_MODES:
+            raise ValueError(f'Please enter a valid routing, one of {", ".join(ROUTING_MODES)}.  You entered '
+                             f'{routing}.')
+        self.routing_mode, self.instance_len = routing, int(instance_len)
+
+    def routing(self, obj_index, bg_index):
+        '''
+        Pixel visited by every position of every sequence, (B, heads, crop * crop) in sequence order: the first half of
+        the crop sequences of a head walk object pixels, the rest background pixels.
+        '''
+        inds = self.rand_inds.reshape(self.heads, -1)
         num_obj = self.img_crop // 2
-        num_bg = self.img_crop - num_obj
-        for i in range(num_obj):
-            obj_vecs.append(build_pos_tensors(img_flat, obj_dict, inds[i]))
-        for i in range(num_bg):
-            bg_vecs.append(build_pos_tensors(img_flat, bg_dict, inds[i + num_obj]))
-
-        obj_tensor = torch.stack(obj_vecs, dim=0)
-        bg_tensor = torch.stack(bg_vecs, dim=0)
-
-        all_tensor = torch.cat((obj_tensor, bg_tensor), dim=0)
-
-        return all_tensor
-
-    def destruct(self, t, img, obj_dict, bg_dict, inds):
-        ts = torch.chunk(t, 2, dim=0)
-
-        obj_tensor_tuple = torch.chunk(ts[0], ts[0].shape[0], dim=0)
-        bg_tensor_tuple = torch.chunk(ts[1], ts[1].shape[0], dim=0)
-
-        for i, vec in enumerate(obj_tensor_tuple):
-            img = self.add_vec_to_tensor(img, inds[i], vec.squeeze(0).transpose(1, 0), obj_dict)
-        for i, vec in enumerate(bg_tensor_tuple):
-            img = self.add_vec_to_tensor(img, inds[i + len(obj_tensor_tuple)], vec.squeeze(0).transpose(1, 0), bg_dict)
-
-        return img
-
-    def add_vec_to_tensor(self, t, inds, vec, obj_dict):
-        for i, v in zip(inds.detach().cpu().numpy(), vec):
-            obj_ind = obj_dict[i]
-            x = obj_ind // self.img_crop
-            y = obj_ind % self.img_crop
-            t[:, :, x, y] = v
-        return t
-
-    def forward(self, x, obj_dict, bg_dict, kv=None):
-        x = x.clone().detach()
-
-        img_heads = torch.chunk(x.cpu(), self.heads, dim=1)
-        head_list = []
-        for inds, h in zip(self.rand_inds, img_heads):
-            head_list.append(self.construct(h, obj_dict, bg_dict, inds))
-
-        out = torch.cat(head_list, dim=0).view(self.heads * self.img_crop, self.img_crop, -1).cuda()
+        is_obj = torch.arange(self.img_crop ** 2, device=inds.device) < num_obj * self.img_crop
+        return torch.where(is_obj, obj_index[:, inds], bg_index[:, inds])
+
+    def construct(self, x_heads, pix):
+        '''Gather the sequences into tokens, (B * heads * crop, crop, dim_heads)'''
+        b, ch = x_heads.shape[0], x_heads.shape[2]
+        seqs = torch.gather(x_heads, 3, pix.unsqueeze(2).expand(-1, -1, ch, -1))
+        seqs = seqs.reshape(b, self.heads, ch, self.img_crop, self.img_crop).transpose(2, 3)
+        # every (channels, positions) sequence is read as (positions, channels) straight from memory, like the
+        # original per sample view did
+        return seqs.reshape(b * self.heads * self.img_crop, self.img_crop, ch)
+
+    def unconstruct(self, t, b):
+        '''Attended tokens of construct back in slot order, (B, heads, dim_heads, crop * crop)'''
+        ch = t.shape[-1]
+        t = t.reshape(b, self.heads, self.img_crop, ch, self.img_crop).transpose(2, 3)
+        return t.reshape(b, self.heads, ch, self.img_crop ** 2)
+
+    def construct_instances(self, x_heads, pix):
+        '''Gather every run of instance_len slots into a sequence, (B * heads * sequences, instance_len, dim_heads)'''
+        b, ch = x_heads.shape[0], x_heads.shape[2]
+        seqs = torch.gather(x_heads, 3, pix.clamp(min=0).unsqueeze(2).expand(-1, -1, ch, -1))
+        seqs = seqs.reshape(b, self.heads, ch, -1, self.instance_len).permute(0, 1, 3, 4, 2)
+        return seqs.reshape(-1, self.instance_len, ch)
+
+    def unconstruct_instances(self, t, b):
+        ch = t.shape[-1]
+        t = t.reshape(b, self.heads, -1, self.instance_len, ch).permute(0, 1, 4, 2, 3)
+        return t.reshape(b, self.heads, ch, -1)
+
+    def destruct(self, t, x_heads, pix):
+        '''
+        Write the attended tokens, (B, heads, dim_heads, slots) in slot order, back to the pixels they came from.  A pixel
+        visited more than once takes the value of its last visit in slot order, pixels that were not visited keep their
+        input value and padding slots (-1) are dropped.
+        '''
+        b, ch, n, slots = x_heads.shape[0], x_heads.shape[2], x_heads.shape[3], pix.shape[-1]
+        pix = torch.where(pix < 0, torch.full_like(pix, n), pix)
+
+        # last visit of every pixel: sort by (pixel, position) and keep the final entry of every pixel run, the other
+        # entries and the padding are scattered to a dummy slot past the end
+        pos = torch.arange(slots, device=pix.device)
+        order = torch.argsort(pix * slots + pos, dim=-1)
+        pix_sorted = torch.gather(pix, 2, order)
+        is_last = torch.cat((pix_sorted[..., 1:] != pix_sorted[..., :-1],
+                             torch.ones_like(pix_sorted[..., :1], dtype=torch.bool)), dim=-1)
+        target = torch.where(is_last, pix_sorted, torch.full_like(pix_sorted, n))
+        winner = torch.full((b, self.heads, n + 1), -1, dtype=torch.long, device=pix.device)
+        winner = winner.scatter(2, target, order)[..., :n]
+
+        written = torch.gather(t, 3, winner.clamp(min=0).unsqueeze(2).expand(-1, -1, ch, -1))
+        return torch.where((winner >= 0).unsqueeze(2), written, x_heads)
+
+    def forward(self, x, obj_index, bg_index, kv=None):
+        '''`obj_index`/`bg_index` map sequence slots to flat pixel positions, (crop * crop,) or (B, crop * crop)'''
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return checkpointed(self.attention, x, obj_index, bg_index, kv)
+        return self.attention(x, obj_index, bg_index, kv)
+
+    def attention(self, x, obj_index, bg_index, kv=None):
+        x = x.detach()
+        b, dim, h, w = x.shape
+        obj_index = routing_index(obj_index, b, x.device)
+        bg_index = routing_index(bg_index, b, x.device)
+
+        x_heads = x.reshape(b, self.heads, dim // self.heads, h * w)
+        mask: Optional[torch.Tensor] = None
+        if self.routing_mode == 'instance':
+            # every head attends within the same instance sequences, padding slots are masked out of the keys
+            pix = torch.cat((obj_index, bg_index), dim=1).unsqueeze(1).expand(-1, self.heads, -1)
+            out = self.construct_instances(x_heads, pix)
+            mask = (pix >= 0).reshape(-1, self.instance_len)
+        else:
+            pix = self.routing(obj_index, bg_index)
+            out = self.construct(x_heads, pix)
 
         kv = out if kv is None else kv
         q, k, v = (self.to_q(out), *self.to_kv(kv).chunk(2, dim=-1))
-        dots = torch.einsum('bie,bje->bij', q, k) * (self.dim_heads ** -0.5)
-        dots = dots.softmax(dim=-1)
-        out = torch.einsum('bij,bje->bie', dots, v)
+        if self.backend == 'linear':
+            out = linear_attention(q, k, v, mask)
+        else:
+            out = full_attention(q, k, v, mask)
+
+        if self.routing_mode == 'instance':
+            out = self.unconstruct_instances(out, b)
+        else:
+            out = self.unconstruct(out, b)
+        out_final = self.destruct(out, x_heads, pix).reshape(b, dim, h, w).permute(0, 2, 3, 1)
+        out_final = self.to_out(out_final)
 
-        out = out.view(self.heads * self.img_crop, -1, self.img_crop).cpu()
-        ts = torch.chunk(out, self.heads, dim=0)
+        return contiguous_like(out_final.permute(0, 3, 1, 2), x)
 
-        new_img_list = []
-        for t, img_head, inds in zip(ts, img_heads, self.rand_inds):
-            new_img_list.append(self.destruct(t, img_head, obj_dict, bg_dict, inds))
-        out_final = torch.cat(new_img_list, dim=1).permute(0, 2, 3, 1).contiguous().cuda()
-        out_final = self.to_out(out_final)
 
-        return out_final.permute(0, 3, 1, 2).contiguous()
+def set_pga_routing(net, routing, instance_len=64):
+    '''Switch every PropAttention of `net` to `routing` ('random' or 'instance' proposal groups)'''
+    for module in net.modules():
+        if isinstance(module, PropAttention):
+            module.set_routing(routing, instance_len)
+    return net
@@ -0,0 +1,133 @@
+from typing import List, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+from src.models.basic_pga.basic_pga_parts import PropAttention, conv1x1
+from src.models.basic_pga.utils import proposal_routing
+from src.models.lbcnn.lbcnn_parts import ConvLBP, BlockLBPUNet
+
+
+class PGADown(nn.Module):
+    '''Max pool, then proposal guided attention and an LBP branch at the pooled level of `img_crop` pixels a side'''
+
+    def __init__(self, n_channels, embedding_dims, img_crop, heads=2):
+        super(PGADown, self).__init__()
+        self.n_channels = n_channels
+        self.embedding_dims = embedding_dims
+        self.cat_dims = n_channels * 3
+
+        self.mp = nn.MaxPool2d(2)
+        self.conv1 = conv1x1(self.cat_dims, self.embedding_dims)
+        self.bn1 = nn.BatchNorm2d(self.embedding_dims)
+        self.relu = nn.ReLU(inplace=True)
+
+        self.attn = PropAttention(dim=self.n_channels, heads=heads, img_crop=img_crop)
+        self.bn_lbc = nn.BatchNorm2d(self.n_channels)
+        self.conv_lbc = ConvLBP(self.n_channels, self.n_channels)
+
+    def forward(self, x, routing: Tuple[torch.Tensor, torch.Tensor]):
+        x = self.mp(x)
+
+        x_attn = self.relu(self.attn(x, routing[0], routing[1]))
+        x_lbc = self.relu(self.conv_lbc(self.bn_lbc(x)))
+
+        x = torch.cat((x_attn, x_lbc, x), dim=1)
+        x = self.conv1(x)
+        x = self.relu(x)
+        x = self.bn1(x)
+
+        return x
+
+
+class PGAUp(nn.Module):
+    """
+    Proposal guided attention and an LBP branch at the incoming level of `img_crop` pixels a side, then upsampling and
+    the skip connection.  Attending before upsampling keeps PGA off the finer level.
+    """
+
+    def __init__(self, n_channels, embedding_dims, img_crop, heads=2):
+        super(PGAUp, self).__init__()
+        self.n_channels = n_channels
+        self.embedding_dims = embedding_dims
+        self.cat_dims = n_channels * 3 + embedding_dims
+
+        self.up = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
+        self.conv1 = conv1x1(self.cat_dims, self.embedding_dims)
+        self.bn1 = nn.BatchNorm2d(self.embedding_dims)
+        self.relu = nn.ReLU(inplace=True)
+
+        self.attn = PropAttention(dim=self.n_channels, heads=heads, img_crop=img_crop)
+        self.bn_lbc = nn.BatchNorm2d(self.n_channels)
+        self.conv_lbc = ConvLBP(self.n_channels, self.n_channels)
+
+    def forward(self, x, res, routing: Tuple[torch.Tensor, torch.Tensor]):
+        x_attn = self.relu(self.attn(x, routing[0], routing[1]))
+        x_lbc = self.relu(self.conv_lbc(self.bn_lbc(x)))
+
+        x = torch.cat((x_attn, x_lbc, x), dim=1)
+        x = self.up(x)
+        x = torch.cat((x, res), dim=1)
+        x = self.conv1(x)
+        x = self.relu(x)
+        x = self.bn1(x)
+
+        return x
+
+
+class PGAUNet(nn.Module):
+    """
+    AxialUNetLBC layout with proposal guided attention in place of axial attention, run only at the downsampled
+    levels.  Takes the image and its binary proposal map (B, 1, crop, crop); the map is max pooled to every level and
+    the object and background routing of each level is built inside the model.
+    """
+
+    def __init__(self, n_channels, n_classes, embedding_dims, img_crop=256):
+        super(PGAUNet, self).__init__()
+        if img_crop % 16:
+            raise ValueError(f'The crop has to be divisible by 16 for four PGA levels, got {img_crop}.')
+        self.n_channels = n_channels
+        self.n_classes = n_classes
+        self.embedding_dims = embedding_dims
+        self.img_crop = img_crop
+        self.levels = 4
+
+        self.encode = BlockLBPUNet(self.n_channels, self.embedding_dims)
+
+        self.down1 = PGADown(self.embedding_dims, self.embedding_dims * 2, img_crop // 2)
+        self.down2 = PGADown(self.embedding_dims * 2, self.embedding_dims * 4, img_crop // 4)
+        self.down3 = PGADown(self.embedding_dims * 4, self.embedding_dims * 8, img_crop // 8)
+        self.down4 = PGADown(self.embedding_dims * 8, self.embedding_dims * 16, img_crop // 16)
+        self.up1 = PGAUp(self.embedding_dims * 16, self.embedding_dims * 8, img_crop // 16)
+        self.up2 = PGAUp(self.embedding_dims * 8, self.embedding_dims * 4, img_crop // 8)
+        self.up3 = PGAUp(self.embedding_dims * 4, self.embedding_dims * 2, img_crop // 4)
+        self.up4 = PGAUp(self.embedding_dims * 2, self.embedding_dims, img_crop // 2)
+
+        self.decode = conv1x1(self.embedding_dims, self.n_classes)
+
+    def level_routing(self, prop) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+        '''Routing of levels 1 to 4, a pooled pixel is object when any pixel it covers is'''
+        prop = prop.float()
+        routing: List[Tuple[torch.Tensor, torch.Tensor]] = []
+        for _ in range(self.levels):
+            prop = F.max_pool2d(prop, 2)
+            routing.append(proposal_routing(prop))
+        return routing
+
+    def forward(self, x, prop):
+        routing = self.level_routing(prop)
+
+        x1 = self.encode(x)
+        x2 = self.down1(x1, routing[0])
+        x3 = self.down2(x2, routing[1])
+        x4 = self.down3(x3, routing[2])
+        x5 = self.down4(x4, routing[3])
+
+        x6 = self.up1(x5, x4, routing[3])
+        x7 = self.up2(x6, x3, routing[2])
+        x8 = self.up3(x7, x2, routing[1])
+        x9 = self.up4(x8, x1, routing[0])
+
+        logits = self.decode(x9)
+
+        return logits
@@ -1,5 +1,6 @@
 import numpy as np
 import random
+import torch
 
 
 def get_image_dicts(prop_flat):
@@ -36,3 +37,33 @@ def build_rand_inds(heads, img_crop):
             inds_head.append(random.sample(range(img_crop ** 2), img_crop))
         rand_inds.append(inds_head)
     return rand_inds
+
+
+def routing_index(routing, batch_size, device):
+    '''(B, crop * crop) long tensor of the pixel behind every slot of a routing given as a tensor or a slot -> pixel dict'''
+    if isinstance(routing, dict):
+        routing = torch.tensor([routing[i] for i in range(len(routing))], dtype=torch.long)
+    routing = routing.to(device=device, dtype=torch.long)
+    if routing.dim() == 1:
+        routing = routing.unsqueeze(0)
+    return routing.expand(batch_size, -1)
+
+
+def proposal_routing(prop):
+    """
+    Object and background routing index, (B, H * W) each, of a batch of binary proposal maps (B, 1, H, W) built on the
+    fly: the object (background) pixels in raster order repeated cyclically over all slots, like
+    IceWithProposals.build_index.  A map without object or without background pixels routes that half through the
+    whole image.
+    """
+    b = prop.shape[0]
+    is_obj = prop.reshape(b, -1) > 0
+    n = is_obj.shape[1]
+    # object pixels first, each group kept in raster order: the keys are unique, so no stable sort is needed
+    positions = torch.arange(n, device=prop.device).unsqueeze(0)
+    order = torch.argsort((~is_obj).long() * n + positions, dim=1)
+    n_obj = is_obj.sum(dim=1, keepdim=True)
+    n_bg = n - n_obj
+    obj = torch.where(n_obj > 0, positions % n_obj.clamp(min=1), positions)
+    bg = torch.where(n_bg > 0, n_obj + positions % n_bg.clamp(min=1), positions)
+    return torch.gather(order, 1, obj), torch.gather(order, 1, bg)
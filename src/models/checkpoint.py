@@ -0,0 +1,46 @@
+import functools
+
+import torch
+
+from src.models.axial_attention.axial_attention import AxialAttention, NON_REENTRANT_CHECKPOINT, checkpointed
+from src.models.basic_pga.basic_pga_parts import PropAttention
+
+
+def _run_blocks(blocks, x, *args):
+    for block in blocks:
+        x = block(x, *args)
+    return x
+
+
+def checkpoint_blocks(blocks, x, segments, *args):
+    """
+    Run `blocks` one after the other on `x` (every block also gets `args`) in `segments` checkpointed segments.  Only
+    the segment inputs are kept for backward, everything inside a segment is recomputed.  Without grad the blocks run
+    as usual.
+    """
+    if not segments or not torch.is_grad_enabled():
+        return _run_blocks(blocks, x, *args)
+    size = -(-len(blocks) // segments)
+    for start in range(0, len(blocks), size):
+        segment = functools.partial(_run_blocks, blocks[start:start + size])
+        # the reentrant checkpoint of older torch leaves the parameters of a segment without grad when its input does
+        # not require any, e.g. the first segment on the image
+        if NON_REENTRANT_CHECKPOINT or x.requires_grad:
+            x = checkpointed(segment, x, *args)
+        else:
+            x = segment(x, *args)
+    return x
+
+
+def set_checkpointing(net, attention=True, segments=0):
+    """
+    Trade compute for memory in training.  `attention` recomputes every AxialAttention and PropAttention in backward,
+    `segments` splits the block stacks of the flat models (LargeAxialLBC, BigOnlyPGA) into that many checkpointed
+    segments, 0 turns it off.
+    """
+    for module in net.modules():
+        if isinstance(module, (AxialAttention, PropAttention)):
+            module.checkpoint = attention
+        if hasattr(module, 'checkpoint_segments'):
+            module.checkpoint_segments = segments
+    return net
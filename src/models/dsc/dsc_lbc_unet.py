@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from src.models.lbcnn.lbcnn_parts import ConvLBP
 
 
 class DSCUNetLBP(nn.Module):
@@ -61,16 +62,9 @@ class DSCSmallUNetLBP(nn.Module):
         return logits
 
 
-class DSCConvLBP(nn.Conv2d):
-    def __init__(self, in_channels, out_channels, kernel_size=3, sparsity=0.5):
-        super().__init__(in_channels, out_channels, kernel_size, padding=1, bias=False, dilation=1, groups=in_channels)
-        weights = next(self.parameters())
-        matrix_proba = torch.FloatTensor(weights.data.shape).fill_(0.5)
-        binary_weights = torch.bernoulli(matrix_proba) * 2 - 1
-        mask_inactive = torch.rand(matrix_proba.shape) > sparsity
-        binary_weights.masked_fill_(mask_inactive, 0)
-        weights.data = binary_weights
-        weights.requires_grad_(False)
+class DSCConvLBP(ConvLBP):
+    def __init__(self, in_channels, out_channels, kernel_size=3, sparsity=0.5, seed=None):
+        super().__init__(in_channels, out_channels, kernel_size, sparsity=sparsity, groups=in_channels, seed=seed)
 
 
 class DSCBlockLBP(nn.Module):
@@ -86,7 +80,7 @@ class DSCBlockLBP(nn.Module):
         x = self.batch_norm(x)
         x = F.relu(self.conv_lbp(x))
         x = self.conv_1x1(x)
-        x.add_(res)
+        x = x + res
         return x
 
 
@@ -102,7 +96,7 @@ class DSCDSCBlockLBPUNet(nn.Module):
         res = x
         x = self.batch_norm(x)
         x = F.relu(self.conv_lbp(x))
-        x.add_(res)
+        x = x + res
         x = self.conv_1x1(x)
         return x
 
@@ -1,18 +1,50 @@
+import functools
+from typing import Tuple
+
 import torch
 from torch import nn
 from src.models.axial_attention.axial_attention import AxialAttention
+from src.models.checkpoint import checkpoint_blocks
 from src.models.lbcnn.lbcnn_parts import ConvLBP, BlockLBP
+from src.models.parallel import run_branches
 
 
 def conv1x1(in_planes, out_planes, stride=1):
     return nn.Conv2d(in_planes, out_planes, kernel_size=1, stride=stride, bias=False)
 
 
-class BlockAxialLBC(nn.Module):
-    def __init__(self, n_channels, embedding_dims, heads=2):
+class AxialLBCBranches(nn.Module):
+    """
+    The independent attention and LBP branches shared by the axial LBC blocks.  With `parallel_branches` they run
+    concurrently on CPU threads (eager) or as forked tasks (TorchScript).
+    """
+
+    def attn_branch(self, x):
+        return self.relu(self.attn(x))
+
+    def lbc_branch(self, x):
+        return self.relu(self.conv_lbc(self.bn_lbc(x)))
+
+    @torch.jit.unused
+    def _parallel_branches(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        x_attn, x_lbc = run_branches([functools.partial(self.attn_branch, x), functools.partial(self.lbc_branch, x)])
+        return x_attn, x_lbc
+
+    def branches(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.parallel_branches and torch.jit.is_scripting():
+            future = torch.jit.fork(self.lbc_branch, x)
+            return self.attn_branch(x), torch.jit.wait(future)
+        if self.parallel_branches:
+            return self._parallel_branches(x)
+        return self.attn_branch(x), self.lbc_branch(x)
+
+
+class BlockAxialLBC(AxialLBCBranches):
+    def __init__(self, n_channels, embedding_dims, heads=2, parallel_branches=False, backend='softmax'):
         super(BlockAxialLBC, self).__init__()
         self.n_channels = n_channels
         self.embedding_dims = embedding_dims
+        self.parallel_branches = parallel_branches
         self.embedding_dims_trip = embedding_dims * 3
 
         self.conv1 = conv1x1(self.n_channels, self.embedding_dims)
@@ -20,7 +52,7 @@ class BlockAxialLBC(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
         self.attn = AxialAttention(dim=self.embedding_dims, dim_index=1, heads=heads, num_dimensions=2,
-                                   sum_axial_out=True)
+                                   sum_axial_out=True, backend=backend)
         self.bn_lbc = nn.BatchNorm2d(self.embedding_dims)
         self.conv_lbc = ConvLBP(self.embedding_dims, self.embedding_dims)
 
@@ -32,12 +64,7 @@ class BlockAxialLBC(nn.Module):
         x = self.relu(x)
         x = self.bn1(x)
 
-        x_attn = self.attn(x)
-        x_attn = self.relu(x_attn)
-
-        x_lbc = self.bn_lbc(x)
-        x_lbc = self.conv_lbc(x_lbc)
-        x_lbc = self.relu(x_lbc)
+        x_attn, x_lbc = self.branches(x)
 
         x = torch.cat((x_attn, x_lbc, x), dim=1)
         x = self.conv2(x)
@@ -46,11 +73,12 @@ class BlockAxialLBC(nn.Module):
         return x
 
 
-class AxialDownLBC(nn.Module):
-    def __init__(self, n_channels, embedding_dims, heads=2):
+class AxialDownLBC(AxialLBCBranches):
+    def __init__(self, n_channels, embedding_dims, heads=2, parallel_branches=False, backend='softmax'):
         super(AxialDownLBC, self).__init__()
         self.n_channels = n_channels
         self.embedding_dims = embedding_dims
+        self.parallel_branches = parallel_branches
         self.cat_dims = embedding_dims + n_channels
         self.heads = heads
 
@@ -60,19 +88,14 @@ class AxialDownLBC(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
         self.attn = AxialAttention(dim=self.n_channels, dim_index=1, heads=self.heads, num_dimensions=2,
-                                   sum_axial_out=True)
+                                   sum_axial_out=True, backend=backend)
         self.bn_lbc = nn.BatchNorm2d(self.n_channels)
         self.conv_lbc = ConvLBP(self.n_channels, self.n_channels)
 
     def forward(self, x):
         x = self.mp(x)
 
-        x_attn = self.attn(x)
-        x_attn = self.relu(x_attn)
-
-        x_lbc = self.bn_lbc(x)
-        x_lbc = self.conv_lbc(x_lbc)
-        x_lbc = self.relu(x_lbc)
+        x_attn, x_lbc = self.branches(x)
 
         x = torch.cat((x_attn, x_lbc, x), dim=1)
         x = self.conv1(x)
@@ -82,11 +105,12 @@ class AxialDownLBC(nn.Module):
         return x
 
 
-class AxialUpLBC(nn.Module):
-    def __init__(self, n_channels, embedding_dims, heads=2):
+class AxialUpLBC(AxialLBCBranches):
+    def __init__(self, n_channels, embedding_dims, heads=2, parallel_branches=False, backend='softmax'):
         super(AxialUpLBC, self).__init__()
         self.n_channels = n_channels
         self.embedding_dims = embedding_dims
+        self.parallel_branches = parallel_branches
         self.cat_dims = n_channels * 3 + embedding_dims
         self.heads = heads
 
@@ -97,19 +121,14 @@ class AxialUpLBC(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
         self.attn = AxialAttention(dim=self.n_channels, dim_index=1, heads=self.heads, num_dimensions=2,
-                                   sum_axial_out=True)
+                                   sum_axial_out=True, backend=backend)
         self.bn_lbc = nn.BatchNorm2d(self.n_channels)
         self.conv_lbc = ConvLBP(self.n_channels, self.n_channels)
 
     def forward(self, x, res):
         x = self.up(x)
 
-        x_attn = self.attn(x)
-        x_attn = self.relu(x_attn)
-
-        x_lbc = self.bn_lbc(x)
-        x_lbc = self.conv_lbc(x_lbc)
-        x_lbc = self.relu(x_lbc)
+        x_attn, x_lbc = self.branches(x)
 
         x = torch.cat((x_attn, x_lbc, x, res), dim=1)
         x = self.conv1(x)
@@ -186,7 +205,7 @@ class SmallAxialUNetLBC(nn.Module):
 
 
 class BlockAxialLBC_Add(nn.Module):
-    def __init__(self, n_channels, embedding_dims, heads=2):
+    def __init__(self, n_channels, embedding_dims, heads=2, backend='softmax'):
         super(BlockAxialLBC_Add, self).__init__()
         self.n_channels = n_channels
         self.embedding_dims = embedding_dims
@@ -197,7 +216,7 @@ class BlockAxialLBC_Add(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
         self.attn = AxialAttention(dim=self.embedding_dims, dim_index=1, heads=heads, num_dimensions=2,
-                                   sum_axial_out=True)
+                                   sum_axial_out=True, backend=backend)
         self.bn_lbc = nn.BatchNorm2d(self.embedding_dims)
         self.conv_lbc = BlockLBP(self.embedding_dims, self.embedding_dims)
 
@@ -247,16 +266,16 @@ class BasicAxialLBC(nn.Module):
 
 
 class BasicAxialLBC_Add(nn.Module):
-    def __init__(self, n_channels, n_classes, embedding_dims):
+    def __init__(self, n_channels, n_classes, embedding_dims, backend='softmax'):
         super(BasicAxialLBC_Add, self).__init__()
         self.n_channels = n_channels
         self.n_classes = n_classes
         self.embedding_dims = embedding_dims
 
-        self.block1 = BlockAxialLBC_Add(self.n_channels, self.embedding_dims)
-        self.block2 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims)
-        self.block3 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims)
-        self.block4 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims)
+        self.block1 = BlockAxialLBC_Add(self.n_channels, self.embedding_dims, backend=backend)
+        self.block2 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims, backend=backend)
+        self.block3 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims, backend=backend)
+        self.block4 = BlockAxialLBC_Add(self.embedding_dims, self.embedding_dims, backend=backend)
 
         self.outc = conv1x1(self.embedding_dims, self.n_classes, 1)
 
@@ -271,11 +290,12 @@ class BasicAxialLBC_Add(nn.Module):
 
 
 class LargeAxialLBC(nn.Module):
-    def __init__(self, n_channels, n_classes, embedding_dims):
+    def __init__(self, n_channels, n_classes, embedding_dims, checkpoint_segments=0):
         super(LargeAxialLBC, self).__init__()
         self.n_channels = n_channels
         self.n_classes = n_classes
         self.embedding_dims = embedding_dims
+        self.checkpoint_segments = checkpoint_segments
 
         self.block1 = BlockAxialLBC(self.n_channels, self.embedding_dims)
         self.block2 = BlockAxialLBC(self.embedding_dims, self.embedding_dims)
@@ -289,14 +309,9 @@ class LargeAxialLBC(nn.Module):
         self.outc = conv1x1(self.embedding_dims, self.n_classes, 1)
 
     def forward(self, x):
-        x = self.block1(x)
-        x = self.block2(x)
-        x = self.block3(x)
-        x = self.block4(x)
-        x = self.block5(x)
-        x = self.block6(x)
-        x = self.block7(x)
-        x = self.block8(x)
+        blocks = [self.block1, self.block2, self.block3, self.block4, self.block5, self.block6, self.block7,
+                  self.block8]
+        x = checkpoint_blocks(blocks, x, self.checkpoint_segments)
 
         logits = self.outc(x)
         return logits
\ No newline at end of file
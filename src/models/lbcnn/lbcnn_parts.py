@@ -3,16 +3,109 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 
+LBP_MODES = ('dense', 'sparse')
+
+
+def lbp_weights(shape, sparsity, seed):
+    '''Ternary LBP weights, the same for the same seed on every machine'''
+    generator = torch.Generator().manual_seed(seed)
+    matrix_proba = torch.full(shape, 0.5)  # same shape as weights filled with 0.5
+    binary_weights = torch.bernoulli(matrix_proba, generator=generator) * 2 - 1  # 50/50 chance of being 1 or -1
+    mask_inactive = torch.rand(shape, generator=generator) > sparsity  # 'sparsity' (50/50 by default) chance of a vale being zero
+    binary_weights.masked_fill_(mask_inactive, 0)
+    return binary_weights
+
+
 class ConvLBP(nn.Conv2d):
-    def __init__(self, in_channels, out_channels, kernel_size=3, sparsity=0.5):
-        super().__init__(in_channels, out_channels, kernel_size, padding=1, bias=False, dilation=1)
-        weights = next(self.parameters())
-        matrix_proba = torch.FloatTensor(weights.data.shape).fill_(0.5)  # same shape as weights filled with 0.5
-        binary_weights = torch.bernoulli(matrix_proba) * 2 - 1  # 50/50 chance of being 1 or -1
-        mask_inactive = torch.rand(matrix_proba.shape) > sparsity  # 'sparsity' (50/50 by default) chance of a vale being zero
-        binary_weights.masked_fill_(mask_inactive, 0)
-        weights.data = binary_weights
-        weights.requires_grad_(False)
+    """
+    Convolution with frozen random ternary weights.  Only the seed and sparsity are stored in the state dict and the
+    weights are regenerated from them on load.  Checkpoints that still contain the weights load them as they are.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size=3, sparsity=0.5, groups=1, seed=None):
+        super().__init__(in_channels, out_channels, kernel_size, padding=1, bias=False, dilation=1, groups=groups)
+        self.sparsity = sparsity
+        self.seed = int(torch.randint(0, 2 ** 62, (1,)).item()) if seed is None else seed
+        self.weight.data = lbp_weights(self.weight.shape, self.sparsity, self.seed)
+        self.weight.requires_grad_(False)
+        self.mode = 'dense'
+        self._ternary = None
+        self._ternary_key = None
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        # a negative seed marks weights loaded from a checkpoint that stored them explicitly
+        if self.seed < 0:
+            super()._save_to_state_dict(destination, prefix, keep_vars)
+        destination[prefix + 'lbp_seed'] = torch.tensor(self.seed, dtype=torch.long)
+        destination[prefix + 'lbp_sparsity'] = torch.tensor(float(self.sparsity), dtype=torch.float64)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys,
+                              error_msgs):
+        seed_key, sparsity_key, weight_key = prefix + 'lbp_seed', prefix + 'lbp_sparsity', prefix + 'weight'
+        if weight_key in state_dict:
+            super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys,
+                                          error_msgs)
+            self.seed = -1
+        elif seed_key in state_dict:
+            self.seed = int(state_dict[seed_key])
+            self.sparsity = float(state_dict[sparsity_key])
+            with torch.no_grad():
+                self.weight.copy_(lbp_weights(self.weight.shape, self.sparsity, self.seed))
+        elif strict:
+            missing_keys.append(weight_key)
+
+        for key in (seed_key, sparsity_key):
+            if key in unexpected_keys:
+                unexpected_keys.remove(key)
+
+    def set_mode(self, mode):
+        """
+        'dense' runs the frozen weights through a regular convolution, 'sparse' multiplies the unfolded input with the
+        ternary weights stored as a sparse matrix so only the non zero taps are computed.
+        """
+        if mode not in LBP_MODES:
+            raise ValueError(f'LBP mode must be one of {LBP_MODES}.  You entered {mode}.')
+        self.mode = mode
+        self._ternary = None
+        self._ternary_key = None
+
+    def packed_weight(self):
+        '''The frozen {-1, 0, 1} weights as int8, a quarter of the float32 size'''
+        return self.weight.detach().to(torch.int8)
+
+    def ternary_matrix(self):
+        '''Sparse (out_channels, in_channels * k * k) matrix of the non zero weights, rebuilt if the weights change'''
+        key = (self.weight.data_ptr(), self.weight._version, self.weight.device, self.weight.dtype)
+        if self._ternary is None or self._ternary_key != key:
+            matrix = self.packed_weight().reshape(self.out_channels, -1).to_sparse().coalesce()
+            self._ternary = torch.sparse_coo_tensor(matrix.indices(), matrix.values().to(self.weight.dtype),
+                                                    matrix.shape).coalesce()
+            self._ternary_key = key
+        return self._ternary
+
+    @torch.jit.unused
+    def _sparse_forward(self, x):
+        b, _, h, w = x.shape
+        out_h = (h + 2 * self.padding[0] - self.dilation[0] * (self.kernel_size[0] - 1) - 1) // self.stride[0] + 1
+        out_w = (w + 2 * self.padding[1] - self.dilation[1] * (self.kernel_size[1] - 1) - 1) // self.stride[1] + 1
+
+        cols = F.unfold(x, self.kernel_size, dilation=self.dilation, padding=self.padding, stride=self.stride)
+        cols = cols.transpose(0, 1).reshape(cols.shape[1], -1)
+        out = torch.sparse.mm(self.ternary_matrix(), cols)
+        return out.reshape(self.out_channels, b, out_h, out_w).transpose(0, 1)
+
+    def forward(self, x):
+        if self.mode == 'sparse' and self.groups == 1:
+            return self._sparse_forward(x)
+        return F.conv2d(x, self.weight, self.bias, self.stride, self.padding, self.dilation, self.groups)
+
+
+def set_lbp_mode(net, mode):
+    '''Switch every ConvLBP of `net` to the given mode'''
+    for module in net.modules():
+        if isinstance(module, ConvLBP):
+            module.set_mode(mode)
+    return net
 
 
 class BlockLBP(nn.Module):
@@ -28,7 +121,7 @@ class BlockLBP(nn.Module):
         x = self.batch_norm(x)
         x = F.relu(self.conv_lbp(x))
         x = self.conv_1x1(x)
-        x.add_(res)
+        x = x + res
         return x
 
 
@@ -44,7 +137,7 @@ class BlockLBPUNet(nn.Module):
         res = x
         x = self.batch_norm(x)
         x = F.relu(self.conv_lbp(x))
-        x.add_(res)
+        x = x + res
         x = self.conv_1x1(x)
         return x
 
@@ -0,0 +1,62 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import torch
+
+from src.compat import inference_mode, is_inference_mode_enabled
+
+_pool = None
+_pool_size = min(4, os.cpu_count() or 1)
+_local = threading.local()
+
+
+def set_branch_workers(workers):
+    '''Number of threads independent branches may run on besides the calling thread'''
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+    _pool_size = workers
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix='branch')
+    return _pool
+
+
+def _call(fn, grad_enabled, inference):
+    # grad and inference mode are thread local, the worker runs the branch in the mode of the caller
+    _local.in_branch = True
+    try:
+        with inference_mode() if inference else nullcontext(), torch.autograd.set_grad_enabled(grad_enabled):
+            return fn()
+    finally:
+        _local.in_branch = False
+
+
+def run_branches(branches):
+    """
+    Call the independent zero argument callables `branches` concurrently and return their results in order.  The first
+    runs on the calling thread and the rest on a shared thread pool; torch ops release the GIL, so on a multi core CPU
+    the branches overlap.  Branches nested inside a branch run sequentially so the pool cannot deadlock on itself.
+    """
+    if len(branches) < 2 or _pool_size < 1 or getattr(_local, 'in_branch', False):
+        return [branch() for branch in branches]
+
+    grad_enabled = torch.is_grad_enabled()
+    inference = is_inference_mode_enabled()
+    futures = [_get_pool().submit(_call, branch, grad_enabled, inference) for branch in branches[1:]]
+    first = branches[0]()
+    return [first] + [future.result() for future in futures]
+
+
+def set_parallel_branches(net, enabled=True):
+    '''Switch concurrent branch execution on or off for every block of `net` that supports it'''
+    for module in net.modules():
+        if hasattr(module, 'parallel_branches'):
+            module.parallel_branches = enabled
+    return net
@@ -0,0 +1,38 @@
+from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large, lraspp_mobilenet_v3_large
+
+from src.models.dsc.dsc_lbc_unet import DSCUNetLBP, DSCSmallUNetLBP
+from src.models.dsc.dsc_unet import UNetDSC, SmallUNetDSC
+from src.models.lbcnn.axial_lbcnn import AxialUNetLBC, SmallAxialUNetLBC
+from src.models.lbcnn.axial_unet import AxialUNet, SmallAxialUNet
+from src.models.lbcnn.lbc_unet import UNetLBP, SmallUNetLBP
+from src.models.unet.unet_model import UNet, SmallUNet
+
+MODELS = {
+    'unet': lambda n_channels, n_classes: UNet(n_channels=n_channels, n_classes=n_classes, bilinear=True),
+    'small_unet': lambda n_channels, n_classes: SmallUNet(n_channels=n_channels, n_classes=n_classes, bilinear=True),
+    'axial_unet': lambda n_channels, n_classes: AxialUNet(n_channels, n_classes, 64),
+    'small_axial_unet': lambda n_channels, n_classes: SmallAxialUNet(n_channels, n_classes, 64),
+    'lbc_unet': lambda n_channels, n_classes: UNetLBP(n_channels, n_classes),
+    'small_lbc_unet': lambda n_channels, n_classes: SmallUNetLBP(n_channels, n_classes),
+    'axial_lbc_unet': lambda n_channels, n_classes: AxialUNetLBC(n_channels, n_classes, 32),
+    'small_axial_lbc_unet': lambda n_channels, n_classes: SmallAxialUNetLBC(n_channels, n_classes, 32),
+    'small_axial_lbc_unet_10': lambda n_channels, n_classes: SmallAxialUNetLBC(n_channels, n_classes, 10),
+    'deeplab_mobile_net': lambda n_channels, n_classes: deeplabv3_mobilenet_v3_large(num_classes=n_classes),
+    'lraspp_mobile_net': lambda n_channels, n_classes: lraspp_mobilenet_v3_large(num_classes=n_classes),
+    'dsc_unet': lambda n_channels, n_classes: UNetDSC(n_channels=n_channels, n_classes=n_classes, bilinear=True),
+    'small_dsc_unet': lambda n_channels, n_classes: SmallUNetDSC(n_channels=n_channels, n_classes=n_classes,
+                                                                 bilinear=True),
+    'dsc_lbc_unet': lambda n_channels, n_classes: DSCUNetLBP(n_channels, n_classes),
+    'small_dsc_lbc_unet': lambda n_channels, n_classes: DSCSmallUNetLBP(n_channels, n_classes),
+}
+
+
+def get_model(name, n_channels=3, n_classes=3):
+    if name not in MODELS:
+        raise ValueError(f'Please enter a valid model name, one of {", ".join(MODELS)}.  You entered {name}.')
+    return MODELS[name](n_channels, n_classes)
+
+
+def model_logits(out):
+    '''torchvision segmentation models return a dict of outputs, ours return the logits'''
+    return out['out'] if isinstance(out, dict) else out
@@ -13,6 +13,7 @@ from torch import optim
 from tqdm import tqdm
 from src.eval.eval_pga import eval_net
 from src.models.basic_pga.basic_pga_net import BasicAxialPGA
+from src.models.basic_pga.basic_pga_parts import set_pga_routing
 from src.datasets.ice import IceWithProposals
 from torch.utils.data import DataLoader
 import wandb
@@ -37,17 +38,27 @@ def get_args():
                         help='Downscaling factor of the images')
     parser.add_argument('-c', '--crop', dest='crop', type=int, default=220,
                         help='Height and width of images and masks.')
+    parser.add_argument('-i', '--instances', dest='instances', action='store_true',
+                        help='Attend within single proposal instances (build_proposal_masks.py --instances artifacts).')
+    parser.add_argument('--instance-len', dest='instance_len', type=int, default=64,
+                        help='Length of the attention sequences drawn inside an instance.')
+    parser.add_argument('-g', '--generate', dest='generate', action='store_true',
+                        help='Build proposals from every image in the data loader instead of loading DeepMask ones.')
 
     return parser.parse_args()
 
 
-def train_net(net, data_dir, device, epochs=20, batch_size=1, lr=0.0001, save_cp=True, img_scale=0.35, img_crop=320):
+def train_net(net, data_dir, device, epochs=20, batch_size=1, lr=0.0001, save_cp=True, img_scale=0.35, img_crop=320,
+              instances=False, instance_len=64, generate=False):
+    prop_dir = os.path.join(data_dir, 'proposals/instances_250_16' if instances else 'proposals/binary_250_16')
     train_set = IceWithProposals(os.path.join(data_dir, 'imgs'), os.path.join(data_dir, 'masks'),
-                    os.path.join(data_dir, 'txt_files'), os.path.join(data_dir, 'proposals/binary_250_16'),
-                                 'train', img_scale, img_crop)
+                    os.path.join(data_dir, 'txt_files'), prop_dir,
+                                 'train', img_scale, img_crop, instances=instances, instance_len=instance_len,
+                                 generate=generate)
     val_set = IceWithProposals(os.path.join(data_dir, 'imgs'), os.path.join(data_dir, 'masks'),
-                  os.path.join(data_dir, 'txt_files'), os.path.join(data_dir, 'proposals/binary_250_16'),
-                               'val', img_scale, img_crop)
+                  os.path.join(data_dir, 'txt_files'), prop_dir,
+                               'val', img_scale, img_crop, instances=instances, instance_len=instance_len,
+                               generate=generate)
 
     train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
     val_loader = DataLoader(val_set, batch_size=batch_size)
@@ -66,9 +77,7 @@ def train_net(net, data_dir, device, epochs=20, batch_size=1, lr=0.0001, save_cp
 
                 imgs = batch['image']
                 true_masks = batch['mask']
-                obj_dict, bg_dict = batch['obj_dict'], batch['bg_dict']
-                obj_dict = {k: v.item() for k, v in obj_dict.items()}
-                bg_dict = {k: v.item() for k, v in bg_dict.items()}
+                obj_index, bg_index = batch['obj_index'], batch['bg_index']
 
                 assert imgs.shape[1] == net.channels, \
                     f'Network has been defined with {net.channels} input channels, ' \
@@ -78,7 +87,7 @@ def train_net(net, data_dir, device, epochs=20, batch_size=1, lr=0.0001, save_cp
                 imgs = imgs.to(device=device, dtype=torch.float32)
                 target = true_masks.to(device=device, dtype=torch.long)
 
-                masks_pred = net(imgs, obj_dict, bg_dict)
+                masks_pred = net(imgs, obj_index.to(device=device), bg_index.to(device=device))
                 probs = F.softmax(masks_pred, dim=1)
                 argmx = torch.argmax(probs, dim=1).to(dtype=torch.float32)
 
@@ -129,6 +138,8 @@ if __name__ == '__main__':
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     net = BasicAxialPGA(3, 3, 10, img_crop=args.crop)
     # net = OnlyPGA(3, 3, 10, img_crop=args.crop)
+    if args.instances:
+        set_pga_routing(net, 'instance', args.instance_len)
     wandb.watch(net)
 
     if args.load:
@@ -139,7 +150,8 @@ if __name__ == '__main__':
     try:
         train_net(net=net, data_dir=args.data_dir, epochs=args.epochs, batch_size=args.batchsize, lr=args.lr,
                   device=device,
-                  img_scale=args.scale, img_crop=args.crop)
+                  img_scale=args.scale, img_crop=args.crop, instances=args.instances, instance_len=args.instance_len,
+                  generate=args.generate)
     except KeyboardInterrupt:
         torch.save(net.state_dict(), '../INTERRUPTED.pth')
         try:
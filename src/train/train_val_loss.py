@@ -3,13 +3,8 @@ import sys
 
 import time
 
-from src.models.dsc.dsc_lbc_unet import DSCUNetLBP, DSCSmallUNetLBP
-from src.models.dsc.dsc_unet import UNetDSC, SmallUNetDSC
-from src.models.lbcnn.axial_lbcnn import AxialUNetLBC, SmallAxialUNetLBC
-from src.models.lbcnn.axial_unet import AxialUNet, SmallAxialUNet
-from src.models.lbcnn.lbc_unet import UNetLBP, SmallUNetLBP
-from src.models.unet.unet_model import UNet, SmallUNet
-from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large, lraspp_mobilenet_v3_large
+from src.models.axial_attention.axial_attention import ATTENTION_BACKENDS, set_attention_backend
+from src.models.registry import get_model
 
 currentdir = os.path.dirname(os.path.realpath(__file__))
 parentdir = os.path.dirname(currentdir)
@@ -23,6 +18,7 @@ from torch import optim
 from tqdm import tqdm
 from src.eval.eval_curves import eval_net
 from src.eval.eval_mobilenet import eval_net as eval_net_mobile
+from src.eval.parallel import ShardedEvaluator
 from src.datasets.ice import Ice
 from torch.utils.data import DataLoader
 # import wandb
@@ -56,22 +52,40 @@ def get_args():
                         help='Train on gpu vs cpu.')
     parser.add_argument('-file', '--file_number', dest='file_number', type=str, default='0',
                         help='Suffix number of output file.')
+    parser.add_argument('-vw', '--val-workers', dest='val_workers', type=int, default=0,
+                        help='Number of CPU processes to shard validation over, 0 validates in the training process.')
+    parser.add_argument('-av', '--async-val', dest='async_val', action='store_true',
+                        help='Validate weight snapshots in the background while training continues.')
+    parser.add_argument('-cl', '--channels-last', dest='channels_last', action='store_true',
+                        help='Run the model and its inputs in channels last memory format.')
+    parser.add_argument('-a', '--attention', dest='attention', type=str, default='softmax',
+                        choices=list(ATTENTION_BACKENDS), help='Attention kernel of the axial and PGA blocks.')
 
     return parser.parse_args()
 
 
 def train_net(net, data_dir, device, name, epochs=20, batch_size=1, lr=0.0001, save_cp=True, img_scale=0.35,
-              img_crop=320):
+              img_crop=320, val_workers=0, async_val=False, channels_last=False):
     accs, ious, losses = [], [], []
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+    def record(val_loss, val_iou, val_acc):
+        accs.append(val_acc.item())
+        ious.append(val_iou.item())
+        losses.append(val_loss)
 
     train_set = Ice(os.path.join(data_dir, 'imgs'), os.path.join(data_dir, 'masks'),
-                    os.path.join(data_dir, 'txt_files'), 'train', img_scale, img_crop)
+                    os.path.join(data_dir, 'txt_files'), 'train', img_scale, img_crop, channels_last)
     val_set = Ice(os.path.join(data_dir, 'imgs'), os.path.join(data_dir, 'masks'),
-                  os.path.join(data_dir, 'txt_files'), 'val', img_scale, img_crop)
+                  os.path.join(data_dir, 'txt_files'), 'val', img_scale, img_crop, channels_last)
 
     train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
     val_loader = DataLoader(val_set, batch_size=batch_size)
 
+    evaluator = None
+    if val_workers > 0 or async_val:
+        evaluator = ShardedEvaluator(net, val_set, 3, workers=max(val_workers, 1), batch_size=batch_size)
+
     global_step = 0
 
     optimizer = optim.RMSprop(net.parameters(), lr=lr, weight_decay=1e-8, momentum=0.9)
@@ -85,7 +99,7 @@ def train_net(net, data_dir, device, name, epochs=20, batch_size=1, lr=0.0001, s
                 imgs = batch['image']
                 true_masks = batch['mask']
 
-                imgs = imgs.to(device=device, dtype=torch.float32)
+                imgs = imgs.to(device=device, dtype=torch.float32, memory_format=memory_format)
                 target = true_masks.to(device=device, dtype=torch.long)
 
                 if 'mobile' in args.model:
@@ -112,14 +126,18 @@ def train_net(net, data_dir, device, name, epochs=20, batch_size=1, lr=0.0001, s
                 else:
                     n = 1
                 if global_step % (len(train_set) // (n * batch_size)) == 0:
-                    if 'mobile' in name:
-                        val_loss, val_iou, val_acc = eval_net_mobile(net, val_loader, device)
+                    if evaluator is not None and async_val:
+                        evaluator.submit(net, tag=global_step, block=False)
+                    elif evaluator is not None:
+                        record(*evaluator.submit(net))
+                    elif 'mobile' in name:
+                        record(*eval_net_mobile(net, val_loader, device, memory_format))
                     else:
-                        val_loss, val_iou, val_acc = eval_net(net, val_loader, device)
-                    accs.append(val_acc.item())
-                    ious.append(val_iou.item())
-                    losses.append(val_loss)
+                        record(*eval_net(net, val_loader, device, memory_format))
                     # scheduler.step(val_loss)
+                if evaluator is not None:
+                    for _, val_loss, val_iou, val_acc in evaluator.poll():
+                        record(val_loss, val_iou, val_acc)
 
         if save_cp:
             try:
@@ -128,6 +146,11 @@ def train_net(net, data_dir, device, name, epochs=20, batch_size=1, lr=0.0001, s
                 pass
             torch.save(net.state_dict(),
                        '../checkpoints/' + f'epoch{epoch + 1}.pth')
+
+    if evaluator is not None:
+        for _, val_loss, val_iou, val_acc in evaluator.wait():
+            record(val_loss, val_iou, val_acc)
+        evaluator.close()
     return accs, ious, losses
 
 
@@ -135,38 +158,7 @@ if __name__ == '__main__':
     args = get_args()
     device = args.device
 
-    if args.model == 'unet':
-        net = UNet(n_channels=3, n_classes=3, bilinear=True)
-    elif args.model == 'small_unet':
-        net = SmallUNet(n_channels=3, n_classes=3, bilinear=True)
-    elif args.model == 'axial_unet':
-        net = AxialUNet(3, 3, 64)
-    elif args.model == 'small_axial_unet':
-        net = SmallAxialUNet(3, 3, 64)
-    elif args.model == 'lbc_unet':
-        net = UNetLBP(3, 3)
-    elif args.model == 'small_lbc_unet':
-        net = SmallUNetLBP(3, 3)
-    elif args.model == 'axial_lbc_unet':
-        net = AxialUNetLBC(3, 3, 32)
-    elif args.model == 'small_axial_lbc_unet':
-        net = SmallAxialUNetLBC(3, 3, 32)
-    elif args.model == 'small_axial_lbc_unet_10':
-        net = SmallAxialUNetLBC(3, 3, 10)
-    elif args.model == 'deeplab_mobile_net':
-        net = deeplabv3_mobilenet_v3_large(num_classes=3)
-    elif args.model == 'lraspp_mobile_net':
-        net = lraspp_mobilenet_v3_large(num_classes=3)
-    elif args.model == 'dsc_unet':
-        net = UNetDSC(n_channels=3, n_classes=3, bilinear=True)
-    elif args.model == 'small_dsc_unet':
-        net = SmallUNetDSC(n_channels=3, n_classes=3, bilinear=True)
-    elif args.model == 'dsc_lbc_unet':
-        net = DSCUNetLBP(3, 3)
-    elif args.model == 'small_dsc_lbc_unet':
-        net = DSCSmallUNetLBP(3, 3)
-    else:
-        raise ValueError('Please enter a valid model name.')
+    net = set_attention_backend(get_model(args.model), args.attention)
 
     log.info(f'Training {args.model}.')
     # wandb.watch(net)
@@ -175,11 +167,15 @@ if __name__ == '__main__':
         net.load_state_dict(torch.load(args.load, map_location=device))
 
     net.to(device=device)
+    if args.channels_last:
+        net.to(memory_format=torch.channels_last)
 
     try:
         accs, ious, losses = train_net(net=net, data_dir=args.data_dir, epochs=args.epochs, batch_size=args.batchsize,
                                        lr=args.lr, device=device, img_scale=args.scale, img_crop=args.crop,
-                                       name=args.model)
+                                       name=args.model, val_workers=args.val_workers, async_val=args.async_val,
+                                       channels_last=args.channels_last)
+        curve_key = args.model if args.attention == 'softmax' else f'{args.model}_{args.attention}'
         curve_dict = {'loss': losses,
                       'iou': ious,
                       'acc': accs}
@@ -187,11 +183,11 @@ if __name__ == '__main__':
         if os.path.exists(f'model_curves.json'):
             with open(f'model_curves.json') as f:
                 data = json.load(f)
-            data[args.model] = curve_dict
+            data[curve_key] = curve_dict
             with open(f'model_curves.json', 'w') as outfile:
                 json.dump(data, outfile)
         else:
-            data = {args.model: curve_dict}
+            data = {curve_key: curve_dict}
             with open(f'model_curves.json', 'w') as outfile:
                 json.dump(data, outfile)
 